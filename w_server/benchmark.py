@@ -0,0 +1,215 @@
+# w_server/benchmark.py
+
+import json
+import statistics
+import time
+from io import StringIO
+from pathlib import Path
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from washint_server.urls import api_url_patterns
+from .cache import album_payloads, artist_pages, artist_payloads, song_payloads, user_cache
+from .models import User, Artist, Album, Song, Playlist, Follow
+
+BASELINE_PATH = Path(__file__).with_name('benchmark_baseline.json')
+
+# Small enough for the test suite, skewed enough to expose N+1s.
+SEED_OPTIONS = {
+    'seed': 1,
+    'users': 200,
+    'artists': 20,
+    'albums': 40,
+    'songs': 1000,
+    'playlists': 100,
+}
+
+# Regressions beyond these fail the run. Latency is compared on p95 and must
+# exceed both the relative and the absolute margin, to ride out noise.
+DEFAULT_THRESHOLDS = {
+    'queries': 0,
+    'bytes_ratio': 0.10,
+    'latency_ratio': 0.50,
+    'latency_ms': 10.0,
+}
+
+
+def seed():
+    """
+    Seeds the benchmark catalog and returns the objects the endpoint URLs
+    are built from.
+    """
+    call_command('seed_catalog', stdout=StringIO(), **SEED_OPTIONS)
+
+    # The first seeded user manages the most prolific artist; make it staff
+    # so admin-only endpoints are measured too.
+    artist = Artist.objects.select_related('managed_by').order_by('name').first()
+    user = artist.managed_by
+    User.objects.filter(pk=user.pk).update(is_staff=True)
+    user.refresh_from_db()
+    other = User.objects.exclude(pk=user.pk).order_by('username').first()
+    follow, _ = Follow.objects.get_or_create(follower=user, following=other)
+
+    album = Album.objects.filter(artist=artist).order_by('title').first()
+    return {
+        'user': user,
+        'other': other,
+        'artist': artist,
+        'album': album,
+        'album_song': Song.objects.filter(album=album).order_by('title').first(),
+        'artist_song': Song.objects.filter(artist=artist).order_by('-play_count').first(),
+        'song': Song.objects.order_by('-play_count').first(),
+        'playlist': Playlist.objects.filter(is_public=True).order_by('-songs_count').first(),
+        'follow': follow,
+    }
+
+
+def endpoint_cases(objects):
+    """
+    One (name, url) pair for every GET route registered on the API routers.
+    """
+    pks = {
+        'user': objects['user'].pk,
+        'profile': objects['user'].profile.pk,
+        'artist': objects['artist'].pk,
+        'public-artist': objects['artist'].pk,
+        'song': objects['song'].pk,
+        'album': objects['album'].pk,
+        'playlist': objects['playlist'].pk,
+        'follow': objects['follow'].pk,
+        'album-songs': objects['album_song'].pk,
+        'artist-songs': objects['artist_song'].pk,
+    }
+    parents = {
+        'playlist_pk': objects['playlist'].pk,
+        'album_pk': objects['album'].pk,
+        'artist_pk': objects['artist'].pk,
+    }
+    query_params = {
+        'user-check-username': {'username': objects['user'].username},
+        'profile-user-profile': {'username': objects['user'].username},
+        'follow-is-following': {'user_id': objects['other'].pk},
+    }
+
+    cases = []
+    for pattern in api_url_patterns:
+        kwarg_names = list(pattern.pattern.regex.groupindex)
+        actions = getattr(pattern.callback, 'actions', None)
+        if 'format' in kwarg_names or (actions is not None and 'get' not in actions):
+            continue
+        kwargs = {}
+        for name in kwarg_names:
+            if name == 'pk':
+                kwargs[name] = pks[pattern.name.rsplit('-', 1)[0]]
+            else:
+                kwargs[name] = parents[name]
+        cases.append((pattern.name, reverse(pattern.name, kwargs=kwargs), query_params.get(pattern.name, {})))
+    return cases
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def clear_caches():
+    """Empties the shared cache and every in-process tier."""
+    cache.clear()
+    user_cache.clear_local()
+    for payload_cache in (song_payloads, album_payloads, artist_payloads, artist_pages):
+        payload_cache.payloads.clear_local()
+
+
+def run(objects, iterations=20, warmup=1):
+    """
+    Requests every endpoint `warmup + iterations` times as the seeded staff
+    user and returns latency percentiles, query count and response size.
+    `cold_queries` counts one more request made with every cache empty:
+    cached endpoints run no queries once warm, which would hide N+1s in
+    the serializers behind them.
+    """
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(objects['user'])}")
+
+    results = {}
+    for name, url, params in endpoint_cases(objects):
+        timings = []
+        queries = 0
+        size = 0
+        for i in range(warmup + iterations):
+            # The query log is a bounded deque; once full, CaptureQueriesContext
+            # would count zero queries.
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                # A fresh client address per request keeps IP throttles out
+                # of the measurement.
+                response = client.get(url, params, REMOTE_ADDR=f"10.0.{i // 256}.{i % 256}")
+                elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                raise AssertionError(f"{name} ({url}) returned {response.status_code}")
+            if i >= warmup:
+                timings.append(elapsed)
+                queries = max(queries, len(captured))
+                size = max(size, len(response.content))
+
+        clear_caches()
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as captured:
+            client.get(url, params, REMOTE_ADDR='10.1.0.0')
+        results[name] = {
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+            'queries': queries,
+            'cold_queries': len(captured),
+            'bytes': size,
+        }
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    baseline = {
+        'vendor': connection.vendor,
+        'seed_options': SEED_OPTIONS,
+        'thresholds': DEFAULT_THRESHOLDS,
+        'endpoints': results,
+    }
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write('\n')
+
+
+def regressions(results, baseline, check_latency=True):
+    """
+    Compares results against a baseline and returns one message per endpoint
+    metric that regressed beyond the baseline's thresholds.
+    """
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get('thresholds', {})}
+    problems = []
+    for name, result in sorted(results.items()):
+        expected = baseline['endpoints'].get(name)
+        if expected is None:
+            problems.append(f"{name}: no baseline recorded")
+            continue
+        for metric in ('queries', 'cold_queries'):
+            if result[metric] > expected.get(metric, result[metric]) + thresholds['queries']:
+                problems.append(f"{name}: {result[metric]} {metric.replace('_', ' ')}, baseline {expected[metric]}")
+        if result['bytes'] > expected['bytes'] * (1 + thresholds['bytes_ratio']):
+            problems.append(f"{name}: {result['bytes']} bytes, baseline {expected['bytes']}")
+        if check_latency:
+            slower_by = result['p95_ms'] - expected['p95_ms']
+            if slower_by > thresholds['latency_ms'] and result['p95_ms'] > expected['p95_ms'] * (1 + thresholds['latency_ratio']):
+                problems.append(f"{name}: p95 {result['p95_ms']}ms, baseline {expected['p95_ms']}ms")
+    return problems
@@ -0,0 +1,407 @@
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from washint_server.metrics import collect, registry
+
+
+class TwoTierCache:
+    """
+    A small in-process LRU in front of Django's shared cache.
+
+    Local entries only live for `local_timeout` seconds, so a delete made by
+    another process is picked up within that window. Keep it short.
+    """
+
+    def __init__(self, prefix, local_timeout, shared_timeout, max_entries=1024):
+        self.prefix = prefix
+        self.local_timeout = local_timeout
+        self.shared_timeout = shared_timeout
+        self.max_entries = max_entries
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return value
+
+    def _set_local(self, key, value):
+        if self.local_timeout <= 0:
+            return
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.local_timeout, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        key = self.make_key(key)
+        value = self._get_local(key)
+        if value is not None:
+            registry.inc('washint_cache_requests_total', {'cache': self.prefix, 'result': 'local_hit'})
+            return value
+        value = cache.get(key)
+        if value is not None:
+            self._set_local(key, value)
+        registry.inc('washint_cache_requests_total', {
+            'cache': self.prefix, 'result': 'miss' if value is None else 'shared_hit',
+        })
+        return value
+
+    def get_many(self, keys):
+        """Found entries by key, with one shared-cache round trip for local misses."""
+        found = {}
+        remote = {}
+        for key in keys:
+            value = self._get_local(self.make_key(key))
+            if value is None:
+                remote[self.make_key(key)] = key
+            else:
+                found[key] = value
+        shared = cache.get_many(list(remote)) if remote else {}
+        for full_key, value in shared.items():
+            self._set_local(full_key, value)
+            found[remote[full_key]] = value
+        for result, count in (('local_hit', len(keys) - len(remote)), ('shared_hit', len(shared)),
+                              ('miss', len(remote) - len(shared))):
+            if count:
+                registry.inc('washint_cache_requests_total', {'cache': self.prefix, 'result': result}, count)
+        return found
+
+    def set(self, key, value):
+        key = self.make_key(key)
+        cache.set(key, value, self.shared_timeout)
+        self._set_local(key, value)
+
+    def set_many(self, values):
+        values = {self.make_key(key): value for key, value in values.items()}
+        cache.set_many(values, self.shared_timeout)
+        for key, value in values.items():
+            self._set_local(key, value)
+
+    def delete(self, key):
+        key = self.make_key(key)
+        cache.delete(key)
+        with self._lock:
+            self._local.pop(key, None)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+
+def _lock_key(name):
+    return f"single-flight:{name}"
+
+
+def single_flight(name, compute, read, stale=None):
+    """
+    Recomputes an expired value in one worker at a time. The first caller
+    takes a lock in the shared cache and runs `compute()`; the others get
+    `stale` if there is one, or poll `read()` for up to
+    SINGLE_FLIGHT_WAIT_TIMEOUT seconds before computing it themselves.
+    """
+    lock = _lock_key(name)
+    if cache.add(lock, 1, settings.SINGLE_FLIGHT_LOCK_TIMEOUT):
+        registry.inc('washint_single_flight_total', {'result': 'computed'})
+        try:
+            return compute()
+        finally:
+            cache.delete(lock)
+    if stale is not None:
+        registry.inc('washint_single_flight_total', {'result': 'stale'})
+        return stale
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+        value = read()
+        if value is not None:
+            registry.inc('washint_single_flight_total', {'result': 'waited'})
+            return value
+    # The lock holder is slow or died; better a duplicate query than an error.
+    registry.inc('washint_single_flight_total', {'result': 'timed_out'})
+    return compute()
+
+
+async def asingle_flight(name, compute, read, stale=None):
+    """single_flight for async views; `compute` and `read` are coroutine functions."""
+    lock = _lock_key(name)
+    if await cache.aadd(lock, 1, settings.SINGLE_FLIGHT_LOCK_TIMEOUT):
+        registry.inc('washint_single_flight_total', {'result': 'computed'})
+        try:
+            return await compute()
+        finally:
+            await cache.adelete(lock)
+    if stale is not None:
+        registry.inc('washint_single_flight_total', {'result': 'stale'})
+        return stale
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+        value = await read()
+        if value is not None:
+            registry.inc('washint_single_flight_total', {'result': 'waited'})
+            return value
+    registry.inc('washint_single_flight_total', {'result': 'timed_out'})
+    return await compute()
+
+
+class StaleWhileRevalidateCache:
+    """
+    Shared-cache entries that turn stale after `fresh_timeout` seconds but
+    are kept for `stale_timeout` more, so while one worker recomputes an
+    expired entry the others keep serving the old one.
+    """
+
+    def __init__(self, prefix, fresh_timeout, stale_timeout):
+        self.prefix = prefix
+        self.fresh_timeout = fresh_timeout
+        self.timeout = fresh_timeout + stale_timeout
+
+    def make_key(self, key):
+        # Hashed, since keys such as search queries may hold any character.
+        return f"{self.prefix}:{hashlib.sha1(key.encode()).hexdigest()}"
+
+    def _fresh_value(self, entry):
+        if entry is not None and entry['fresh_until'] > time.time():
+            return entry['value']
+        return None
+
+    def _entry(self, value):
+        return {'value': value, 'fresh_until': time.time() + self.fresh_timeout}
+
+    def _count(self, entry):
+        result = 'miss' if entry is None else ('stale' if self._fresh_value(entry) is None else 'shared_hit')
+        registry.inc('washint_cache_requests_total', {'cache': self.prefix, 'result': result})
+
+    def get_or_set(self, key, compute):
+        key = self.make_key(key)
+        entry = cache.get(key)
+        self._count(entry)
+        value = self._fresh_value(entry)
+        if value is not None:
+            return value
+
+        def recompute():
+            value = compute()
+            cache.set(key, self._entry(value), self.timeout)
+            return value
+
+        return single_flight(
+            key, recompute,
+            read=lambda: self._fresh_value(cache.get(key)),
+            stale=None if entry is None else entry['value'],
+        )
+
+    async def aget_or_set(self, key, compute):
+        """get_or_set for async views; `compute` is a coroutine function."""
+        key = self.make_key(key)
+        entry = await cache.aget(key)
+        self._count(entry)
+        value = self._fresh_value(entry)
+        if value is not None:
+            return value
+
+        async def recompute():
+            value = await compute()
+            await cache.aset(key, self._entry(value), self.timeout)
+            return value
+
+        async def read():
+            return self._fresh_value(await cache.aget(key))
+
+        return await asingle_flight(key, recompute, read, stale=None if entry is None else entry['value'])
+
+
+class VersionedCache:
+    """
+    Serialized payloads of one kind of object in a TwoTierCache, keyed by the
+    object's id plus its current version. The version lives in the shared
+    cache only, so bump() invalidates every process at once; payloads stored
+    under older versions are simply never read again.
+
+    Versions are random and expire with the payloads, so a lost or expired
+    version only ever causes a miss.
+    """
+
+    def __init__(self, kind, local_timeout, shared_timeout, max_entries=1024):
+        self.kind = kind
+        self.shared_timeout = shared_timeout
+        self.payloads = TwoTierCache(f'{kind}-payload', local_timeout, shared_timeout, max_entries)
+
+    def version_key(self, pk):
+        return f"{self.kind}-version:{pk}"
+
+    def latest_key(self, pk):
+        return f"{self.kind}-latest:{pk}"
+
+    def version(self, pk):
+        key = self.version_key(pk)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, self.shared_timeout)
+            version = cache.get(key)
+        return version
+
+    def get(self, pk, version):
+        return self.payloads.get(f"{pk}:{version}")
+
+    def set(self, pk, version, payload):
+        self.payloads.set(f"{pk}:{version}", payload)
+        # Whatever version it was built for, the newest payload is what other
+        # workers serve while the next one is being built.
+        cache.set(self.latest_key(pk), payload, self.shared_timeout)
+
+    def get_many(self, pks):
+        """
+        The current version of every object and the payloads cached under
+        them. Two round trips to the shared cache when every version exists,
+        two more (whatever the id count) to create the missing ones.
+        """
+        keys = {self.version_key(pk): pk for pk in pks}
+        versions = {keys[key]: version for key, version in cache.get_many(list(keys)).items()}
+        missing = {self.version_key(pk): uuid.uuid4().hex for pk in pks if pk not in versions}
+        if missing:
+            # There is no add_many: overwriting a version another worker just
+            # created only costs misses, since a fresh version has no payloads.
+            # Re-read so concurrent creators settle on the same version.
+            cache.set_many(missing, self.shared_timeout)
+            stored = cache.get_many(list(missing))
+            for key, version in missing.items():
+                versions[keys[key]] = stored.get(key, version)
+        payloads = self.payloads.get_many([f"{pk}:{version}" for pk, version in versions.items()])
+        found = {}
+        for pk, version in versions.items():
+            payload = payloads.get(f"{pk}:{version}")
+            if payload is not None:
+                found[pk] = payload
+        return versions, found
+
+    def set_many(self, versions, payloads):
+        """Stores payloads built for the versions returned by get_many()."""
+        self.payloads.set_many({f"{pk}:{versions[pk]}": payload for pk, payload in payloads.items()})
+        cache.set_many({self.latest_key(pk): payload for pk, payload in payloads.items()}, self.shared_timeout)
+
+    def get_or_set(self, pk, compute):
+        # The version is read before compute() reads the object, so a
+        # concurrent save leaves this payload under a version nobody asks
+        # for again.
+        version = self.version(pk)
+        payload = self.get(pk, version)
+        if payload is not None:
+            return payload
+
+        def recompute():
+            payload = compute()
+            self.set(pk, version, payload)
+            return payload
+
+        return single_flight(
+            f"{self.kind}:{pk}:{version}", recompute,
+            read=lambda: self.get(pk, version),
+            stale=cache.get(self.latest_key(pk)),
+        )
+
+    def bump(self, pks):
+        keys = [self.version_key(pk) for pk in pks]
+        if not keys:
+            return
+        self._set_new_versions(keys)
+        if transaction.get_connection().in_atomic_block:
+            # Again once the write is visible, in case a reader cached the
+            # old row under the version set above in the meantime.
+            transaction.on_commit(lambda: self._set_new_versions(keys))
+
+    def forget(self, pks):
+        """bump() for deleted objects, whose last payload must not be served stale."""
+        pks = list(pks)
+        self.bump(pks)
+        cache.delete_many([self.latest_key(pk) for pk in pks])
+
+    def _set_new_versions(self, keys):
+        cache.set_many({key: uuid.uuid4().hex for key in keys}, self.shared_timeout)
+
+
+# Detail payloads of SongViewSet, AlbumViewSets and PublicArtistViewSet, and
+# whole artist pages (PublicArtistViewSet.page). Versions are bumped by the
+# signals in models.py.
+song_payloads, album_payloads, artist_payloads, artist_pages = (
+    VersionedCache(
+        kind,
+        local_timeout=getattr(settings, 'OBJECT_CACHE_LOCAL_TIMEOUT', 30),
+        shared_timeout=getattr(settings, 'OBJECT_CACHE_TIMEOUT', 300),
+    )
+    for kind in ('song', 'album', 'artist', 'artist-page')
+)
+
+
+def hit_ratios():
+    """
+    Hit ratio of each tier per cache, summed over all worker processes:
+    the local ratio is local hits over lookups, the shared ratio is shared
+    hits over lookups that missed locally. Stale entries count as misses.
+    """
+    counters, _ = collect()
+    counts = {}
+    for (name, labels), value in counters.items():
+        if name != 'washint_cache_requests_total':
+            continue
+        labels = dict(labels)
+        counts.setdefault(labels['cache'], {})[labels['result']] = value
+
+    ratios = {}
+    for name, results in sorted(counts.items()):
+        local_hits = results.get('local_hit', 0)
+        shared_hits = results.get('shared_hit', 0)
+        misses = results.get('miss', 0) + results.get('stale', 0)
+        lookups = local_hits + shared_hits + misses
+        shared_lookups = shared_hits + misses
+        ratios[name] = {
+            'lookups': lookups,
+            'local_hit_ratio': round(local_hits / lookups, 4) if lookups else None,
+            'shared_hit_ratio': round(shared_hits / shared_lookups, 4) if shared_lookups else None,
+            'hit_ratio': round((local_hits + shared_hits) / lookups, 4) if lookups else None,
+        }
+    return ratios
+
+
+# Results of /api/search/, per normalized query.
+search_results = StaleWhileRevalidateCache(
+    'search',
+    fresh_timeout=getattr(settings, 'SEARCH_CACHE_TIMEOUT', 60),
+    stale_timeout=getattr(settings, 'SEARCH_CACHE_STALE_TIMEOUT', 300),
+)
+
+
+# Users resolved from JWTs. Invalidated by the User signals in models.py.
+user_cache = TwoTierCache(
+    'jwt-user',
+    local_timeout=getattr(settings, 'JWT_USER_LOCAL_CACHE_TIMEOUT', 5),
+    shared_timeout=getattr(settings, 'JWT_USER_CACHE_TIMEOUT', 60),
+)
+
+
+def username_availability_key(username):
+    return f"username-taken:{username.lower()}"
+
+
+def play_event_key(song_id, client):
+    return f"song-played:{song_id}:{client}"
@@ -0,0 +1,93 @@
+import csv
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+
+from washint_server.renderers import dumps
+
+from .models import Artist, Song
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def song_rows(artist_ids=None):
+    """The song catalog with play counts, one row per song."""
+    queryset = Song.objects.order_by('artist_id', 'created_at', 'id')
+    if artist_ids is not None:
+        queryset = queryset.filter(artist_id__in=artist_ids)
+    return queryset.values(
+        'id', 'title', 'artist_id', 'album_id', 'duration_seconds', 'play_count', 'created_at',
+        artist_name=F('artist__name'), album_title=F('album__title'),
+    )
+
+
+def play_stat_rows(artist_ids=None):
+    """Song count and total plays per artist."""
+    queryset = Artist.objects.order_by('name', 'id')
+    if artist_ids is not None:
+        queryset = queryset.filter(id__in=artist_ids)
+    return queryset.values('id', 'name').annotate(
+        songs_count=Count('songs'),
+        total_plays=Coalesce(Sum('songs__play_count'), 0),
+    )
+
+
+EXPORTS = {
+    'songs': (
+        song_rows,
+        ['id', 'title', 'artist_id', 'artist_name', 'album_id', 'album_title',
+         'duration_seconds', 'play_count', 'created_at'],
+    ),
+    'play-stats': (play_stat_rows, ['id', 'name', 'songs_count', 'total_plays']),
+}
+
+
+class _Line:
+    """A file-like object for csv.writer that hands back the line written."""
+
+    def write(self, value):
+        return value
+
+
+def _encoder(file_format, fields):
+    if file_format == 'ndjson':
+        return lambda row: dumps(row) + b'\n'
+    writer = csv.writer(_Line())
+    return lambda row: writer.writerow([_csv_value(row[field]) for field in fields]).encode()
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_header(file_format, fields):
+    return csv.writer(_Line()).writerow(fields).encode() if file_format == 'csv' else None
+
+
+def stream(rows, fields, file_format):
+    """
+    Encodes rows one at a time as NDJSON or CSV lines. Rows are read with
+    `.iterator()`, in chunks of EXPORT_CHUNK_SIZE (server-side cursors on
+    PostgreSQL), so memory stays flat however many rows there are.
+    """
+    header = _csv_header(file_format, fields)
+    if header:
+        yield header
+    encode = _encoder(file_format, fields)
+    for row in rows.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+        yield encode(row)
+
+
+async def astream(rows, fields, file_format):
+    """stream() for ASGI, where StreamingHttpResponse needs an async iterator."""
+    header = _csv_header(file_format, fields)
+    if header:
+        yield header
+    encode = _encoder(file_format, fields)
+    async for row in rows.aiterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+        yield encode(row)
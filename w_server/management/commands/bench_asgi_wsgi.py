@@ -0,0 +1,76 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from w_server import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares concurrent-request throughput of the WSGI and ASGI handlers "
+        "on the async endpoints (is-following, song and album media), against "
+        "a freshly seeded test database. WSGI requests run on a thread pool, "
+        "ASGI requests as concurrent tasks on one event loop; both go through "
+        "the full middleware stack, but not through a real server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and handler.')
+        parser.add_argument('--concurrency', type=int, default=16)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0)
+        old_config = runner.setup_databases()
+        try:
+            objects = benchmark.seed()
+            headers = {'Authorization': f"Bearer {AccessToken.for_user(objects['user'])}"}
+            cases = [
+                ('is-following', reverse('follow-is-following'), {'user_id': objects['other'].pk}),
+                ('song-media', reverse('song-media', kwargs={'pk': objects['song'].pk}), {}),
+                ('album-media', reverse('album-media', kwargs={'pk': objects['album'].pk}), {}),
+            ]
+            self.stdout.write(f"{'endpoint':16} {'wsgi req/s':>12} {'asgi req/s':>12}")
+            for name, url, params in cases:
+                wsgi = self.run_wsgi(url, params, headers, options['requests'], options['concurrency'])
+                asgi = asyncio.run(self.run_asgi(url, params, headers, options['requests'], options['concurrency']))
+                self.stdout.write(f"{name:16} {wsgi:>12.1f} {asgi:>12.1f}")
+        finally:
+            connections.close_all()
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+    def run_wsgi(self, url, params, headers, requests, concurrency):
+        client = Client()
+
+        def request(_):
+            response = client.get(url, params, headers=headers)
+            if response.status_code != 200:
+                raise CommandError(f"WSGI {url} returned {response.status_code}")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            started = time.perf_counter()
+            list(executor.map(request, range(requests)))
+            return requests / (time.perf_counter() - started)
+
+    async def run_asgi(self, url, params, headers, requests, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request():
+            async with semaphore:
+                response = await client.get(url, params, headers=headers)
+            if response.status_code != 200:
+                raise CommandError(f"ASGI {url} returned {response.status_code}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(requests)))
+        return requests / (time.perf_counter() - started)
@@ -0,0 +1,114 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import connection
+
+from washint_server.db_pool import pool_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures simulated requests/sec against the database with the current "
+        "connection settings. Each simulated request runs one query between the "
+        "request_started/request_finished signals, so connections are opened, "
+        "reused or returned to the pool exactly as in a real worker. With "
+        "--compare, runs pooled (PostgreSQL only), persistent and per-request "
+        "connections side by side."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Simulated requests per thread.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of threads.')
+        parser.add_argument('--compare', action='store_true')
+        parser.add_argument('--json', action='store_true', help='Print the result as JSON.')
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            return self.compare(options)
+
+        result = self.run(options['requests'], options['concurrency'])
+        if options['json']:
+            self.stdout.write(json.dumps(result))
+        else:
+            self.write_result(result)
+
+    def run(self, requests, concurrency):
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(requests):
+                    request_started.send(sender=self.__class__)
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                        cursor.fetchone()
+                    request_finished.send(sender=self.__class__)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise CommandError(f"Benchmark failed: {errors[0]!r}")
+
+        return {
+            'pooled': bool(getattr(connection, 'pool', None)),
+            'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+            'requests': requests * concurrency,
+            'seconds': round(elapsed, 3),
+            'requests_per_second': round(requests * concurrency / elapsed, 1),
+            'pool': pool_stats()['default'],
+        }
+
+    def compare(self, options):
+        # Settings are read once per process, so each mode runs in its own.
+        modes = {
+            'pooled': {'DATABASE_POOL': 'True'},
+            'persistent': {'DATABASE_POOL': 'False'},
+            'per-request': {'DATABASE_POOL': 'False', 'DATABASE_CONN_MAX_AGE': '0'},
+        }
+        if connection.vendor != 'postgresql':
+            # Django only pools PostgreSQL connections.
+            del modes['pooled']
+        for name, env in modes.items():
+            output = subprocess.run(
+                [
+                    sys.executable, sys.argv[0], 'bench_db_connections', '--json',
+                    '--requests', str(options['requests']),
+                    '--concurrency', str(options['concurrency']),
+                ],
+                env={**os.environ, **env},
+                capture_output=True,
+                text=True,
+            )
+            if output.returncode != 0:
+                self.stderr.write(f"{name}: failed\n{output.stderr.strip()}")
+                continue
+            self.stdout.write(f"{name}:")
+            self.write_result(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    def write_result(self, result):
+        self.stdout.write(
+            f"  {result['requests']} requests in {result['seconds']}s "
+            f"= {result['requests_per_second']} req/s "
+            f"(pooled={result['pooled']}, conn_max_age={result['conn_max_age']})"
+        )
+        if result['pool'].get('pooled'):
+            pool = result['pool']
+            self.stdout.write(
+                f"  pool: size={pool['size']} waiting={pool['waiting']} "
+                f"queued={pool['requests_queued']} wait_ms={pool['requests_wait_ms']}"
+            )
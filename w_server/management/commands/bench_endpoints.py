@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.test.runner import DiscoverRunner
+
+from w_server import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks every GET API endpoint against a freshly seeded test "
+        "database and reports p50/p95/p99 latency, query counts (warm, and with "
+        "every cache empty) and response size. Exits non-zero when an endpoint "
+        "regresses beyond the thresholds stored with the baseline; "
+        "--update-baseline records a new one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per endpoint.')
+        parser.add_argument('--baseline', default=str(benchmark.BASELINE_PATH))
+        parser.add_argument('--update-baseline', action='store_true')
+        parser.add_argument('--no-latency', action='store_true',
+                            help='Only compare query counts and response sizes.')
+
+    def handle(self, *args, **options):
+        # The seed data goes into the test database, never the configured one.
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0)
+        old_config = runner.setup_databases()
+        try:
+            results = benchmark.run(benchmark.seed(), iterations=options['iterations'])
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'endpoint':32} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'cold':>8} {'bytes':>8}")
+        for name, result in sorted(results.items()):
+            self.stdout.write(
+                f"{name:32} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} "
+                f"{result['queries']:>8} {result['cold_queries']:>8} {result['bytes']:>8}"
+            )
+
+        if options['update_baseline']:
+            benchmark.save_baseline(results, options['baseline'])
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+            return
+
+        problems = benchmark.regressions(
+            results, benchmark.load_baseline(options['baseline']), check_latency=not options['no_latency'],
+        )
+        if problems:
+            raise CommandError("Endpoint regressions:\n" + "\n".join(problems))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
@@ -0,0 +1,74 @@
+import statistics
+import time
+from importlib.util import find_spec
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.renderers import JSONRenderer
+
+from w_server import benchmark
+from w_server.models import Playlist, Song
+from w_server.serializers import PlaylistListSerializer, SongSerializer
+from washint_server.renderers import MessagePackRenderer, ORJSONRenderer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares encode time and size of 100-item song and playlist pages "
+        "under DRF's JSONRenderer, the orjson renderer and, when msgpack is "
+        "installed, the MessagePack renderer. Pages are serialized once from "
+        "a freshly seeded test database; only rendering is timed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        renderers = [('drf-json', JSONRenderer()), ('orjson', ORJSONRenderer())]
+        if find_spec('msgpack'):
+            renderers.append(('msgpack', MessagePackRenderer()))
+        else:
+            self.stderr.write("msgpack is not installed; skipping the MessagePack renderer.")
+
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0)
+        old_config = runner.setup_databases()
+        try:
+            benchmark.seed()
+            pages = self.build_pages(options['page_size'])
+        finally:
+            connections.close_all()
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'page':10} {'renderer':10} {'p50 ms':>9} {'p95 ms':>9} {'bytes':>9}")
+        for page_name, page in pages:
+            for renderer_name, renderer in renderers:
+                timings, size = self.time_renderer(renderer, page, options['iterations'])
+                self.stdout.write(
+                    f"{page_name:10} {renderer_name:10} {statistics.median(timings):>9.3f} "
+                    f"{timings[int(len(timings) * 0.95) - 1]:>9.3f} {size:>9}"
+                )
+
+    def build_pages(self, page_size):
+        songs = Song.objects.select_related('artist__managed_by').prefetch_related('genres')[:page_size]
+        playlists = Playlist.objects.select_related('owner__profile')[:page_size]
+        # Shaped like a paginated response, as MyLimitOffsetPagination returns it.
+        return [
+            ('songs', {'count': page_size, 'next': None, 'previous': None,
+                       'results': SongSerializer(songs, many=True).data}),
+            ('playlists', {'count': page_size, 'next': None, 'previous': None,
+                           'results': PlaylistListSerializer(playlists, many=True).data}),
+        ]
+
+    def time_renderer(self, renderer, page, iterations):
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            body = renderer.render(page, renderer.media_type, {})
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return timings, len(body)
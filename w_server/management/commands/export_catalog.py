@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from w_server import exports
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams the song catalog with play counts (`songs`) or per-artist "
+        "play totals (`play-stats`) as NDJSON or CSV, reading rows in chunks "
+        "of EXPORT_CHUNK_SIZE so memory stays flat for any catalog size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--format', dest='file_format', choices=sorted(exports.FORMATS), default='ndjson')
+        parser.add_argument('--artist-id', action='append', dest='artist_ids',
+                            help='Only export this artist (repeatable). Defaults to every artist.')
+        parser.add_argument('--output', help='File to write to. Defaults to stdout.')
+
+    def handle(self, *args, **options):
+        rows, fields = exports.EXPORTS[options['kind']]
+        lines = exports.stream(rows(options['artist_ids']), fields, options['file_format'])
+
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line.decode(), ending='')
+            return
+
+        try:
+            output = open(options['output'], 'wb')
+        except OSError as exc:
+            raise CommandError(f"Cannot write to {options['output']}: {exc}")
+        count = 0
+        with output:
+            for line in lines:
+                output.write(line)
+                count += 1
+        if options['file_format'] == 'csv':
+            count -= 1
+        self.stderr.write(f"Wrote {count} rows to {options['output']}.")
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from w_server.models import SyncChange
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes sync change-log rows older than SYNC_CHANGE_RETENTION_DAYS, "
+        "and rows left behind by deleted users, in small chunks. Clients whose "
+        "token predates the oldest kept row are told to resync. Meant to run daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.SYNC_CHANGE_RETENTION_DAYS)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        expired = SyncChange.objects.filter(created_at__lt=cutoff)
+        orphaned = SyncChange.objects.exclude(user_id__in=get_user_model().objects.values('pk'))
+
+        purged = self.purge(expired, options['chunk_size']) + self.purge(orphaned, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Pruned {purged} sync changes."))
+
+    def purge(self, queryset, chunk_size):
+        purged = 0
+        while True:
+            ids = list(queryset.order_by().values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return purged
+            SyncChange.objects.filter(id__in=ids).delete()
+            purged += len(ids)
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired outstanding tokens (and their blacklist rows) in small "
+        "chunks, so the purge never holds long locks. Meant to run periodically."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.0,
+            help='Seconds to pause between chunks to spread the load.',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        cutoff = aware_utcnow()
+
+        purged = 0
+        while True:
+            ids = list(
+                OutstandingToken.objects.filter(expires_at__lte=cutoff)
+                .order_by()
+                .values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            OutstandingToken.objects.filter(id__in=ids).delete()
+            purged += len(ids)
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} expired tokens."))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from w_server.models import Playlist
+
+
+class Command(BaseCommand):
+    help = "Recomputes the denormalized songs_count and total_duration_seconds of every playlist."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of playlists recomputed per UPDATE statement.',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        playlist_ids = Playlist.objects.order_by('pk').values_list('pk', flat=True)
+
+        updated = 0
+        chunk = []
+        for playlist_id in playlist_ids.iterator(chunk_size=chunk_size):
+            chunk.append(playlist_id)
+            if len(chunk) >= chunk_size:
+                updated += Playlist.refresh_stats(chunk)
+                chunk = []
+        if chunk:
+            updated += Playlist.refresh_stats(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {updated} playlists."))
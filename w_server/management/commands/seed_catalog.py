@@ -0,0 +1,238 @@
+import bisect
+import itertools
+import random
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from w_server.models import (
+    User, UserProfile, Genre, Artist, Album, Song, SongGenre, Playlist, PlaylistSong, Follow
+)
+
+GENRE_NAMES = [
+    'Tizita', 'Bati', 'Ambassel', 'Anchihoye', 'Ethio-jazz', 'Pop', 'Hip hop', 'Reggae',
+    'Gospel', 'Traditional', 'Guragigna', 'Oromo', 'Tigrigna', 'Afar', 'Instrumental',
+    'R&B', 'Electronic', 'Rock', 'Soul', 'Classical',
+]
+
+
+def zipf_cum_weights(n, exponent):
+    """
+    Cumulative weights for ranks 1..n of a Zipf distribution, sampled from
+    with bisect in Command.pick.
+    """
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a synthetic catalog (users, artists, albums, songs, genres, playlists, "
+        "playlist songs and follows) with Zipfian song popularity and power-law "
+        "follower counts. Rows are inserted with batched bulk_create, and the "
+        "generated data is fully determined by --seed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--artists', type=int, default=100)
+        parser.add_argument('--albums', type=int, default=300)
+        parser.add_argument('--songs', type=int, default=5000)
+        parser.add_argument('--genres', type=int, default=20)
+        parser.add_argument('--playlists', type=int, default=500)
+        parser.add_argument('--songs-per-playlist', type=int, default=25, help='Mean playlist length.')
+        parser.add_argument('--follows-per-user', type=int, default=10, help='Mean follows per user.')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Exponent of the popularity skew.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['artists'] > options['users']:
+            raise CommandError("Every artist is managed by its own user, so --artists cannot exceed --users.")
+        if options['artists'] < 1 or options['songs'] < 1:
+            raise CommandError("--artists and --songs must be at least 1.")
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.zipf = options['zipf']
+        self.prefix = f"seed{options['seed']}_"
+        # The same seed regenerates the same usernames and UUIDs; other seeds
+        # draw their own, so catalogs with different seeds can coexist.
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(
+                f"A catalog with --seed {options['seed']} is already in this database; "
+                "use another --seed or flush the database first."
+            )
+
+        genre_ids = self.seed_genres(options['genres'])
+        user_ids, followers, following = self.seed_users(options['users'], options['follows_per_user'])
+        self.seed_profiles(user_ids, followers, following)
+        artist_ids = self.seed_artists(user_ids[:options['artists']])
+        albums_by_artist = self.seed_albums(artist_ids, options['albums'])
+        song_ids, durations = self.seed_songs(artist_ids, albums_by_artist, genre_ids, options['songs'])
+        self.seed_playlists(user_ids, song_ids, durations, options['playlists'], options['songs_per_playlist'])
+
+    def new_uuid(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def insert(self, model, objects, **kwargs):
+        started = time.perf_counter()
+        count = 0
+        # One transaction per table: far fewer commits than one per batch.
+        with transaction.atomic():
+            for batch in batched(objects, self.batch_size):
+                model.objects.bulk_create(batch, batch_size=self.batch_size, **kwargs)
+                count += len(batch)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{model.__name__}: {count} rows in {elapsed:.1f}s")
+        return count
+
+    def pick(self, cum_weights):
+        # Index drawn from the Zipf weights; index 0 is the most popular.
+        return bisect.bisect(cum_weights, self.rng.random() * cum_weights[-1])
+
+    def seed_genres(self, count):
+        names = [
+            GENRE_NAMES[i] if i < len(GENRE_NAMES) else f"{GENRE_NAMES[i % len(GENRE_NAMES)]} {i // len(GENRE_NAMES)}"
+            for i in range(count)
+        ]
+        # Draw every id even for genres that already exist, so the random
+        # stream (and everything seeded after it) does not depend on them.
+        new_ids = [self.new_uuid() for _ in names]
+        existing = set(Genre.objects.filter(name__in=names).values_list('name', flat=True))
+        self.insert(Genre, (
+            Genre(id=genre_id, name=name) for genre_id, name in zip(new_ids, names) if name not in existing
+        ))
+        by_name = dict(Genre.objects.filter(name__in=names).values_list('name', 'id'))
+        return [by_name[name] for name in names]
+
+    def seed_users(self, count, follows_per_user):
+        user_ids = [self.new_uuid() for _ in range(count)]
+        password = make_password('password')
+        self.insert(User, (
+            User(id=user_id, username=f"{self.prefix}user{i}", password=password,
+                 first_name='Seed', last_name=f"User {i}")
+            for i, user_id in enumerate(user_ids)
+        ))
+
+        # Power-law followers: low-index users are followed far more often.
+        cum_weights = zipf_cum_weights(count, self.zipf)
+        followers = [0] * count
+        following = [0] * count
+
+        def follows():
+            for follower in range(count):
+                wanted = min(int(self.rng.expovariate(1 / follows_per_user)), count - 1) if follows_per_user else 0
+                targets = set()
+                attempts = 0
+                while len(targets) < wanted and attempts < wanted * 10:
+                    attempts += 1
+                    target = self.pick(cum_weights)
+                    if target != follower:
+                        targets.add(target)
+                for target in sorted(targets):
+                    followers[target] += 1
+                    following[follower] += 1
+                    yield Follow(follower_id=user_ids[follower], following_id=user_ids[target])
+
+        self.insert(Follow, follows())
+        return user_ids, followers, following
+
+    def seed_profiles(self, user_ids, followers, following):
+        self.insert(UserProfile, (
+            UserProfile(id=self.new_uuid(), user_id=user_id, display_name=f"Seed User {i}",
+                        followers_count=followers[i], following_count=following[i])
+            for i, user_id in enumerate(user_ids)
+        ))
+
+    def seed_artists(self, manager_ids):
+        artist_ids = [self.new_uuid() for _ in manager_ids]
+        self.insert(Artist, (
+            Artist(id=artist_id, name=f"Seed Artist {i}", managed_by_id=manager_id)
+            for i, (artist_id, manager_id) in enumerate(zip(artist_ids, manager_ids))
+        ))
+        return artist_ids
+
+    def seed_albums(self, artist_ids, count):
+        cum_weights = zipf_cum_weights(len(artist_ids), self.zipf)
+        albums_by_artist = {}
+        albums = []
+        for i in range(count):
+            artist_index = self.pick(cum_weights)
+            album_id = self.new_uuid()
+            albums_by_artist.setdefault(artist_index, []).append(album_id)
+            albums.append(Album(id=album_id, title=f"Album {i}", artist_id=artist_ids[artist_index],
+                                cover_art_upload='images/seed.png'))
+        self.insert(Album, albums)
+        return albums_by_artist
+
+    def seed_songs(self, artist_ids, albums_by_artist, genre_ids, count):
+        artist_weights = zipf_cum_weights(len(artist_ids), self.zipf)
+        genre_weights = zipf_cum_weights(len(genre_ids), self.zipf) if genre_ids else None
+        song_ids = [self.new_uuid() for _ in range(count)]
+        durations = [self.rng.randint(90, 420) for _ in range(count)]
+        # Song i has popularity rank i + 1, so plays follow the same Zipf curve
+        # playlists sample from.
+        max_plays = 10 * count
+
+        def songs():
+            for i, song_id in enumerate(song_ids):
+                artist_index = self.pick(artist_weights)
+                albums = albums_by_artist.get(artist_index)
+                album_id = self.rng.choice(albums) if albums and self.rng.random() < 0.8 else None
+                yield Song(
+                    id=song_id, title=f"Song {i}", artist_id=artist_ids[artist_index], album_id=album_id,
+                    duration_seconds=durations[i], audio_file_url='songs/seed.mp3',
+                    song_cover_upload='images/seed.png', play_count=int(max_plays / (i + 1) ** self.zipf),
+                )
+
+        def song_genres():
+            for song_id in song_ids:
+                picked = {self.pick(genre_weights) for _ in range(self.rng.randint(1, 2))}
+                for genre_index in sorted(picked):
+                    yield SongGenre(song_id=song_id, genre_id=genre_ids[genre_index])
+
+        self.insert(Song, songs())
+        if genre_ids:
+            self.insert(SongGenre, song_genres())
+        return song_ids, durations
+
+    def seed_playlists(self, user_ids, song_ids, durations, count, songs_per_playlist):
+        song_weights = zipf_cum_weights(len(song_ids), self.zipf)
+        playlist_ids = [self.new_uuid() for _ in range(count)]
+        contents = []
+        for _ in playlist_ids:
+            wanted = min(int(self.rng.expovariate(1 / songs_per_playlist)), len(song_ids)) if songs_per_playlist else 0
+            picked = []
+            seen = set()
+            attempts = 0
+            while len(picked) < wanted and attempts < wanted * 10:
+                attempts += 1
+                song_index = self.pick(song_weights)
+                if song_index not in seen:
+                    seen.add(song_index)
+                    picked.append(song_index)
+            contents.append(picked)
+
+        # songs_count/total_duration_seconds are filled in directly, since
+        # bulk inserts bypass the add/remove paths that maintain them.
+        self.insert(Playlist, (
+            Playlist(id=playlist_id, title=f"Playlist {i}", owner_id=self.rng.choice(user_ids),
+                     is_public=self.rng.random() < 0.8, cover_art_upload='images/seed.png',
+                     songs_count=len(contents[i]),
+                     total_duration_seconds=sum(durations[song_index] for song_index in contents[i]))
+            for i, playlist_id in enumerate(playlist_ids)
+        ))
+        self.insert(PlaylistSong, (
+            PlaylistSong(playlist_id=playlist_id, song_id=song_ids[song_index], order=order)
+            for playlist_id, picked in zip(playlist_ids, contents)
+            for order, song_index in enumerate(picked, start=1)
+        ))
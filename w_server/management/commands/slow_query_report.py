@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db.models import ExpressionWrapper, F, FloatField
+
+from w_server.models import SlowQuery
+
+ORDERINGS = {
+    'total': '-total_ms',
+    'calls': '-calls',
+    'max': '-max_ms',
+    'mean': '-mean_ms',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Prints the slowest query shapes recorded by the slow query log, worst "
+        "first, with their captured EXPLAIN plans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--order-by', choices=sorted(ORDERINGS), default='total')
+        parser.add_argument('--no-plans', action='store_true', help='Leave out the EXPLAIN output.')
+        parser.add_argument('--reset', action='store_true', help='Delete every recorded shape afterwards.')
+
+    def handle(self, *args, **options):
+        slow_queries = SlowQuery.objects.annotate(
+            mean_ms=ExpressionWrapper(F('total_ms') / F('calls'), output_field=FloatField()),
+        ).order_by(ORDERINGS[options['order_by']])[:options['limit']]
+
+        for rank, slow_query in enumerate(slow_queries, start=1):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"#{rank} {slow_query.calls} calls, {slow_query.total_ms:.0f}ms total, "
+                f"{slow_query.mean_ms:.1f}ms mean, {slow_query.max_ms:.1f}ms max ({slow_query.database})"
+            ))
+            self.stdout.write(slow_query.shape)
+            if not options['no_plans']:
+                self.stdout.write(slow_query.plan or '(no plan captured)')
+            self.stdout.write('')
+
+        if options['reset']:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(f"Deleted {deleted} slow query shapes.")
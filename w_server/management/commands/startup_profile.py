@@ -0,0 +1,118 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+# What a worker does before serving its first request: load the WSGI/ASGI
+# application (django.setup()) and the URLconf, which imports every view.
+BOOT_SCRIPT = (
+    "import importlib, sys\n"
+    "importlib.import_module(sys.argv[1])\n"
+    "from django.urls import get_resolver\n"
+    "get_resolver().url_patterns\n"
+)
+
+# Only needed by specific endpoints, so they must not load at boot.
+# (django.contrib.postgres is not listed: rest_framework.compat imports it.)
+LAZY_MODULES = (
+    'botocore',
+    'boto3',
+    'storages.backends.s3',
+    'mutagen',
+)
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def profile_boot(application='washint_server.wsgi'):
+    """
+    Boots a worker in a fresh interpreter under `-X importtime` and returns
+    its wall time and every imported module with self/cumulative microseconds.
+    """
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT, application],
+        capture_output=True,
+        text=True,
+        env=os.environ.copy(),
+    )
+    wall_seconds = time.perf_counter() - started
+    if process.returncode != 0:
+        raise CommandError(f"Worker boot failed:\n{process.stderr[-2000:]}")
+
+    modules = []
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            modules.append({
+                'module': match.group(4),
+                'self_us': int(match.group(1)),
+                'cumulative_us': int(match.group(2)),
+                'depth': len(match.group(3)) // 2,
+            })
+    return {'wall_seconds': round(wall_seconds, 3), 'modules': modules}
+
+
+class Command(BaseCommand):
+    help = (
+        "Boots a worker in a subprocess with `python -X importtime` and reports "
+        "total boot time, the slowest imports and the import time per top-level "
+        "package. Fails if a module that should load lazily is imported at boot, "
+        "or if imports take longer than --budget seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--application', default='washint_server.wsgi',
+                            help='Module holding the worker application (washint_server.asgi for uvicorn).')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--json', action='store_true', help='Print the full profile as JSON.')
+        # Boot currently spends ~0.35s importing; a run with --budget 1.0 on a
+        # known machine catches a heavy dependency that starts loading eagerly.
+        parser.add_argument('--budget', type=float,
+                            help='Fail if imports take longer than this many seconds (machine dependent).')
+
+    def handle(self, *args, **options):
+        profile = profile_boot(options['application'])
+        modules = profile['modules']
+        eager = sorted({
+            module['module'] for module in modules
+            if any(module['module'] == lazy or module['module'].startswith(lazy + '.') for lazy in LAZY_MODULES)
+        })
+        profile['eager_lazy_modules'] = eager
+        profile['imports_seconds'] = round(sum(module['self_us'] for module in modules) / 1e6, 3)
+
+        if options['json']:
+            self.stdout.write(json.dumps(profile))
+        else:
+            self.write_report(profile, options['limit'])
+
+        if eager:
+            raise CommandError(f"Imported at boot but expected to load lazily: {', '.join(eager)}")
+        if options['budget'] is not None and profile['imports_seconds'] > options['budget']:
+            raise CommandError(
+                f"Imports took {profile['imports_seconds']}s, over the {options['budget']}s budget."
+            )
+
+    def write_report(self, profile, limit):
+        modules = profile['modules']
+        self.stdout.write(
+            f"Boot: {profile['wall_seconds']}s wall, {profile['imports_seconds']:.3f}s importing {len(modules)} modules"
+        )
+
+        packages = {}
+        for module in modules:
+            package = module['module'].split('.')[0]
+            packages[package] = packages.get(package, 0) + module['self_us']
+        self.stdout.write("\nBy package:")
+        for package, total in sorted(packages.items(), key=lambda item: -item[1])[:limit]:
+            self.stdout.write(f"  {total / 1000:9.1f}ms  {package}")
+
+        self.stdout.write("\nSlowest imports (cumulative):")
+        for module in sorted(modules, key=lambda module: -module['cumulative_us'])[:limit]:
+            self.stdout.write(
+                f"  {module['cumulative_us'] / 1000:9.1f}ms  {module['self_us'] / 1000:7.1f}ms self  {module['module']}"
+            )
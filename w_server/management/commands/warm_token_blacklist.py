@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from washint_server.tokens import warm_blacklist_cache
+
+
+class Command(BaseCommand):
+    help = "Loads every unexpired blacklisted refresh-token jti into the shared cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cached = warm_blacklist_cache(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Cached {cached} blacklisted tokens."))
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:02
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_playlist_stats(apps, schema_editor):
+    Playlist = apps.get_model('w_server', 'Playlist')
+    PlaylistSong = apps.get_model('w_server', 'PlaylistSong')
+    entries = PlaylistSong.objects.filter(playlist=OuterRef('pk')).order_by().values('playlist')
+    Playlist.objects.update(
+        songs_count=Coalesce(Subquery(entries.annotate(total=Count('pk')).values('total')), 0),
+        total_duration_seconds=Coalesce(
+            Subquery(entries.annotate(total=Sum('song__duration_seconds')).values('total')), 0
+        ),
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('w_server', '0014_artist_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='songs_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='total_duration_seconds',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_playlist_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:06
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('w_server', '0015_playlist_songs_count_playlist_total_duration_seconds'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('username'), name='user_username_lower_unique'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('w_server', '0016_user_user_username_lower_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['artist', '-created_at'], name='album_artist_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['following', 'follower'], name='follow_following_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playlist',
+            index=models.Index(fields=['owner', 'created_at'], name='playlist_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playlist',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['created_at'], name='playlist_public_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playlistsong',
+            index=models.Index(fields=['playlist', 'order'], name='plsong_playlist_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['artist', '-created_at'], name='song_artist_created_idx'),
+        ),
+    ]
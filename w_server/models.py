@@ -3,18 +3,57 @@ from django.db import models
 # Create your models here.
 import uuid
 from django.contrib.auth.models import AbstractUser
+from django.core.cache import cache
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest, Lower
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_save, pre_delete, pre_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
+
+from washint_server import query_budget
+from washint_server.slow_queries import slow_query_log
+from .cache import album_payloads, artist_pages, artist_payloads, song_payloads, user_cache, username_availability_key
 
 
 
 class User(AbstractUser):
     id = models.UUIDField(primary_key=True,default=uuid.uuid4,editable=False)
+
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Backs case-insensitive username lookups (see UserViewSet.check_username).
+            models.UniqueConstraint(Lower('username'), name='user_username_lower_unique'),
+        ]
+
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}".strip()
 
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Covers deactivation and password changes, which both go through save().
+    user_cache.delete(instance.pk)
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_username(sender, instance, update_fields=None, **kwargs):
+    # Saves that cannot rename the user (e.g. last_login) skip the lookup.
+    if instance._state.adding or (update_fields is not None and 'username' not in update_fields):
+        return
+    instance._previous_username = User.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_username_availability(sender, instance, **kwargs):
+    # After a rename the old name is free again, so its "taken" answer goes too.
+    usernames = {instance.username, getattr(instance, '_previous_username', None) or instance.username}
+    cache.delete_many([username_availability_key(username) for username in usernames])
+
 class UserProfile(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4,editable=False)
     user = models.OneToOneField(User,on_delete=models.CASCADE,related_name='profile')
@@ -55,6 +94,9 @@ class Album(models.Model):
 
     class Meta:
         unique_together = ('artist', 'title')
+        indexes = [
+            models.Index(fields=['artist', '-created_at'], name='album_artist_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} by {self.artist.name}"
@@ -65,6 +107,10 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ('follower', 'following')
+        indexes = [
+            # The unique index only serves lookups by follower.
+            models.Index(fields=['following', 'follower'], name='follow_following_idx'),
+        ]
 
 
 class Song(models.Model):
@@ -80,6 +126,11 @@ class Song(models.Model):
     play_count = models.PositiveBigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['artist', '-created_at'], name='song_artist_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.title}"
 class SongGenre(models.Model):
@@ -97,9 +148,70 @@ class Playlist(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     cover_art_upload = models.ImageField(upload_to='images/')
+    # Denormalized from PlaylistSong so list pages need no per-row aggregates.
+    # Kept in step by the add/remove paths; `reconcile_playlist_stats` repairs drift.
+    songs_count = models.PositiveIntegerField(default=0)
+    total_duration_seconds = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'created_at'], name='playlist_owner_created_idx'),
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(is_public=True),
+                name='playlist_public_created_idx',
+            ),
+        ]
+
     def __str__(self):
         return self.title
 
+    def adjust_stats(self, songs_delta, duration_delta):
+        """
+        Applies an increment (or decrement) to the denormalized song count and
+        duration in a single UPDATE, never going below zero, and logs the
+        playlist as changed for sync.
+        """
+        Playlist.objects.filter(pk=self.pk).update(
+            songs_count=Greatest(F('songs_count') + songs_delta, 0),
+            total_duration_seconds=Greatest(F('total_duration_seconds') + duration_delta, 0),
+            # update() skips auto_now, and sync clients compare updated_at.
+            updated_at=timezone.now(),
+        )
+        SyncChange.record('playlist', 'update', [(self.owner_id, self.pk)])
+
+    @classmethod
+    def refresh_stats(cls, playlist_ids=None, touch=False):
+        """
+        Recomputes the denormalized song count and duration from PlaylistSong
+        rows in one UPDATE. Returns the number of playlists updated. `touch`
+        also sets updated_at, for callers that changed the playlists' songs
+        (reconciling alone does not change a playlist).
+        """
+        entries = PlaylistSong.objects.filter(playlist=OuterRef('pk')).order_by().values('playlist')
+        queryset = cls.objects.all()
+        if playlist_ids is not None:
+            queryset = queryset.filter(pk__in=playlist_ids)
+        extra = {'updated_at': timezone.now()} if touch else {}
+        return queryset.update(
+            songs_count=Coalesce(Subquery(entries.annotate(total=Count('pk')).values('total')), 0),
+            total_duration_seconds=Coalesce(
+                Subquery(entries.annotate(total=Sum('song__duration_seconds')).values('total')), 0
+            ),
+            **extra,
+        )
+
+    def ordered_songs(self):
+        """
+        Songs of this playlist in playlist order, with the relations used by
+        SongSerializer loaded up front.
+        """
+        return (
+            self.songs.select_related('artist__managed_by')
+            .prefetch_related('genres')
+            .order_by('playlistsong__order')
+        )
+
 class PlaylistSong(models.Model):
     playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE)
     song = models.ForeignKey(Song, on_delete=models.CASCADE)
@@ -109,7 +221,109 @@ class PlaylistSong(models.Model):
     class Meta:
         ordering = ['order']
         unique_together = ('playlist', 'song')
+        indexes = [
+            models.Index(fields=['playlist', 'order'], name='plsong_playlist_order_idx'),
+        ]
         
+
+@receiver(pre_delete, sender=Song)
+def remember_song_playlists(sender, instance, **kwargs):
+    # PlaylistSong rows are cascaded away with the song, so note the affected
+    # playlists before they disappear.
+    instance._playlist_ids = list(
+        PlaylistSong.objects.filter(song=instance).values_list('playlist_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Song)
+def refresh_song_playlists(sender, instance, **kwargs):
+    playlist_ids = getattr(instance, '_playlist_ids', None)
+    if playlist_ids:
+        Playlist.refresh_stats(playlist_ids, touch=True)
+        SyncChange.record('playlist', 'update', Playlist.objects.filter(pk__in=playlist_ids).values_list('owner_id', 'pk'))
+
+def invalidate_artist_payloads(artist_ids):
+    """
+    Bumps the cached payloads and pages of artists and of all their songs
+    and albums, which show the managing user's name.
+    """
+    artist_ids = list(artist_ids)
+    if not artist_ids:
+        return
+    artist_payloads.bump(artist_ids)
+    artist_pages.bump(artist_ids)
+    song_payloads.bump(Song.objects.filter(artist_id__in=artist_ids).values_list('pk', flat=True))
+    album_payloads.bump(Album.objects.filter(artist_id__in=artist_ids).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Song)
+def invalidate_song_payload(sender, instance, **kwargs):
+    song_payloads.bump([instance.pk])
+    artist_pages.bump([instance.artist_id])
+
+
+@receiver(post_delete, sender=Song)
+def forget_song_payload(sender, instance, **kwargs):
+    song_payloads.forget([instance.pk])
+    artist_pages.forget([instance.artist_id])
+
+
+@receiver(m2m_changed, sender=Song.genres.through)
+def invalidate_song_genres_payload(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # Changed from the Genre side; pk_set is None after a clear().
+        songs = Song.objects.filter(genres=instance) if pk_set is None else Song.objects.filter(pk__in=pk_set)
+        songs = list(songs.values_list('pk', 'artist_id'))
+        song_payloads.bump(song_id for song_id, _ in songs)
+        artist_pages.bump({artist_id for _, artist_id in songs})
+    else:
+        song_payloads.bump([instance.pk])
+        artist_pages.bump([instance.artist_id])
+
+
+@receiver(post_save, sender=Album)
+def invalidate_album_payload(sender, instance, **kwargs):
+    album_payloads.bump([instance.pk])
+    artist_pages.bump([instance.artist_id])
+
+
+@receiver(post_delete, sender=Album)
+def forget_album_payload(sender, instance, **kwargs):
+    album_payloads.forget([instance.pk])
+    artist_pages.forget([instance.artist_id])
+
+
+@receiver(post_save, sender=Artist)
+def invalidate_artist_payload(sender, instance, **kwargs):
+    invalidate_artist_payloads([instance.pk])
+
+
+@receiver(post_delete, sender=Artist)
+def forget_artist_payload(sender, instance, **kwargs):
+    # Its songs and albums were deleted first and forgot themselves.
+    artist_payloads.forget([instance.pk])
+    artist_pages.forget([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def invalidate_managed_artist_payloads(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_artist_payloads(instance.managed_artists.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_profile_artist_payloads(sender, instance, **kwargs):
+    # Artist payloads embed the manager's profile and picture. Follower counts
+    # change through queryset updates and lag by up to OBJECT_CACHE_TIMEOUT.
+    artist_ids = list(Artist.objects.filter(managed_by_id=instance.user_id).values_list('pk', flat=True))
+    artist_payloads.bump(artist_ids)
+    artist_pages.bump(artist_ids)
+
+
 class UserSubscription(models.Model):
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions')
@@ -138,3 +352,118 @@ class UserSubscription(models.Model):
         ]
 
 
+class SyncChange(models.Model):
+    """
+    Per-user change log behind /api/sync/. The id is the sync sequence: a
+    client passes the last id it has seen and gets every later change to its
+    playlists (including their songs), follows and owned songs and albums.
+    """
+    KINDS = [
+        ('playlist', 'Playlist'),
+        ('follow', 'Follow'),
+        ('song', 'Song'),
+        ('album', 'Album'),
+    ]
+    ACTIONS = [
+        ('insert', 'Insert'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    # No database constraint: a deleted user's follows are logged for the
+    # other side while the user's own rows go away, and prune_sync_changes
+    # removes anything left over.
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.CharField(max_length=36)
+    action = models.CharField(max_length=6, choices=ACTIONS)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='syncchange_user_seq_idx'),
+        ]
+
+    @classmethod
+    def record(cls, kind, action, changes):
+        """Logs `action` on `kind` for (user_id, object_id) pairs, skipping ownerless ones."""
+        cls.objects.bulk_create([
+            cls(user_id=user_id, kind=kind, object_id=str(object_id), action=action)
+            for user_id, object_id in changes
+            if user_id is not None
+        ])
+
+
+def _save_action(created):
+    return 'insert' if created else 'update'
+
+
+def _artist_manager_id(artist_id):
+    return Artist.objects.filter(pk=artist_id).values_list('managed_by_id', flat=True).first()
+
+
+@receiver(post_save, sender=Playlist)
+def log_playlist_save(sender, instance, created, **kwargs):
+    SyncChange.record('playlist', _save_action(created), [(instance.owner_id, instance.pk)])
+
+
+@receiver(post_delete, sender=Playlist)
+def log_playlist_delete(sender, instance, **kwargs):
+    SyncChange.record('playlist', 'delete', [(instance.owner_id, instance.pk)])
+
+
+@receiver(post_save, sender=Follow)
+def log_follow_save(sender, instance, created, **kwargs):
+    SyncChange.record('follow', _save_action(created), [
+        (instance.follower_id, instance.pk), (instance.following_id, instance.pk),
+    ])
+
+
+@receiver(post_delete, sender=Follow)
+def log_follow_delete(sender, instance, **kwargs):
+    SyncChange.record('follow', 'delete', [
+        (instance.follower_id, instance.pk), (instance.following_id, instance.pk),
+    ])
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_save, sender=Album)
+def log_owned_save(sender, instance, created, **kwargs):
+    kind = 'song' if sender is Song else 'album'
+    SyncChange.record(kind, _save_action(created), [(_artist_manager_id(instance.artist_id), instance.pk)])
+
+
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Album)
+def log_owned_delete(sender, instance, **kwargs):
+    kind = 'song' if sender is Song else 'album'
+    SyncChange.record(kind, 'delete', [(_artist_manager_id(instance.artist_id), instance.pk)])
+
+
+class SlowQuery(models.Model):
+    """
+    Queries slower than SLOW_QUERY_THRESHOLD_MS, aggregated per SQL shape by
+    washint_server.slow_queries. See the slow_query_report command.
+    """
+    fingerprint = models.CharField(max_length=40, unique=True)
+    database = models.CharField(max_length=64)
+    shape = models.TextField()
+    sample_sql = models.TextField()
+    calls = models.PositiveBigIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    plan = models.TextField(blank=True)
+    plan_captured_at = models.DateTimeField(null=True, blank=True)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.shape[:80]
+
+
+@receiver(connection_created)
+def install_execute_wrappers(sender, connection, **kwargs):
+    query_budget.install(connection)
+    if settings.SLOW_QUERY_LOG_ENABLED:
+        slow_query_log.install(connection)
@@ -1,9 +1,74 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
+from rest_framework.utils.urls import replace_query_param
 from .models import (
     User, UserProfile, Artist, Album, Song, Genre, Playlist,
-    PlaylistSong, Follow, UserSubscription
+    PlaylistSong, Follow, UserSubscription, SyncChange
 )
-from django.db import models
+from django.db import models, transaction
+
+
+
+def _split_param(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsetsMixin:
+    """
+    Lets list and retrieve requests trim the representation:
+    `?fields=id,title` keeps only the listed fields, and `?expand=` collapses
+    the nested relations in `expandable_fields` to the related object's
+    primary key unless they are listed (`?expand=artist`). Without `?expand`
+    everything stays nested, as before.
+
+    Fields left out are never computed, so they sign no URLs, and
+    eager_load() only joins or prefetches what is still rendered. Only the
+    top-level serializer of a response is trimmed, and only when the view
+    sets the `sparse_fieldsets` context flag.
+    """
+    # Nested field -> attribute holding the related primary key.
+    expandable_fields = {}
+    # Field -> select_related / prefetch_related lookups it needs.
+    select_related_fields = {}
+    prefetch_related_fields = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        self._collapsed = set()
+        if not self._is_sparse():
+            return fields
+
+        params = self.context['request'].query_params
+        if 'expand' in params:
+            expand = _split_param(params['expand'])
+            for name, source in self.expandable_fields.items():
+                if name in fields and name not in expand:
+                    fields[name] = serializers.ReadOnlyField(source=source)
+                    self._collapsed.add(name)
+        if 'fields' in params:
+            requested = _split_param(params['fields'])
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
+
+    def _is_sparse(self):
+        if not self.context.get('sparse_fieldsets') or self.context.get('request') is None:
+            return False
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+    def eager_load(self, queryset):
+        """Adds the lookups needed by the fields this serializer renders."""
+        select, prefetch = set(), set()
+        for name in self.fields:
+            if name not in self._collapsed:
+                select.update(self.select_related_fields.get(name, ()))
+                prefetch.update(self.prefetch_related_fields.get(name, ()))
+        if select:
+            queryset = queryset.select_related(*sorted(select))
+        if prefetch:
+            queryset = queryset.prefetch_related(*sorted(prefetch))
+        return queryset
+
 
 # Reusing existing serializers
 class UserSerializer(serializers.ModelSerializer):
@@ -64,20 +129,30 @@ class ManagedByUserSerializer(serializers.ModelSerializer):
             return profile.profile_picture_url.url
         return None
 
-class ArtistSerializer(serializers.ModelSerializer):
+class ArtistSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     managed_by = FullUserSerializer(read_only=True)
     name = serializers.CharField(source='managed_by.full_name', read_only=True)
 
+    expandable_fields = {'managed_by': 'managed_by_id'}
+    select_related_fields = {'managed_by': ['managed_by__profile'], 'name': ['managed_by']}
+
     class Meta:
         model = Artist
         fields = ['id','genre','name','managed_by']
     
 
-class ArtistListSerializer(serializers.ModelSerializer):
+class ArtistListSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     display_name = serializers.CharField(source='managed_by.full_name',read_only=True)
     username = serializers.CharField(source='managed_by.username',read_only=True)
     profile_picture_url = serializers.SerializerMethodField(read_only=True)
     name = serializers.CharField(source='managed_by.full_name',read_only=True)
+
+    select_related_fields = {
+        'display_name': ['managed_by'],
+        'username': ['managed_by'],
+        'name': ['managed_by'],
+        'profile_picture_url': ['managed_by__profile'],
+    }
     class Meta:
         model = Artist
         fields = ['id','genre','display_name','name','username','profile_picture_url']
@@ -93,10 +168,13 @@ class ArtistManagedBySerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'display_name']
 
-class AlbumSerializer(serializers.ModelSerializer):
+class AlbumSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     artist = ArtistManagedBySerializer(source='artist.managed_by',read_only=True)
     signed_cover_art_url = serializers.SerializerMethodField(read_only=True)
     cover_art_upload = serializers.ImageField(write_only=True)
+
+    expandable_fields = {'artist': 'artist_id'}
+    select_related_fields = {'artist': ['artist__managed_by']}
     class Meta:
         model = Album
         fields =  ['id','title','artist','cover_art_upload','signed_cover_art_url']
@@ -134,7 +212,7 @@ class SongCreditSerializer(serializers.Serializer):
     role = serializers.CharField(max_length=255)
     name = serializers.CharField(max_length=255)
 
-class SongSerializer(serializers.ModelSerializer):
+class SongSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     audio_file_upload = serializers.FileField(write_only=True)
     song_cover_upload = serializers.ImageField(write_only=True)
     signed_audio_url = serializers.SerializerMethodField(read_only=True)
@@ -147,6 +225,10 @@ class SongSerializer(serializers.ModelSerializer):
     )
     credits = SongCreditSerializer(many=True, required=False, allow_null=True)
 
+    expandable_fields = {'artist': 'artist_id'}
+    select_related_fields = {'artist': ['artist__managed_by']}
+    prefetch_related_fields = {'genres': ['genres']}
+
     class Meta:
         model = Song
         fields = [
@@ -179,15 +261,17 @@ class SongSerializer(serializers.ModelSerializer):
             song.save()
         return song
 
-class PlaylistListSerializer(serializers.ModelSerializer):
+class PlaylistListSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """
     A serializer for listing playlists, including the owner's full details
     and a count of songs.
     """
     owner = FullUserSerializer(read_only=True)
-    songs_count = serializers.SerializerMethodField()
     cover_art_upload = serializers.ImageField(write_only=True)
     signed_cover_art_url = serializers.SerializerMethodField(read_only=True)
+
+    expandable_fields = {'owner': 'owner_id'}
+    select_related_fields = {'owner': ['owner__profile']}
     class Meta:
         model = Playlist
         fields = [
@@ -198,29 +282,35 @@ class PlaylistListSerializer(serializers.ModelSerializer):
             'owner',
             'is_public',
             'songs_count',
+            'total_duration_seconds',
             'created_at',
             'updated_at',
         ]
-        read_only_fields = ('id', 'created_at', 'updated_at',)
+        read_only_fields = ('id', 'songs_count', 'total_duration_seconds', 'created_at', 'updated_at',)
 
-    def get_songs_count(self, obj):
-        return obj.songs.count()
     def get_signed_cover_art_url(self, obj):
         if obj.cover_art_upload:
             return obj.cover_art_upload.url
         return None
       
 
-class PlaylistDetailSerializer(serializers.ModelSerializer):
+class PlaylistDetailSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """
     A serializer for a single playlist, including the owner's details
-    and a full, nested list of songs.
+    and the first page of its songs. The rest of the songs are paged
+    through /playlists/{id}/songs/, linked by `songs_next`.
     """
+    INLINE_SONGS_LIMIT = 20
+
     songs = serializers.SerializerMethodField()
+    songs_next = serializers.SerializerMethodField()
     owner = FullUserSerializer(read_only=True)
     cover_art_upload = serializers.ImageField(write_only=True)
     signed_cover_art_url = serializers.SerializerMethodField(read_only=True)
-    
+
+    expandable_fields = {'owner': 'owner_id'}
+    select_related_fields = {'owner': ['owner__profile']}
+
     class Meta:
         model = Playlist
         fields = [
@@ -230,18 +320,41 @@ class PlaylistDetailSerializer(serializers.ModelSerializer):
             'signed_cover_art_url',
             'owner',
             'is_public',
+            'songs_count',
+            'total_duration_seconds',
             'songs',
+            'songs_next',
             'created_at',
             'updated_at',
         ]
-        read_only_fields = ('id', 'created_at', 'updated_at',)
+        read_only_fields = ('id', 'songs_count', 'total_duration_seconds', 'created_at', 'updated_at',)
+
+    def _inline_songs(self, obj):
+        # One extra row tells us whether there is a next page without a COUNT query.
+        cache = self.__dict__.setdefault('_inline_songs_cache', {})
+        if obj.pk not in cache:
+            cache[obj.pk] = list(obj.ordered_songs()[:self.INLINE_SONGS_LIMIT + 1])
+        return cache[obj.pk]
 
     def get_songs(self, obj):
         """
-        Manually serializes the songs in the playlist.
+        Manually serializes the first page of songs in the playlist.
         This prevents the AttributeError on retrieve.
         """
-        return SongSerializer(obj.songs.all(), many=True, context=self.context).data
+        songs = self._inline_songs(obj)[:self.INLINE_SONGS_LIMIT]
+        # ?fields= and ?expand= apply to the playlist, not its songs.
+        context = {**self.context, 'sparse_fieldsets': False}
+        return SongSerializer(songs, many=True, context=context).data
+
+    def get_songs_next(self, obj):
+        if len(self._inline_songs(obj)) <= self.INLINE_SONGS_LIMIT:
+            return None
+        url = reverse('playlist-songs-list', kwargs={'playlist_pk': obj.pk})
+        request = self.context.get('request')
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        url = replace_query_param(url, 'limit', self.INLINE_SONGS_LIMIT)
+        return replace_query_param(url, 'offset', self.INLINE_SONGS_LIMIT)
     def get_signed_cover_art_url(self, obj):
         if obj.cover_art_upload:
             return obj.cover_art_upload.url
@@ -306,12 +419,103 @@ class AddSongToPlaylistSerializer(serializers.ModelSerializer):
             max_order = PlaylistSong.objects.filter(playlist=playlist).aggregate(models.Max('order'))['order__max']
             order = (max_order or 0) + 1
 
-        playlist_song = PlaylistSong.objects.create(
-            playlist=playlist,
-            song=song,
-            order=order
-        )
+        with transaction.atomic():
+            playlist_song = PlaylistSong.objects.create(
+                playlist=playlist,
+                song=song,
+                order=order
+            )
+            playlist.adjust_stats(1, song.duration_seconds)
         return playlist_song
+class SongIdsSerializer(serializers.Serializer):
+    """
+    A non-empty list of at most MAX_SONGS song ids, deduplicated in request
+    order; the base of the bulk song endpoints.
+    """
+    MAX_SONGS = None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fields['song_ids'] = serializers.ListField(
+            child=serializers.UUIDField(),
+            allow_empty=False,
+            max_length=self.MAX_SONGS,
+        )
+        return fields
+
+    def validate_song_ids(self, value):
+        # Keep the request order but drop ids repeated within the same request.
+        return list(dict.fromkeys(value))
+
+
+class BulkPlaylistSongsSerializer(SongIdsSerializer):
+    """
+    Adds or removes many songs in a playlist with a fixed number of queries,
+    reporting a status for every requested song id.
+    """
+    MAX_SONGS = 1000
+
+    def add_songs(self):
+        playlist = self.context['playlist']
+        song_ids = self.validated_data['song_ids']
+
+        with transaction.atomic():
+            # Concurrent bulk adds to the playlist queue here, so each reads
+            # the max order after the previous one has committed.
+            Playlist.objects.select_for_update().filter(pk=playlist.pk).values_list('pk').first()
+            durations = dict(Song.objects.filter(id__in=song_ids).values_list('id', 'duration_seconds'))
+            existing = set(
+                PlaylistSong.objects.filter(playlist=playlist, song_id__in=durations).order_by().values_list('song_id', flat=True)
+            )
+            max_order = PlaylistSong.objects.filter(playlist=playlist).aggregate(models.Max('order'))['order__max']
+            order = max_order or 0
+
+            new_orders = {}
+            for song_id in song_ids:
+                if song_id in durations and song_id not in existing:
+                    order += 1
+                    new_orders[song_id] = order
+
+            inserted = set()
+            if new_orders:
+                PlaylistSong.objects.bulk_create(
+                    [PlaylistSong(playlist=playlist, song_id=song_id, order=order) for song_id, order in new_orders.items()],
+                    ignore_conflicts=True,
+                )
+                # ignore_conflicts drops rows raced in by another path (such
+                # as add-song); only rows stored with our order were inserted.
+                stored = PlaylistSong.objects.filter(playlist=playlist, song_id__in=new_orders).values_list('song_id', 'order')
+                inserted = {song_id for song_id, order in stored if new_orders[song_id] == order}
+                if inserted:
+                    playlist.adjust_stats(len(inserted), sum(durations[song_id] for song_id in inserted))
+
+        results = []
+        for song_id in song_ids:
+            if song_id not in durations:
+                results.append({'song_id': song_id, 'status': 'not_found'})
+            elif song_id in inserted:
+                results.append({'song_id': song_id, 'status': 'added', 'order': new_orders[song_id]})
+            else:
+                results.append({'song_id': song_id, 'status': 'already_in_playlist'})
+        return results
+
+    def remove_songs(self):
+        playlist = self.context['playlist']
+        song_ids = self.validated_data['song_ids']
+
+        with transaction.atomic():
+            in_playlist = PlaylistSong.objects.filter(playlist=playlist, song_id__in=song_ids).order_by()
+            existing = set(in_playlist.values_list('song_id', flat=True))
+            if existing:
+                in_playlist.delete()
+                Playlist.refresh_stats([playlist.pk], touch=True)
+                SyncChange.record('playlist', 'update', [(playlist.owner_id, playlist.pk)])
+
+        return [
+            {'song_id': song_id, 'status': 'removed' if song_id in existing else 'not_in_playlist'}
+            for song_id in song_ids
+        ]
+
 class FollowSerializer(serializers.ModelSerializer):
     # This field will be used for POST requests to specify the user to follow
     following = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
@@ -333,3 +537,10 @@ class FollowSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("You are already following this user.")
         
         return value
+
+
+class SongBatchSerializer(SongIdsSerializer):
+    """
+    Song ids to fetch in one request; see SongViewSet.batch.
+    """
+    MAX_SONGS = 300
@@ -0,0 +1,119 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from .models import Album, Follow, Playlist, PlaylistSong, Song, SyncChange
+
+# Compact representations: plain columns only, no nested objects or signed
+# URLs (clients fetch media through the media endpoints when needed).
+COMPACT_FIELDS = {
+    'playlist': (Playlist, ['id', 'title', 'is_public', 'songs_count', 'total_duration_seconds', 'updated_at']),
+    'follow': (Follow, ['id', 'follower_id', 'following_id', 'created_at']),
+    'song': (Song, ['id', 'title', 'album_id', 'duration_seconds', 'created_at']),
+    'album': (Album, ['id', 'title', 'created_at']),
+}
+
+
+def current_token():
+    """
+    Sequence to start syncing from after a full download: the log's global
+    high-water mark, so the token of a user without changes of their own
+    still moves past rows that prune_sync_changes removes.
+    """
+    return SyncChange.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+def needs_reset(since):
+    """Whether changes after `since` may already have been pruned."""
+    oldest = SyncChange.objects.aggregate(first=Min('id'))['first']
+    return oldest is not None and since < oldest - 1
+
+
+def changes_since(user, since, limit):
+    """
+    The user's changes after sequence `since`, at most `limit` log rows,
+    collapsed to the last action per object. Returns (changes, token,
+    has_more). Rows younger than SYNC_SETTLE_SECONDS are held back, so a
+    row whose transaction commits late is not skipped by a client that has
+    already moved past its sequence.
+    """
+    entries = list(
+        SyncChange.objects.filter(user=user, id__gt=since)
+        .order_by('id')
+        .values_list('id', 'kind', 'object_id', 'action', 'created_at')[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    settled_before = timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+    unsettled_id = None
+    for index, entry in enumerate(entries):
+        if entry[4] > settled_before:
+            # Not has_more: the rest is picked up by the client's next
+            # regular sync, rather than by calling again straight away.
+            unsettled_id = entry[0]
+            entries = entries[:index]
+            has_more = False
+            break
+
+    token = entries[-1][0] if entries else since
+    if not has_more:
+        # Caught up: move the token to the newest settled row of any user, so
+        # it never falls behind the rows pruning keeps.
+        settled = (
+            SyncChange.objects.filter(created_at__lte=settled_before)
+            .order_by('-id').values_list('id', flat=True).first()
+        )
+        token = max(token, settled or 0)
+        if unsettled_id is not None:
+            token = min(token, unsettled_id - 1)
+    latest = {}
+    for _, kind, object_id, action, _ in entries:
+        # Re-inserted so the dict keeps the order of each object's last change.
+        latest.pop((kind, object_id), None)
+        latest[(kind, object_id)] = action
+
+    rows = _load_rows(user, (key for key, action in latest.items() if action != 'delete'))
+    changes = []
+    for (kind, object_id), action in latest.items():
+        data = rows.get((kind, object_id))
+        if data is None:
+            # Deleted, or no longer owned by this user, since it was logged.
+            changes.append({'kind': kind, 'id': object_id, 'op': 'delete'})
+        else:
+            changes.append({'kind': kind, 'id': object_id, 'op': 'upsert', 'data': data})
+    return changes, token, has_more
+
+
+def _owned_by(kind, user):
+    if kind == 'playlist':
+        return Q(owner=user)
+    if kind == 'follow':
+        return Q(follower=user) | Q(following=user)
+    return Q(artist__managed_by=user)
+
+
+def _load_rows(user, keys):
+    """Current compact rows for (kind, object_id) pairs, one query per kind."""
+    ids_by_kind = {}
+    for kind, object_id in keys:
+        ids_by_kind.setdefault(kind, []).append(object_id)
+
+    rows = {}
+    for kind, object_ids in ids_by_kind.items():
+        model, fields = COMPACT_FIELDS[kind]
+        for row in model.objects.filter(_owned_by(kind, user), pk__in=object_ids).values(*fields):
+            rows[(kind, str(row['id']))] = row
+
+    playlist_ids = [row['id'] for (kind, _), row in rows.items() if kind == 'playlist']
+    if playlist_ids:
+        song_ids = {}
+        entries = PlaylistSong.objects.filter(playlist_id__in=playlist_ids).order_by('playlist_id', 'order')
+        for playlist_id, song_id in entries.values_list('playlist_id', 'song_id'):
+            song_ids.setdefault(playlist_id, []).append(song_id)
+        for (kind, _), row in rows.items():
+            if kind == 'playlist':
+                row['song_ids'] = song_ids.get(row['id'], [])
+    return rows
@@ -1,3 +1,1351 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from importlib.util import find_spec
+from io import StringIO
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from washint_server.authentication import CachedJWTAuthentication
+from washint_server.metrics import registry as metrics_registry
+from washint_server.profiling import ProfilingMiddleware
+from washint_server.renderers import ORJSONRenderer
+from washint_server.slow_queries import normalize_sql, slow_query_log
+from washint_server.query_budget import QueryBudgetTestMixin, query_shape
+from washint_server.db_router import ReplicaRouter, ReplicaRoutingMiddleware, STICKY_COOKIE
+from washint_server.throttling import PlayEventThrottle, UsernameCheckThrottle
+
+from . import benchmark
+from .cache import StaleWhileRevalidateCache, artist_pages, hit_ratios, single_flight, song_payloads, user_cache
+from .models import User, UserProfile, Artist, Album, Song, Playlist, PlaylistSong, Follow, SlowQuery, SyncChange
+from .serializers import BulkPlaylistSongsSerializer
+from .views import (
+    ArtistViewSets, AlbumViewSets, AlbumSongViewSets, ArtistSongViewSets, PlayListViewSets,
+    FollowViewSet, UserProfileViewSets,
+)
+
+
+def make_song(artist, title='Song', duration_seconds=180):
+    return Song.objects.create(
+        title=title,
+        artist=artist,
+        duration_seconds=duration_seconds,
+        audio_file_url='songs/test.mp3',
+    )
+
+
+class PlaylistBulkSongsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='owner', password='pass12345')
+        self.artist = Artist.objects.create(name='Artist', managed_by=self.user)
+        self.songs = [make_song(self.artist, title=f'Song {i}') for i in range(5)]
+        self.playlist = Playlist.objects.create(title='Mix', owner=self.user, cover_art_upload='images/mix.png')
+        self.url = f'/api/playlists/{self.playlist.id}/songs/'
+        self.client.force_authenticate(self.user)
+
+    def test_only_the_owner_can_change_songs(self):
+        body = {'song_ids': [str(self.songs[0].id)]}
+        PlaylistSong.objects.create(playlist=self.playlist, song=self.songs[1], order=1)
+        other = User.objects.create_user(username='other', password='pass12345')
+
+        for user, expected in ((None, 401), (other, 404)):
+            self.client.force_authenticate(user)
+            for path in ('add-songs/', 'remove-songs/'):
+                with self.subTest(user=user, path=path):
+                    response = self.client.post(self.url + path, body, format='json')
+                    self.assertEqual(response.status_code, expected)
+        self.assertEqual(list(PlaylistSong.objects.values_list('song_id', flat=True)), [self.songs[1].id])
+
+    def test_add_songs_reports_per_item_status(self):
+        PlaylistSong.objects.create(playlist=self.playlist, song=self.songs[0], order=1)
+        missing = '00000000-0000-0000-0000-000000000000'
+        song_ids = [str(song.id) for song in self.songs] + [missing]
+
+        # Playlist lookup, row lock, song IN query, duplicate check, max order,
+        # insert, inserted-rows check, stats update, sync log and the
+        # savepoint pair.
+        with self.assertNumQueries(11):
+            response = self.client.post(self.url + 'add-songs/', {'song_ids': song_ids}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['added'], 4)
+        statuses = [item['status'] for item in response.data['results']]
+        self.assertEqual(statuses, ['already_in_playlist'] + ['added'] * 4 + ['not_found'])
+        orders = list(PlaylistSong.objects.filter(playlist=self.playlist).values_list('order', flat=True))
+        self.assertEqual(orders, [1, 2, 3, 4, 5])
+
+    def test_adding_and_removing_songs_moves_updated_at(self):
+        # Sync clients compare updated_at, and the stats UPDATEs skip auto_now.
+        stamps = [self.playlist.updated_at]
+        for path in ('add-songs/', 'remove-songs/'):
+            self.client.post(self.url + path, {'song_ids': [str(self.songs[0].id)]}, format='json')
+            self.playlist.refresh_from_db()
+            stamps.append(self.playlist.updated_at)
+        self.assertLess(stamps[0], stamps[1])
+        self.assertLess(stamps[1], stamps[2])
+
+    def test_too_many_ids(self):
+        song_ids = [str(uuid.uuid4()) for _ in range(BulkPlaylistSongsSerializer.MAX_SONGS + 1)]
+        response = self.client.post(self.url + 'add-songs/', {'song_ids': song_ids}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_songs_raced_in_by_another_request_are_not_counted(self):
+        bulk_create = PlaylistSong.objects.bulk_create
+
+        def racing_bulk_create(rows, **kwargs):
+            # Another request adds the first song between our reads and insert.
+            PlaylistSong.objects.create(playlist=self.playlist, song=self.songs[0], order=99)
+            return bulk_create(rows, **kwargs)
+
+        with mock.patch.object(PlaylistSong.objects, 'bulk_create', side_effect=racing_bulk_create):
+            response = self.client.post(self.url + 'add-songs/', {'song_ids': [str(song.id) for song in self.songs[:3]]}, format='json')
+
+        self.assertEqual(response.data['added'], 2)
+        self.assertEqual([item['status'] for item in response.data['results']], ['already_in_playlist', 'added', 'added'])
+        self.playlist.refresh_from_db()
+        self.assertEqual(self.playlist.songs_count, 2)
+
+    def test_remove_songs(self):
+        for order, song in enumerate(self.songs[:2], start=1):
+            PlaylistSong.objects.create(playlist=self.playlist, song=song, order=order)
+        song_ids = [str(self.songs[0].id), str(self.songs[4].id)]
+
+        response = self.client.post(self.url + 'remove-songs/', {'song_ids': song_ids}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['removed'], 1)
+        self.assertEqual([item['status'] for item in response.data['results']], ['removed', 'not_in_playlist'])
+        self.assertEqual(PlaylistSong.objects.filter(playlist=self.playlist).count(), 1)
+
+
+class PlaylistSongsListingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='owner', password='pass12345')
+        self.artist = Artist.objects.create(name='Artist', managed_by=self.user)
+        self.playlist = Playlist.objects.create(title='Mix', owner=self.user, cover_art_upload='images/mix.png')
+        # Insert in reverse so playlist order differs from creation order.
+        for order in range(25, 0, -1):
+            song = make_song(self.artist, title=f'Song {order}')
+            PlaylistSong.objects.create(playlist=self.playlist, song=song, order=order)
+
+    def test_detail_inlines_first_page_in_playlist_order(self):
+        response = self.client.get(f'/api/playlists/{self.playlist.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        titles = [song['title'] for song in response.data['songs']]
+        self.assertEqual(titles, [f'Song {order}' for order in range(1, 21)])
+        self.assertIn('offset=20', response.data['songs_next'])
+
+    def test_songs_listing_is_paginated_with_constant_queries(self):
+        url = f'/api/playlists/{self.playlist.id}/songs/'
+        # Playlist lookup, count, page and genres prefetch.
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {'limit': 10, 'offset': 20})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual([song['title'] for song in response.data['results']], [f'Song {order}' for order in range(21, 26)])
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        call_command('seed_catalog', seed=5, users=20, artists=3, albums=4, songs=80, playlists=6, stdout=StringIO())
+        self.user = User.objects.order_by('username').first()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.playlist = Playlist.objects.filter(is_public=True).order_by('-songs_count').first()
+        self.songs = list(Song.objects.order_by('title')[:30])
+
+    def test_read_endpoints_stay_within_budget(self):
+        for url in ('/api/playlists/', f'/api/playlists/{self.playlist.id}/', f'/api/playlists/{self.playlist.id}/songs/'):
+            with self.subTest(url=url):
+                # A cold user cache, so the authentication query is counted.
+                user_cache.clear_local()
+                cache.clear()
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinQueryBudget(response)
+
+        response = self.client.get('/api/users/check_username/', {'username': 'nobody'})
+        self.assertWithinQueryBudget(response)
+
+    def test_bulk_endpoints_stay_within_budget(self):
+        playlist = Playlist.objects.create(title='Mine', owner=self.user, cover_art_upload='images/mix.png')
+        song_ids = [str(song.id) for song in self.songs]
+        for action in ('add-songs', 'remove-songs'):
+            with self.subTest(action=action):
+                cache.clear()
+                user_cache.clear_local()
+                response = self.client.post(f'/api/playlists/{playlist.id}/songs/{action}/', {'song_ids': song_ids}, format='json')
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinQueryBudget(response)
+
+    @override_settings(QUERY_BUDGET_HEADERS=True)
+    def test_headers_and_over_budget_warning(self):
+        with mock.patch.dict(PlayListViewSets.query_budgets, {'list': 0}):
+            with self.assertLogs('washint_server.query_budget', 'WARNING') as logs:
+                response = self.client.get('/api/playlists/')
+
+        self.assertEqual(response['X-DB-Query-Budget'], '0')
+        self.assertEqual(int(response['X-DB-Queries']), response.query_stats.queries)
+        self.assertIn('X-DB-Time-Ms', response)
+        self.assertIn('budget 0', logs.output[0])
+        with self.assertRaises(AssertionError):
+            self.assertWithinQueryBudget(response)
+
+    def test_placeholder_lists_share_a_shape(self):
+        self.assertEqual(
+            query_shape('SELECT 1 FROM t WHERE id IN (%s, %s) AND x = %s'),
+            query_shape('SELECT 1 FROM t WHERE id IN (%s, %s, %s, %s) AND x = %s'),
+        )
+
+
+class PlaylistStatsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='owner', password='pass12345')
+        self.client.force_authenticate(self.user)
+        self.artist = Artist.objects.create(name='Artist', managed_by=self.user)
+        self.songs = [make_song(self.artist, title=f'Song {i}', duration_seconds=100 + i) for i in range(3)]
+        self.playlist = Playlist.objects.create(title='Mix', owner=self.user, cover_art_upload='images/mix.png')
+        self.url = f'/api/playlists/{self.playlist.id}/songs/'
+
+    def assertStats(self, songs_count, total_duration_seconds):
+        self.playlist.refresh_from_db()
+        self.assertEqual(self.playlist.songs_count, songs_count)
+        self.assertEqual(self.playlist.total_duration_seconds, total_duration_seconds)
+
+    def test_add_and_remove_paths_keep_stats_in_step(self):
+        self.client.post(self.url + 'add-song/', {'song_id': str(self.songs[0].id)}, format='json')
+        self.assertStats(1, 100)
+
+        song_ids = [str(song.id) for song in self.songs]
+        self.client.post(self.url + 'add-songs/', {'song_ids': song_ids}, format='json')
+        self.assertStats(3, 303)
+
+        self.client.delete(self.url + f'remove-song/{self.songs[1].id}/')
+        self.assertStats(2, 202)
+
+        self.client.post(self.url + 'remove-songs/', {'song_ids': song_ids[:1]}, format='json')
+        self.assertStats(1, 102)
+
+        self.songs[2].delete()
+        self.assertStats(0, 0)
+
+    def test_list_reads_stats_without_per_row_queries(self):
+        for i in range(3):
+            Playlist.objects.create(title=f'Other {i}', owner=self.user, cover_art_upload='images/mix.png')
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/playlists/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['songs_count'], 0)
+
+    def test_reconcile_command_repairs_drift(self):
+        PlaylistSong.objects.create(playlist=self.playlist, song=self.songs[0], order=1)
+        PlaylistSong.objects.create(playlist=self.playlist, song=self.songs[1], order=2)
+        self.assertStats(0, 0)
+
+        out = StringIO()
+        call_command('reconcile_playlist_stats', stdout=out)
+
+        self.assertIn('Reconciled 1 playlists.', out.getvalue())
+        self.assertStats(2, 201)
+
+
+class CachedJWTUserTests(TestCase):
+    def setUp(self):
+        user_cache.clear_local()
+        self.user = User.objects.create_user(username='listener', password='pass12345')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.url = f'/api/follows/is-following/?user_id={self.user.id}'
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_user_lookup_is_cached_between_requests(self):
+        # The first request resolves the user from the database, later ones
+        # only run the view's own query.
+        self.assertEqual(self.count_queries(), 2)
+        self.assertEqual(self.count_queries(), 1)
+
+    def test_each_request_gets_its_own_user(self):
+        cache.clear()
+        authentication = CachedJWTAuthentication()
+        token = authentication.get_validated_token(str(AccessToken.for_user(self.user)))
+
+        # A cache miss, then a hit, must both leave the cached user untouched.
+        for _ in range(2):
+            user = authentication.get_user(token)
+            user.first_name = 'Mutated'
+            user._state.fields_cache['profile'] = None
+        cached = user_cache.get(self.user.pk)
+        self.assertEqual(cached.first_name, '')
+        self.assertNotIn('profile', cached._state.fields_cache)
+
+    def test_deactivation_invalidates_cached_user(self):
+        self.count_queries()
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+
+class ObjectPayloadCacheTests(TestCase):
+    def setUp(self):
+        metrics_registry.clear()
+        self.addCleanup(metrics_registry.clear)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='owner', password='pass12345', first_name='Old')
+        self.profile = UserProfile.objects.create(user=self.user, display_name='Owner')
+        self.artist = Artist.objects.create(name='Artist', managed_by=self.user)
+        self.album = Album.objects.create(title='Album', artist=self.artist, cover_art_upload='images/a.png')
+        self.song = make_song(self.artist)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_repeated_retrieve_runs_no_queries(self):
+        for url in (f'/api/songs/{self.song.pk}/', f'/api/albums/{self.album.pk}/',
+                    f'/api/public-artists/{self.artist.pk}/'):
+            first, first_queries = self.get(url)
+            second, second_queries = self.get(url)
+            self.assertGreater(first_queries, 0)
+            self.assertEqual(second_queries, 0)
+            self.assertEqual(first, second)
+
+    def test_song_save_invalidates_payload(self):
+        self.get(f'/api/songs/{self.song.pk}/')
+        self.song.title = 'Renamed'
+        self.song.save()
+        payload, _ = self.get(f'/api/songs/{self.song.pk}/')
+        self.assertEqual(payload['title'], 'Renamed')
+
+    def test_pk_spelling_is_normalized(self):
+        url = f'/api/songs/{self.song.pk.hex.upper()}/'
+        self.get(url)
+        self.song.title = 'Renamed'
+        self.song.save()
+        payload, _ = self.get(url)
+        self.assertEqual(payload['title'], 'Renamed')
+
+        with mock.patch.object(song_payloads, 'get_or_set') as get_or_set:
+            self.assertEqual(self.client.get('/api/songs/not%20a%20uuid/').status_code, 404)
+        get_or_set.assert_not_called()
+
+    def test_artist_name_change_invalidates_songs_and_albums(self):
+        self.get(f'/api/songs/{self.song.pk}/')
+        self.get(f'/api/albums/{self.album.pk}/')
+        self.user.first_name = 'New'
+        self.user.save()
+        song, _ = self.get(f'/api/songs/{self.song.pk}/')
+        album, _ = self.get(f'/api/albums/{self.album.pk}/')
+        self.assertEqual(song['artist']['display_name'], 'New')
+        self.assertEqual(album['artist']['display_name'], 'New')
+
+    def test_profile_change_invalidates_artist(self):
+        self.get(f'/api/public-artists/{self.artist.pk}/')
+        self.profile.profile_picture_url = 'images/new.png'
+        self.profile.save()
+        artist, _ = self.get(f'/api/public-artists/{self.artist.pk}/')
+        self.assertIn('images/new.png', artist['managed_by']['profile']['profile_picture_url'])
+
+    def test_deleted_song_is_not_served(self):
+        self.get(f'/api/songs/{self.song.pk}/')
+        song_id = self.song.pk
+        self.song.delete()
+        self.assertEqual(self.client.get(f'/api/songs/{song_id}/').status_code, 404)
+
+    def test_hit_ratios_per_tier(self):
+        song_payloads.payloads.clear_local()
+        url = f'/api/songs/{self.song.pk}/'
+        self.get(url)
+        self.get(url)
+        song_payloads.payloads.clear_local()
+        self.get(url)
+
+        ratios = hit_ratios()['song-payload']
+        self.assertEqual(ratios['lookups'], 3)
+        self.assertEqual(ratios['local_hit_ratio'], round(1 / 3, 4))
+        self.assertEqual(ratios['shared_hit_ratio'], 0.5)
+
+        staff = User.objects.create_user(username='staff', password='pass12345', is_staff=True)
+        self.client.force_authenticate(staff)
+        self.assertEqual(self.client.get('/api/cache-stats/').json()['song-payload'], ratios)
+
+
+@override_settings(SINGLE_FLIGHT_POLL_INTERVAL=0, SINGLE_FLIGHT_WAIT_TIMEOUT=0.5)
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.compute = mock.Mock(return_value='fresh')
+
+    def hold_lock(self, name):
+        self.assertTrue(cache.add(f'single-flight:{name}', 1))
+
+    def test_first_caller_computes_and_releases_lock(self):
+        self.assertEqual(single_flight('key', self.compute, read=lambda: None), 'fresh')
+        self.assertEqual(single_flight('key', self.compute, read=lambda: None), 'fresh')
+        self.assertEqual(self.compute.call_count, 2)
+
+    def test_others_get_stale_value_while_locked(self):
+        self.hold_lock('key')
+        self.assertEqual(single_flight('key', self.compute, read=lambda: None, stale='stale'), 'stale')
+        self.compute.assert_not_called()
+
+    def test_others_wait_for_the_recomputed_value(self):
+        self.hold_lock('key')
+        read = mock.Mock(side_effect=[None, None, 'recomputed'])
+        self.assertEqual(single_flight('key', self.compute, read=read), 'recomputed')
+        self.compute.assert_not_called()
+
+    def test_computes_when_lock_holder_takes_too_long(self):
+        self.hold_lock('key')
+        with override_settings(SINGLE_FLIGHT_WAIT_TIMEOUT=0):
+            self.assertEqual(single_flight('key', self.compute, read=lambda: None), 'fresh')
+
+    def test_expired_entry_served_stale_during_refresh(self):
+        results = StaleWhileRevalidateCache('test-swr', fresh_timeout=0, stale_timeout=60)
+        self.assertEqual(results.get_or_set('query', lambda: 'old'), 'old')
+        self.hold_lock(results.make_key('query'))
+        self.assertEqual(results.get_or_set('query', self.compute), 'old')
+        cache.delete(f"single-flight:{results.make_key('query')}")
+        self.assertEqual(results.get_or_set('query', self.compute), 'fresh')
+
+    def test_changed_song_served_stale_while_rebuilt(self):
+        user = User.objects.create_user(username='owner', password='pass12345')
+        song = make_song(Artist.objects.create(name='Artist', managed_by=user), title='Old')
+        client = APIClient()
+        url = f'/api/songs/{song.pk}/'
+        client.get(url)
+
+        song.title = 'New'
+        song.save()
+        self.hold_lock(f'song:{song.pk}:{song_payloads.version(song.pk)}')
+        self.assertEqual(client.get(url).json()['title'], 'Old')
+
+        cache.delete(f'single-flight:song:{song.pk}:{song_payloads.version(song.pk)}')
+        self.assertEqual(client.get(url).json()['title'], 'New')
+
+
+class ArtistPageTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='owner', password='pass12345')
+        UserProfile.objects.create(user=self.user, display_name='Owner', followers_count=3)
+        self.artist = Artist.objects.create(name='Artist', managed_by=self.user)
+        self.url = f'/api/public-artists/{self.artist.pk}/page/'
+        for i in range(3):
+            album = Album.objects.create(title=f'Album {i}', artist=self.artist, cover_art_upload='images/a.png')
+            for j in range(5):
+                song = make_song(self.artist, title=f'Song {i}-{j}')
+                song.album = album
+                song.play_count = i * 5 + j
+                song.save()
+
+    def test_page_contents(self):
+        page = self.client.get(self.url).json()
+        self.assertEqual(page['artist']['id'], str(self.artist.pk))
+        self.assertEqual(page['artist']['managed_by']['profile']['display_name'], 'Owner')
+        self.assertEqual(len(page['albums']), 3)
+        self.assertEqual(len(page['top_songs']), 10)
+        self.assertEqual(page['top_songs'][0]['title'], 'Song 2-4')
+        self.assertEqual(page['counts'], {'songs': 15, 'albums': 3, 'followers': 3, 'following': 0})
+        self.assertNotIn('is_following', page)
+
+    def test_pk_spelling_is_normalized(self):
+        url = f'/api/public-artists/{self.artist.pk.hex.upper()}/page/'
+        self.assertEqual(self.client.get(url).json()['counts']['songs'], 15)
+        make_song(self.artist, title='New')
+        self.assertEqual(self.client.get(url).json()['counts']['songs'], 16)
+
+        with mock.patch.object(artist_pages, 'get_or_set') as get_or_set:
+            self.assertEqual(self.client.get('/api/public-artists/not%20a%20uuid/page/').status_code, 404)
+        get_or_set.assert_not_called()
+
+    def test_fixed_number_of_queries_then_cached(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(len(queries), 4)
+        self.assertWithinQueryBudget(response)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertEqual(len(queries), 0)
+
+    def test_follow_status_added_per_user(self):
+        fan = User.objects.create_user(username='fan', password='pass12345')
+        Follow.objects.create(follower=fan, following=self.user)
+        self.client.get(self.url)
+        self.client.force_authenticate(fan)
+        self.assertTrue(self.client.get(self.url).json()['is_following'])
+
+    def test_new_song_invalidates_page(self):
+        self.client.get(self.url)
+        song = make_song(self.artist, title='Hit')
+        song.play_count = 1000
+        song.save()
+        page = self.client.get(self.url).json()
+        self.assertEqual(page['top_songs'][0]['title'], 'Hit')
+        self.assertEqual(page['counts']['songs'], 16)
+
+    def test_unknown_artist(self):
+        self.assertEqual(self.client.get(f'/api/public-artists/{User().pk}/page/').status_code, 404)
+
+
+class SongBatchTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create_user(username='owner', password='pass12345')
+        artist = Artist.objects.create(name='Artist', managed_by=user)
+        self.songs = [make_song(artist, title=f'Song {i}') for i in range(20)]
+        self.url = '/api/songs/batch/'
+
+    def post(self, song_ids):
+        return self.client.post(self.url, {'song_ids': [str(song_id) for song_id in song_ids]}, format='json')
+
+    def test_songs_in_request_order_with_missing_reported(self):
+        unknown = User().pk
+        ids = [self.songs[5].pk, unknown, self.songs[1].pk, self.songs[5].pk]
+        response = self.post(ids)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([song['title'] for song in response.json()['songs']], ['Song 5', 'Song 1'])
+        self.assertEqual(response.json()['missing'], [str(unknown)])
+
+    def test_one_query_plus_prefetch_then_cached(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post([song.pk for song in self.songs])
+        self.assertEqual(len(queries), 2)
+        self.assertWithinQueryBudget(response)
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.post([song.pk for song in self.songs])
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(cached.json(), response.json())
+
+    def test_missing_versions_are_created_in_bulk(self):
+        cache.clear()
+        pks = [str(song.pk) for song in self.songs]
+        # No per-id version() round trips (get, add, get) for a cold batch.
+        with mock.patch.object(song_payloads, 'version', wraps=song_payloads.version) as version, \
+                mock.patch.object(cache, 'add', wraps=cache.add) as add:
+            versions, found = song_payloads.get_many(pks)
+        version.assert_not_called()
+        add.assert_not_called()
+        self.assertEqual(found, {})
+        self.assertEqual(versions, {pk: song_payloads.version(pk) for pk in pks})
+
+    def test_shares_payloads_with_retrieve(self):
+        detail = self.client.get(f'/api/songs/{self.songs[0].pk}/').json()
+        self.assertEqual(self.post([self.songs[0].pk]).json()['songs'], [detail])
+
+        self.songs[0].title = 'Renamed'
+        self.songs[0].save()
+        self.assertEqual(self.post([self.songs[0].pk]).json()['songs'][0]['title'], 'Renamed')
+
+    def test_too_many_ids(self):
+        self.assertEqual(self.post([User().pk for _ in range(301)]).status_code, 400)
+
+
+class SparseFieldsetsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='owner', password='pass12345')
+        UserProfile.objects.create(user=self.user, display_name='Owner')
+        self.artist = Artist.objects.create(name='Artist', managed_by=self.user)
+        self.songs = [make_song(self.artist, title=f'Song {i}') for i in range(5)]
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), [query['sql'] for query in queries]
+
+    def test_fields_trims_output_queries_and_signing(self):
+        with mock.patch.object(Song.audio_file_url.field.storage, 'url', return_value='signed') as sign:
+            body, queries = self.get('/api/songs/', {'fields': 'id,title,signed_cover_url'})
+        self.assertEqual(set(body['results'][0]), {'id', 'title', 'signed_cover_url'})
+        # Only covers are signed, and neither artists nor genres are loaded.
+        self.assertEqual(sign.call_count, 5)
+        self.assertFalse(any('w_server_user' in sql or 'w_server_genre' in sql for sql in queries))
+
+    def test_full_representation_loads_relations_up_front(self):
+        body, queries = self.get('/api/songs/', {})
+        self.assertEqual(body['results'][0]['artist']['username'], 'owner')
+        # COUNT, songs joined to their artist and manager, genres.
+        self.assertEqual(len(queries), 3)
+
+    def test_expand_collapses_unlisted_relations(self):
+        collapsed, _ = self.get(f'/api/songs/{self.songs[0].pk}/', {'expand': ''})
+        self.assertEqual(collapsed['artist'], str(self.artist.pk))
+        expanded, _ = self.get(f'/api/songs/{self.songs[0].pk}/', {'expand': 'artist'})
+        self.assertEqual(expanded['artist']['username'], 'owner')
+
+    def test_artist_without_manager_runs_one_query(self):
+        body, queries = self.get(f'/api/public-artists/{self.artist.pk}/', {'fields': 'id,genre'})
+        self.assertEqual(body, {'id': str(self.artist.pk), 'genre': None})
+        self.assertEqual(len(queries), 1)
+
+    def test_playlist_fields_do_not_apply_to_inline_songs(self):
+        playlist = Playlist.objects.create(title='Mix', owner=self.user, cover_art_upload='images/mix.png')
+        PlaylistSong.objects.create(playlist=playlist, song=self.songs[0], order=1)
+        body, _ = self.get(f'/api/playlists/{playlist.pk}/', {'fields': 'id,songs', 'expand': ''})
+        self.assertEqual(set(body), {'id', 'songs'})
+        self.assertEqual(body['songs'][0]['artist']['username'], 'owner')
+
+
+class RendererTests(TestCase):
+    def test_orjson_output_matches_drf_json(self):
+        data = {
+            'id': uuid.uuid4(),
+            'created_at': timezone.now(),
+            'price': Decimal('1.50'),
+            'label': gettext_lazy('Song'),
+            'nested': [{'n': 1, 'ratio': 0.5, 'name': 'Tēwodros'}],
+            3: None,
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_indent_requested_by_browsable_api(self):
+        body = ORJSONRenderer().render({'a': 1}, 'application/json; indent=4')
+        self.assertEqual(json.loads(body), {'a': 1})
+        self.assertIn(b'\n', body)
+
+    def test_api_responses_rendered_with_orjson(self):
+        response = APIClient().get('/api/songs/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIsInstance(response.accepted_renderer, ORJSONRenderer)
+
+    @unittest.skipUnless(find_spec('msgpack'), 'msgpack is not installed')
+    def test_msgpack_selected_by_accept_header(self):
+        import msgpack
+
+        response = APIClient().get('/api/songs/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['count'], 0)
+
+
+class RefreshTokenBlacklistTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        User.objects.create_user(username='listener', password='pass12345')
+
+    def obtain_refresh(self):
+        response = self.client.post('/api/token/', {'username': 'listener', 'password': 'pass12345'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['refresh']
+
+    def test_rotated_refresh_token_is_rejected(self):
+        refresh = self.obtain_refresh()
+
+        response = self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('refresh', response.data)
+
+        # The old token is answered from the shared cache, without a blacklist query.
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+    def test_blacklist_survives_cache_loss(self):
+        refresh = self.obtain_refresh()
+        self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        cache.clear()
+
+        response = self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_purge_expired_tokens_in_chunks(self):
+        now = timezone.now()
+        OutstandingToken.objects.bulk_create([
+            OutstandingToken(jti=f'expired-{i}', token='', expires_at=now - timedelta(minutes=1))
+            for i in range(5)
+        ] + [OutstandingToken(jti='live', token='', expires_at=now + timedelta(days=1))])
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti='expired-0'))
+
+        out = StringIO()
+        call_command('purge_expired_tokens', chunk_size=2, stdout=out)
+
+        self.assertIn('Purged 5 expired tokens.', out.getvalue())
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), ['live'])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+class CheckUsernameTests(TestCase):
+    url = '/api/users/check_username/'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        User.objects.create_user(username='Taken', password='pass12345')
+
+    def test_lookup_is_case_insensitive_and_cached(self):
+        response = self.client.get(self.url, {'username': 'taken'})
+        self.assertFalse(response.data['is_available'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'username': 'TAKEN'})
+        self.assertFalse(response.data['is_available'])
+
+    def test_cached_availability_is_cleared_on_signup(self):
+        self.assertTrue(self.client.get(self.url, {'username': 'newcomer'}).data['is_available'])
+
+        User.objects.create_user(username='NewComer', password='pass12345')
+
+        self.assertFalse(self.client.get(self.url, {'username': 'newcomer'}).data['is_available'])
+
+    def test_rename_frees_the_old_username(self):
+        self.assertFalse(self.client.get(self.url, {'username': 'taken'}).data['is_available'])
+
+        user = User.objects.get(username='Taken')
+        user.username = 'Renamed'
+        user.save()
+
+        self.assertTrue(self.client.get(self.url, {'username': 'taken'}).data['is_available'])
+        self.assertFalse(self.client.get(self.url, {'username': 'renamed'}).data['is_available'])
+
+    def test_anonymous_checks_are_throttled(self):
+        with mock.patch.dict(UsernameCheckThrottle.THROTTLE_RATES, {'username_check': '2/min'}):
+            statuses = [self.client.get(self.url, {'username': f'user{i}'}).status_code for i in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+
+@mock.patch.dict(settings.DATABASES, {'replica': {}})
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def route(self, request, write=False):
+        used = {}
+
+        def view(request):
+            if write:
+                used['write'] = self.router.db_for_write(Song)
+            used['read'] = self.router.db_for_read(Song)
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return used, response
+
+    def test_safe_requests_read_from_replica(self):
+        used, _ = self.route(self.factory.get('/api/songs/'))
+        self.assertEqual(used['read'], 'replica')
+        self.assertEqual(self.router.db_for_read(Song), 'default')
+
+    def test_writes_go_to_primary_and_pin_the_request(self):
+        used, _ = self.route(self.factory.get('/api/profiles/my-profile/'), write=True)
+        self.assertEqual(used, {'write': 'default', 'read': 'default'})
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        used, response = self.route(self.factory.post('/api/songs/'), write=True)
+        self.assertEqual(used['read'], 'default')
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+        request = self.factory.get('/api/songs/')
+        request.COOKIES[STICKY_COOKIE] = '1'
+        used, _ = self.route(request)
+        self.assertEqual(used['read'], 'default')
+
+
+class DbPoolStatsTests(TestCase):
+    def test_stats_are_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='listener', password='pass12345'))
+        self.assertEqual(client.get('/api/db-pool-stats/').status_code, 403)
+
+        client.force_authenticate(User.objects.create_user(username='admin', password='pass12345', is_staff=True))
+        response = client.get('/api/db-pool-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pooled', response.data['default'])
+
+
+def sequential_scans(queryset):
+    """
+    Returns the lines of the query plan that read a whole table. On
+    PostgreSQL sequential scans are disabled first, so one only shows up
+    when no index can serve the query at all.
+    """
+    if connection.vendor == 'postgresql':
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+        return [line for line in plan.splitlines() if 'Seq Scan' in line]
+    plan = queryset.explain()
+    return [line for line in plan.splitlines() if re.search(r'\bSCAN w_server_\w+( AS \w+)?$', line.strip())]
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAINs the querysets behind the filtered list endpoints and fails when
+    one of them would read a whole table. Unfiltered listings (all songs,
+    all artists) are paginated scans by design and are not covered.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username=f'user{i}', password='pass12345') for i in range(20)]
+        for user in cls.users:
+            UserProfile.objects.create(user=user, display_name=user.username)
+        cls.artists = [Artist.objects.create(name=f'Artist {i}', managed_by=user) for i, user in enumerate(cls.users[:10])]
+        cls.albums = [
+            Album.objects.create(title=f'Album {i}', artist=artist, cover_art_upload='images/a.png')
+            for i, artist in enumerate(cls.artists)
+        ]
+        songs = [
+            Song(title=f'Song {i}', artist=cls.artists[i % 10], album=cls.albums[i % 10],
+                 duration_seconds=180, audio_file_url='songs/s.mp3')
+            for i in range(100)
+        ]
+        Song.objects.bulk_create(songs)
+        cls.playlists = [
+            Playlist.objects.create(title=f'Mix {i}', owner=cls.users[i % 20], is_public=i % 3 != 0,
+                                    cover_art_upload='images/p.png')
+            for i in range(40)
+        ]
+        PlaylistSong.objects.bulk_create([
+            PlaylistSong(playlist=playlist, song=song, order=order)
+            for playlist in cls.playlists[:5]
+            for order, song in enumerate(songs[:30], start=1)
+        ])
+        Follow.objects.bulk_create([
+            Follow(follower=follower, following=following)
+            for follower in cls.users
+            for following in cls.users[:5]
+            if follower != following
+        ])
+
+    def get_queryset(self, viewset_class, user=None, query=None, kwargs=None, action='list'):
+        request = APIRequestFactory().get('/', query or {})
+        force_authenticate(request, user=user)
+        view = viewset_class(action=action, action_map={'get': action}, kwargs=kwargs or {}, format_kwarg=None)
+        view.request = view.initialize_request(request)
+        view.request.user  # Run authentication.
+        return view.get_queryset()
+
+    def assertUsesIndexes(self, queryset):
+        self.assertEqual(sequential_scans(queryset), [], queryset.explain())
+
+    def test_artist_by_manager(self):
+        user = self.users[0]
+        self.assertUsesIndexes(self.get_queryset(ArtistViewSets, user=user, query={'artist_id': user.id}))
+
+    def test_albums_by_artist(self):
+        query = {'artist_id': self.artists[0].id}
+        self.assertUsesIndexes(self.get_queryset(AlbumViewSets, query=query))
+
+    def test_album_songs(self):
+        kwargs = {'album_pk': self.albums[0].id}
+        self.assertUsesIndexes(self.get_queryset(AlbumSongViewSets, kwargs=kwargs))
+
+    def test_artist_songs_by_newest(self):
+        kwargs = {'artist_pk': self.artists[0].id}
+        self.assertUsesIndexes(self.get_queryset(ArtistSongViewSets, kwargs=kwargs))
+
+    def test_public_playlists(self):
+        self.assertUsesIndexes(self.get_queryset(PlayListViewSets))
+
+    def test_my_playlists(self):
+        query = {'my-playlists': 'true'}
+        self.assertUsesIndexes(self.get_queryset(PlayListViewSets, user=self.users[0], query=query))
+
+    @unittest.skipIf(connection.vendor == 'sqlite', "SQLite cannot use a partial index inside an OR.")
+    def test_visible_playlists(self):
+        self.assertUsesIndexes(self.get_queryset(PlayListViewSets, user=self.users[0]))
+
+    def test_playlist_songs_in_order(self):
+        self.assertUsesIndexes(self.playlists[0].ordered_songs())
+
+    def test_my_follows(self):
+        self.assertUsesIndexes(self.get_queryset(FollowViewSet, user=self.users[0]))
+
+    def test_my_followers(self):
+        self.assertUsesIndexes(UserProfile.objects.filter(user__following__following=self.users[0]))
+
+    def test_my_profile(self):
+        self.assertUsesIndexes(self.get_queryset(UserProfileViewSets, user=self.users[0]))
+
+
+class SeedCatalogTests(TestCase):
+    def seed(self):
+        call_command('seed_catalog', seed=3, users=30, artists=5, albums=8, songs=60, playlists=10, stdout=StringIO())
+        return list(Song.objects.order_by('id').values_list('id', 'artist_id', 'play_count'))
+
+    def test_seeding_is_deterministic_and_consistent(self):
+        first = self.seed()
+        self.assertEqual(len(first), 60)
+
+        # Seeded playlist aggregates match a recount.
+        stats = list(Playlist.objects.order_by('id').values_list('songs_count', 'total_duration_seconds'))
+        Playlist.refresh_stats()
+        self.assertEqual(stats, list(Playlist.objects.order_by('id').values_list('songs_count', 'total_duration_seconds')))
+
+        for model in (PlaylistSong, Playlist, Follow, Song, Album, Artist, UserProfile, User):
+            model.objects.all().delete()
+        self.assertEqual(self.seed(), first)
+
+    def test_reseeding_with_the_same_seed_is_refused(self):
+        self.seed()
+        with self.assertRaisesMessage(CommandError, '--seed 3 is already in this database'):
+            self.seed()
+        call_command('seed_catalog', seed=4, users=10, artists=2, albums=2, songs=10, playlists=2, stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='seed4_').count(), 10)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0.0, PROFILING_MAX_PROFILES=2, PROFILING_DIR=directory.name,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.staff = User.objects.create_user(username='staff', password='pass12345', is_staff=True)
+        self.user = User.objects.create_user(username='listener', password='pass12345')
+        # A new client loads the middleware with the overridden settings.
+        self.client = APIClient()
+
+    def test_disabled_middleware_is_not_installed(self):
+        with override_settings(PROFILING_ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(lambda request: HttpResponse())
+
+    def test_staff_header_profiles_are_listed_and_downloadable(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/playlists/', HTTP_X_PROFILE='1')
+        profile_id = response['X-Profile-Id']
+
+        listing = self.client.get('/api/request-profiles/')
+        self.assertEqual(listing.status_code, 200)
+        self.assertEqual(listing.data[0]['id'], profile_id)
+        self.assertEqual(listing.data[0]['endpoint'], 'playlist-list')
+
+        download = self.client.get(f'/api/request-profiles/{profile_id}/')
+        self.assertEqual(download.status_code, 200)
+        self.assertGreater(len(b''.join(download.streaming_content)), 0)
+        self.assertEqual(self.client.get('/api/request-profiles/..%2Fsettings/').status_code, 404)
+
+    def test_header_from_non_staff_is_ignored(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/playlists/', HTTP_X_PROFILE='1')
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.client.get('/api/request-profiles/').status_code, 403)
+
+    def test_header_without_staff_credentials_is_not_profiled(self):
+        with mock.patch('washint_server.profiling.cProfile.Profile') as profile:
+            self.client.get('/api/playlists/', HTTP_X_PROFILE='1')
+            self.client.get('/api/playlists/', HTTP_X_PROFILE='1', HTTP_AUTHORIZATION='Bearer invalid')
+            self.client.force_authenticate(self.user)
+            self.client.get('/api/playlists/', HTTP_X_PROFILE='1')
+        profile.assert_not_called()
+
+    def test_ring_buffer_keeps_newest_profiles(self):
+        self.client.force_authenticate(self.staff)
+        with override_settings(PROFILING_SAMPLE_RATE=1.0):
+            for _ in range(4):
+                self.client.get('/api/playlists/')
+
+        self.assertEqual(len(self.client.get('/api/request-profiles/').data), 2)
+
+
+@override_settings(METRICS_TOKEN='scrape-token')
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics_registry.clear()
+        self.addCleanup(metrics_registry.clear)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='owner', password='pass12345')
+        artist = Artist.objects.create(name='Artist', managed_by=self.user)
+        make_song(artist)
+
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_requests_are_recorded_per_view_action(self):
+        self.client.get('/api/songs/')
+        self.client.get('/api/songs/')
+        self.client.get('/api/users/check_username/', {'username': 'owner'})
+        body = self.scrape()
+
+        self.assertIn('washint_http_requests_total{method="GET",status="200",view="SongViewSet.list"} 2', body)
+        self.assertIn('washint_http_request_duration_seconds_count{method="GET",view="SongViewSet.list"} 2', body)
+        self.assertIn('washint_http_request_duration_seconds_bucket{method="GET",view="SongViewSet.list",le="+Inf"} 2', body)
+        self.assertIn('washint_db_duration_seconds_count{method="GET",view="SongViewSet.list"} 2', body)
+        self.assertIn('washint_http_response_size_bytes_count{method="GET",view="UserViewSet.check_username"} 1', body)
+        self.assertIn('washint_cache_requests_total{cache="username-taken",result="miss"} 1', body)
+        # One cover and one audio URL signed per listed song.
+        self.assertIn('washint_storage_presign_duration_seconds_count 4', body)
+
+    def test_scrape_requires_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+
+    def test_totals_include_other_worker_processes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        other_worker = {
+            'counters': [['washint_db_queries_total', {'method': 'GET', 'view': 'SongViewSet.list'}, 5]],
+            'histograms': [],
+        }
+        with open(os.path.join(directory.name, '1.json'), 'w') as snapshot:
+            json.dump(other_worker, snapshot)
+
+        with override_settings(METRICS_DIR=directory.name):
+            metrics_registry.inc('washint_db_queries_total', {'method': 'GET', 'view': 'SongViewSet.list'}, 2)
+            metrics_registry.flush()
+            self.assertTrue(os.path.exists(os.path.join(directory.name, f'{os.getpid()}.json')))
+            body = self.scrape()
+
+        # 5 from the other worker's snapshot, 2 from this process.
+        self.assertIn('washint_db_queries_total{method="GET",view="SongViewSet.list"} 7', body)
+
+
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        # Processed synchronously with drain() instead of on the worker thread.
+        patcher = mock.patch.object(slow_query_log, 'start_worker')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # SLOW_QUERY_LOG_ENABLED is off by default, so install it by hand.
+        if slow_query_log not in connection.execute_wrappers:
+            slow_query_log.install(connection)
+            self.addCleanup(connection.execute_wrappers.remove, slow_query_log)
+        slow_query_log.drain()
+        SlowQuery.objects.all().delete()
+
+        self.client = APIClient()
+        user = User.objects.create_user(username='owner', password='pass12345')
+        Playlist.objects.create(title='Mix', owner=user, is_public=True, cover_art_upload='images/mix.png')
+
+    def test_shapes_ignore_literals_and_placeholder_counts(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE a IN (%s, %s) AND b = 'x' LIMIT 20"),
+            normalize_sql("SELECT * FROM t WHERE a IN (%s) AND b = 'y' LIMIT 40"),
+        )
+
+    def test_slow_queries_are_aggregated_per_shape_with_a_plan(self):
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0):
+            self.client.get('/api/playlists/')
+            self.client.get('/api/playlists/')
+        slow_query_log.drain()
+
+        playlists = SlowQuery.objects.get(shape__contains='FROM "w_server_playlist"', shape__startswith='SELECT "w_server_playlist"')
+        self.assertEqual(playlists.calls, 2)
+        self.assertGreater(playlists.total_ms, 0)
+        self.assertTrue(playlists.plan)
+
+        out = StringIO()
+        call_command('slow_query_report', '--limit', '50', stdout=out)
+        self.assertIn(playlists.shape, out.getvalue())
+
+    def test_locking_reads_are_not_explained(self):
+        sql = 'SELECT "w_server_playlist"."id" FROM "w_server_playlist" WHERE "w_server_playlist"."id" = %s FOR UPDATE'
+        slow_query_log.process('default', sql, ['x'], 500.0)
+
+        self.assertEqual(SlowQuery.objects.get().plan, '')
+
+    def test_fast_queries_are_not_recorded(self):
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=60_000):
+            self.client.get('/api/playlists/')
+        slow_query_log.drain()
+
+        self.assertFalse(SlowQuery.objects.exists())
+
+
+class CacheSettingsTests(SimpleTestCase):
+    def load_settings(self, **env):
+        return subprocess.run(
+            [sys.executable, '-c', 'import django; django.setup()'],
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'washint_server.settings', **env},
+            capture_output=True, text=True,
+        )
+
+    def test_local_cache_is_refused_outside_debug(self):
+        result = self.load_settings(DEBUG='False', CACHE_BACKEND='django.core.cache.backends.locmem.LocMemCache')
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('ImproperlyConfigured', result.stderr)
+
+        result = self.load_settings(DEBUG='False', CACHE_BACKEND='django.core.cache.backends.redis.RedisCache',
+                                    CACHE_LOCATION='redis://localhost:6379')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        result = self.load_settings(DEBUG='False', CACHE_BACKEND='django.core.cache.backends.locmem.LocMemCache',
+                                    CACHE_ALLOW_LOCAL='True')
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+class StartupProfileTests(SimpleTestCase):
+    def test_worker_boot_defers_heavy_imports(self):
+        out = StringIO()
+        # Import time depends on the machine, so only the budget check itself
+        # is exercised here (no boot imports in zero seconds); the command
+        # raises for eager imports of botocore, boto3, the S3 backend or
+        # mutagen before it gets to the budget.
+        with self.assertRaisesMessage(CommandError, 'budget'):
+            call_command('startup_profile', '--json', '--budget', '0', stdout=out)
+        profile = json.loads(out.getvalue())
+
+        self.assertEqual(profile['eager_lazy_modules'], [])
+        self.assertGreater(profile['imports_seconds'], 0)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pass12345')
+        self.other = User.objects.create_user(username='other', password='pass12345')
+        Follow.objects.create(follower=self.user, following=self.other)
+        self.artist = Artist.objects.create(name='Artist', managed_by=self.user)
+        self.song = make_song(self.artist)
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    async def test_is_following(self):
+        url = '/api/follows/is-following/'
+        response = await self.async_client.get(url, {'user_id': str(self.other.pk)}, headers=self.headers)
+        self.assertEqual(response.json(), {'is_following': True})
+
+        response = await self.async_client.get(url, {'user_id': str(self.user.pk)}, headers=self.headers)
+        self.assertEqual(response.json(), {'is_following': False})
+
+        response = await self.async_client.get(url, {'user_id': 'not-a-uuid'}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get(url, {'user_id': str(self.other.pk)})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_play_song_increments_play_count(self):
+        await cache.aclear()
+        url = f'/api/songs/{self.song.pk}/play/'
+        self.assertEqual((await self.async_client.post(url)).status_code, 204)
+        # Repeats by the same client within the window count once.
+        self.assertEqual((await self.async_client.post(url)).status_code, 204)
+        self.assertEqual((await self.async_client.post(url, headers=self.headers)).status_code, 204)
+        self.assertEqual((await self.async_client.get(url)).status_code, 405)
+        self.assertEqual((await self.async_client.post('/api/songs/00000000-0000-0000-0000-000000000000/play/')).status_code, 404)
+
+        song = await Song.objects.aget(pk=self.song.pk)
+        self.assertEqual(song.play_count, 2)
+
+    def test_play_song_is_throttled_per_client_ip(self):
+        cache.clear()
+        url = f'/api/songs/{self.song.pk}/play/'
+        with mock.patch.dict(PlayEventThrottle.THROTTLE_RATES, {'play_event': '2/min'}):
+            statuses = [self.client.post(url).status_code for _ in range(3)]
+            response = self.client.post(url, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(statuses, [204, 204, 429])
+        self.assertEqual(response.status_code, 204)
+
+    async def test_song_media_returns_signed_urls(self):
+        response = await self.async_client.get(f'/api/songs/{self.song.pk}/media/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Signature=', response.json()['signed_audio_url'])
+        self.assertIn('Signature=', response.json()['signed_cover_url'])
+        # Queries run by async views are still counted per request.
+        self.assertEqual(response.query_stats.queries, 1)
+
+    def test_search_without_query(self):
+        response = self.client.get('/api/search/')
+        self.assertEqual(response.json(), {'results': []})
+        self.assertEqual(self.client.post('/api/search/').status_code, 405)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pass12345')
+        self.artist = Artist.objects.create(name='Artist', managed_by=self.user)
+        self.songs = [make_song(self.artist, title=f'Song {i}') for i in range(5)]
+        other = Artist.objects.create(name='Other', managed_by=User.objects.create_user(username='other'))
+        make_song(other, title='Not mine')
+        self.client = APIClient()
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def test_ndjson_is_streamed_lazily(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/exports/songs/', headers=self.headers)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        # Songs are only read while the response is streamed.
+        self.assertFalse(any('FROM "w_server_song"' in query['sql'] for query in queries))
+
+        with override_settings(EXPORT_CHUNK_SIZE=2):
+            rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['title'] for row in rows], [f'Song {i}' for i in range(5)])
+        self.assertEqual(rows[0]['artist_name'], 'Artist')
+
+    def test_csv(self):
+        response = self.client.get('/api/exports/songs/', {'format': 'csv'}, headers=self.headers)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,title,artist_id,artist_name,album_id,album_title,duration_seconds,play_count,created_at')
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="songs.csv"')
+
+    def test_staff_export_every_artist(self):
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(staff)}'}
+        response = self.client.get('/api/exports/play-stats/', headers=headers)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(row['name'], row['songs_count']) for row in rows], [('Artist', 5), ('Other', 1)])
+
+        response = self.client.get('/api/exports/play-stats/', {'artist_id': str(self.artist.pk)}, headers=headers)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 1)
+
+    def test_rejected_requests(self):
+        self.assertEqual(self.client.get('/api/exports/songs/').status_code, 401)
+        self.assertEqual(self.client.get('/api/exports/songs/', {'format': 'xml'}, headers=self.headers).status_code, 400)
+        self.assertEqual(self.client.get('/api/exports/albums/', headers=self.headers).status_code, 404)
+        listener = User.objects.create_user(username='listener')
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(listener)}'}
+        self.assertEqual(self.client.get('/api/exports/songs/', headers=headers).status_code, 403)
+
+    async def test_asgi_streams_asynchronously(self):
+        response = await self.async_client.get('/api/exports/songs/', {'format': 'csv'}, headers=self.headers)
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.splitlines()), 6)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_catalog', 'songs', '--artist-id', str(self.artist.pk), stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 5)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class SyncTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='owner', password='pass12345')
+        self.artist = Artist.objects.create(name='Artist', managed_by=self.user)
+        self.song = make_song(self.artist)
+        self.playlist = Playlist.objects.create(title='Mix', owner=self.user, cover_art_upload='images/mix.png')
+        self.client.force_authenticate(self.user)
+        self.token = self.client.get('/api/sync/').data['token']
+
+    def sync(self, token=None):
+        response = self.client.get('/api/sync/', {'since': token or self.token})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_initial_call_returns_token_and_reset(self):
+        data = self.client.get('/api/sync/').data
+        self.assertTrue(data['reset'])
+        self.assertEqual(data['token'], str(SyncChange.objects.latest('id').id))
+        self.assertEqual(self.sync(), {'token': self.token, 'changes': [], 'has_more': False, 'reset': False})
+
+    def test_changes_are_collapsed_per_object(self):
+        self.client.post(f'/api/playlists/{self.playlist.id}/songs/add-songs/', {'song_ids': [str(self.song.id)]}, format='json')
+        self.playlist.refresh_from_db()
+        self.playlist.title = 'Renamed'
+        self.playlist.save()
+        other = User.objects.create_user(username='fan')
+        follow = Follow.objects.create(follower=other, following=self.user)
+        album = Album.objects.create(title='Album', artist=self.artist)
+        album_id = str(album.pk)
+        album.delete()
+
+        # Reset check, change log, high-water mark, then one query per kind
+        # plus playlist songs.
+        with self.assertNumQueries(6):
+            data = self.sync()
+        changes = {(change['kind'], change['op']): change for change in data['changes']}
+        self.assertEqual(len(data['changes']), 3)
+        playlist = changes[('playlist', 'upsert')]['data']
+        self.assertEqual((playlist['title'], playlist['songs_count'], playlist['song_ids']), ('Renamed', 1, [self.song.id]))
+        self.assertEqual(changes[('follow', 'upsert')]['data']['follower_id'], other.id)
+        self.assertEqual(changes[('album', 'delete')]['id'], album_id)
+        self.assertEqual(self.sync(data['token'])['changes'], [])
+
+        follow.delete()
+        self.playlist.delete()
+        ops = {(change['kind'], change['op']) for change in self.sync(data['token'])['changes']}
+        self.assertEqual(ops, {('follow', 'delete'), ('playlist', 'delete')})
+
+    def test_other_users_changes_are_not_returned(self):
+        Playlist.objects.create(title='Theirs', owner=User.objects.create_user(username='other'))
+        self.assertEqual(self.sync()['changes'], [])
+
+    def test_paging_and_settling(self):
+        for i in range(3):
+            make_song(self.artist, title=f'Song {i}')
+        with override_settings(SYNC_PAGE_SIZE=2):
+            first = self.sync()
+            self.assertTrue(first['has_more'])
+            second = self.sync(first['token'])
+        self.assertEqual(len(first['changes']) + len(second['changes']), 3)
+        self.assertFalse(second['has_more'])
+
+        make_song(self.artist, title='Fresh')
+        with override_settings(SYNC_SETTLE_SECONDS=60):
+            data = self.sync(second['token'])
+        # Held back without has_more, so clients do not poll until it settles.
+        self.assertEqual((data['changes'], data['token'], data['has_more']), ([], second['token'], False))
+        self.assertEqual([change['data']['title'] for change in self.sync(data['token'])['changes']], ['Fresh'])
+
+    def test_pruned_token_needs_reset(self):
+        make_song(self.artist, title='Later')
+        SyncChange.objects.update(created_at=timezone.now() - timedelta(days=40))
+        make_song(self.artist, title='Kept')
+        call_command('prune_sync_changes', stdout=StringIO())
+        self.assertEqual(SyncChange.objects.count(), 1)
+        self.assertTrue(self.sync('1')['reset'])
+        self.assertEqual(self.client.get('/api/sync/', {'since': 'abc'}).status_code, 400)
+
+    def test_users_without_changes_sync_after_prune(self):
+        make_song(self.artist, title='Later')
+        SyncChange.objects.update(created_at=timezone.now() - timedelta(days=40))
+        Playlist.objects.create(title='Theirs', owner=User.objects.create_user(username='other'))
+        call_command('prune_sync_changes', stdout=StringIO())
+
+        newcomer = User.objects.create_user(username='newcomer')
+        self.client.force_authenticate(newcomer)
+        token = self.client.get('/api/sync/').data['token']
+        for _ in range(3):
+            data = self.sync(token)
+            self.assertFalse(data['reset'])
+            token = data['token']
+
+
+class EndpointBenchmarkTests(TestCase):
+    def test_endpoints_match_baseline(self):
+        # Latency is left to the bench_endpoints command; query counts and
+        # response sizes are deterministic, so they are checked on every run.
+        results = benchmark.run(benchmark.seed(), iterations=1)
+        self.assertEqual(benchmark.regressions(results, benchmark.load_baseline(), check_latency=False), [])
@@ -1,6 +1,5 @@
 # your_app_name/utils.py
 
-from mutagen import File as MutagenFile
 from io import BytesIO
 
 def get_audio_duration(audio_file):
@@ -13,6 +12,9 @@ def get_audio_duration(audio_file):
     Returns:
         float: The duration of the audio in seconds, or None if the duration cannot be determined.
     """
+    # Imported on first use so workers that never handle uploads skip it.
+    from mutagen import File as MutagenFile
+
     try:
         # Mutagen can read from a file-like object, which the uploaded file is.
         # We need to seek to the beginning of the file to ensure Mutagen can read it.
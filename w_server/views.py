@@ -1,26 +1,90 @@
+import hmac
+import math
+import uuid
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from rest_framework import viewsets, permissions, status,serializers
 from rest_framework.decorators import action
 from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
 from django.http import JsonResponse
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework.exceptions import ValidationError
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 from .models import UserProfile,Artist,Song,Album,Playlist,PlaylistSong,Follow
-from .serializers import UserSerializer, UserProfileSerializer,ArtistSerializer,SongSerializer,AlbumSerializer,ArtistListSerializer,PlaylistListSerializer,PlaylistDetailSerializer,PlaylistCreateSerializer,AddSongToPlaylistSerializer,PlaylistSongSerializer,FollowSerializer
+from .serializers import UserSerializer, UserProfileSerializer,ArtistSerializer,SongSerializer,AlbumSerializer,ArtistListSerializer,PlaylistListSerializer,PlaylistDetailSerializer,PlaylistCreateSerializer,AddSongToPlaylistSerializer,PlaylistSongSerializer,FollowSerializer,BulkPlaylistSongsSerializer,SongBatchSerializer
 from .permissions import IsUserOrAdmin, IsOwnerOrReadOnly
+from . import exports, sync as sync_log
 from washint_server.pagination import MyLimitOffsetPagination 
+from washint_server.throttling import PlayEventThrottle, UsernameCheckThrottle
+from washint_server.authentication import aauthenticate_request, authenticate_request
+from washint_server.db_pool import pool_stats
+from washint_server.metrics import registry as metrics, render as render_metrics
+from washint_server.profiling import recent_profiles, profile_path
+from washint_server.renderers import ORJSONResponse
+from .cache import album_payloads, artist_pages, artist_payloads, hit_ratios, play_event_key, search_results, song_payloads, username_availability_key
 from django.conf import settings
-from django.db.models import F
-from django.http import HttpResponse
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
-from botocore.exceptions import ClientError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Lower
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, FileResponse, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 User = get_user_model()
 
+class SparseFieldsetsViewMixin:
+    """
+    Enables `?fields=` and `?expand=` (see serializers.SparseFieldsetsMixin)
+    on list and retrieve, and loads related rows for exactly the fields
+    that will be rendered.
+    """
+    sparse_actions = ('list', 'retrieve')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['sparse_fieldsets'] = self.action in self.sparse_actions
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in self.sparse_actions:
+            eager_load = getattr(self.get_serializer(), 'eager_load', None)
+            if eager_load is not None:
+                queryset = eager_load(queryset)
+        return queryset
+
+
+class CachedRetrieveMixin:
+    """
+    Serves `retrieve` from `payload_cache`, a VersionedCache of serialized
+    payloads that the signals in models.py keep current. Permissions and
+    throttles still run on every request; requests with query parameters
+    bypass the cache, since they may filter the queryset. After a change,
+    one worker rebuilds the payload while the others serve the previous one.
+    """
+    payload_cache = None
+
+    def retrieve(self, request, *args, **kwargs):
+        retrieve = super().retrieve
+        if request.query_params:
+            return retrieve(request, *args, **kwargs)
+        payload = self.payload_cache.get_or_set(self.cache_pk(), lambda: retrieve(request, *args, **kwargs).data)
+        return Response(payload)
+
+    def cache_pk(self):
+        # Keyed like the signals bump versions, whatever case or hyphenation
+        # the URL used; malformed ids 404 before touching the cache.
+        try:
+            return str(uuid.UUID(self.kwargs[self.lookup_url_kwarg or self.lookup_field]))
+        except ValueError:
+            raise Http404
+
+
 class UserViewSet(viewsets.ModelViewSet):
     """
     A ViewSet for viewing and editing user instances.
@@ -28,6 +92,7 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = MyLimitOffsetPagination # Add this line
+    query_budgets = {'check_username': 1}
 
     def get_permissions(self):
         """
@@ -42,7 +107,7 @@ class UserViewSet(viewsets.ModelViewSet):
         else:
             return [permissions.IsAuthenticated(), IsUserOrAdmin()]
         
-    @action(detail=False, methods=['get'], permission_classes=[AllowAny])
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny], throttle_classes=[UsernameCheckThrottle])
     def check_username(self, request):
         """
         Check if a username is already taken.
@@ -54,7 +119,18 @@ class UserViewSet(viewsets.ModelViewSet):
                 {'message': 'Please provide a username to check.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        is_taken = User.objects.filter(username__iexact=username).exists()
+        cache_key = username_availability_key(username)
+        is_taken = cache.get(cache_key)
+        metrics.inc('washint_cache_requests_total', {
+            'cache': 'username-taken', 'result': 'miss' if is_taken is None else 'shared_hit',
+        })
+        if is_taken is None:
+            # Matches the lower(username) unique index, unlike username__iexact.
+            is_taken = User.objects.alias(username_lower=Lower('username')).filter(
+                username_lower=username.lower()
+            ).exists()
+            timeout = settings.USERNAME_TAKEN_CACHE_TIMEOUT if is_taken else settings.USERNAME_AVAILABLE_CACHE_TIMEOUT
+            cache.set(cache_key, is_taken, timeout)
         if is_taken:
             return Response (
                 {'is_available': False, 'message': 'This username is already taken.'},
@@ -107,7 +183,7 @@ class UserProfileViewSets(viewsets.ModelViewSet):
         serializer = self.get_serializer(user.profile)
         return Response({'profile':serializer.data})
 
-class ArtistViewSets(viewsets.ModelViewSet):
+class ArtistViewSets(SparseFieldsetsViewMixin, viewsets.ModelViewSet):
     queryset = Artist.objects.all()
     serializer_class = ArtistSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly,IsOwnerOrReadOnly]
@@ -140,20 +216,73 @@ class ArtistViewSets(viewsets.ModelViewSet):
             queryset = Artist.objects.filter(managed_by=self.request.user)
 
         return queryset
-class PublicArtistViewSet(viewsets.ReadOnlyModelViewSet):
+class PublicArtistViewSet(SparseFieldsetsViewMixin, CachedRetrieveMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Artist.objects.all()
+    payload_cache = artist_payloads
     serializer_class = ArtistSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly,IsOwnerOrReadOnly]
     pagination_class = MyLimitOffsetPagination 
 
+    query_budgets = {'page': 5}
+    page_top_songs = 10
+
     def get_serializer_class(self):
         if(self.action == 'list'):
             return ArtistListSerializer
         if(self.action == 'retrieve'):
             return ArtistSerializer
         return ArtistSerializer
-class SongViewSet(viewsets.ModelViewSet):
+
+    def get_queryset(self):
+        if self.action == 'page':
+            songs = Song.objects.filter(artist=OuterRef('pk')).order_by().values('artist')
+            return Artist.objects.select_related('managed_by__profile').annotate(
+                songs_count=Coalesce(Subquery(songs.annotate(total=Count('pk')).values('total')), 0),
+            )
+        return super().get_queryset()
+
+    @action(detail=True, methods=['get'])
+    def page(self, request, pk=None):
+        """
+        Everything an artist page shows: the artist with its manager's
+        profile, all albums, the top songs by play count and counts. Built
+        in four queries and cached as one payload; follow status is added
+        per request, the fifth query in the budget.
+        """
+        payload = artist_pages.get_or_set(self.cache_pk(), self.build_page)
+        user = payload['artist']['managed_by']
+        if request.user.is_authenticated and user is not None:
+            payload = {
+                **payload,
+                'is_following': Follow.objects.filter(follower=request.user, following_id=user['id']).exists(),
+            }
+        return Response(payload)
+
+    def build_page(self):
+        artist = self.get_object()
+        albums = list(artist.albums.order_by('-created_at'))
+        top_songs = list(artist.songs.prefetch_related('genres').order_by('-play_count', '-created_at')[:self.page_top_songs])
+        # Both serializers show the artist's manager, which is loaded already.
+        for item in albums + top_songs:
+            item.artist = artist
+
+        context = self.get_serializer_context()
+        profile = getattr(artist.managed_by, 'profile', None)
+        return {
+            'artist': ArtistSerializer(artist, context=context).data,
+            'albums': AlbumSerializer(albums, many=True, context=context).data,
+            'top_songs': SongSerializer(top_songs, many=True, context=context).data,
+            'counts': {
+                'songs': artist.songs_count,
+                'albums': len(albums),
+                'followers': profile.followers_count if profile else 0,
+                'following': profile.following_count if profile else 0,
+            },
+        }
+class SongViewSet(SparseFieldsetsViewMixin, CachedRetrieveMixin, viewsets.ModelViewSet):
     queryset = Song.objects.all()
+    payload_cache = song_payloads
+    query_budgets = {'batch': 2}
     serializer_class = SongSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly,IsOwnerOrReadOnly]
     pagination_class = MyLimitOffsetPagination 
@@ -170,8 +299,38 @@ class SongViewSet(viewsets.ModelViewSet):
 
         serializer.save(artist=artist)
 
-class AlbumViewSets(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'], permission_classes=[AllowAny], parser_classes=[JSONParser])
+    def batch(self, request):
+        """
+        Fetch many songs by id in one request, e.g. to hydrate a play queue.
+        Body: {"song_ids": [<uuid>, ...]}. Songs come back in request order;
+        ids that match no song are listed under "missing".
+        """
+        serializer = SongBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        song_ids = serializer.validated_data['song_ids']
+
+        versions, payloads = song_payloads.get_many(song_ids)
+        uncached = [song_id for song_id in song_ids if song_id not in payloads]
+        if uncached:
+            songs = list(
+                Song.objects.filter(id__in=uncached).select_related('artist__managed_by').prefetch_related('genres')
+            )
+            built = {
+                song.id: data for song, data in
+                zip(songs, self.get_serializer(songs, many=True).data)
+            }
+            song_payloads.set_many(versions, built)
+            payloads.update(built)
+
+        return Response({
+            'songs': [payloads[song_id] for song_id in song_ids if song_id in payloads],
+            'missing': [song_id for song_id in song_ids if song_id not in payloads],
+        })
+
+class AlbumViewSets(SparseFieldsetsViewMixin, CachedRetrieveMixin, viewsets.ModelViewSet):
     queryset = Album.objects.all()
+    payload_cache = album_payloads
     serializer_class = AlbumSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly,IsOwnerOrReadOnly]
     pagination_class = MyLimitOffsetPagination 
@@ -191,7 +350,7 @@ class AlbumViewSets(viewsets.ModelViewSet):
             return self.queryset.filter(artist=artist)
         except Artist.DoesNotExist:
             return self.queryset.none()
-class AlbumSongViewSets(viewsets.ReadOnlyModelViewSet):
+class AlbumSongViewSets(SparseFieldsetsViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     A nested ViewSet for listing songs within a specific album.
     """
@@ -207,9 +366,11 @@ class AlbumSongViewSets(viewsets.ReadOnlyModelViewSet):
 
         return album.songs.all()
 
-class PlayListViewSets(viewsets.ModelViewSet):
+class PlayListViewSets(SparseFieldsetsViewMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly,IsOwnerOrReadOnly]
     pagination_class = MyLimitOffsetPagination 
+    # Including the authenticated user lookup; enforced by the tests.
+    query_budgets = {'list': 3, 'retrieve': 4}
     def get_serializer_class(self):
        
         if self.action == 'list':
@@ -225,22 +386,43 @@ class PlayListViewSets(viewsets.ModelViewSet):
         user = self.request.user
         
         if self.request.query_params.get('my-playlists') == 'true' and user.is_authenticated:
-            return Playlist.objects.filter(owner=user).order_by('created_at').distinct()
+            return Playlist.objects.filter(owner=user).select_related('owner__profile').order_by('created_at').distinct()
         
         if user.is_authenticated:
-            queryset = queryset | Playlist.objects.filter(is_public=False, owner=user)
+            # A plain OR keeps both branches index-backed (public partial
+            # index, owner index); no joins are involved, so no DISTINCT.
+            queryset = Playlist.objects.filter(Q(is_public=True) | Q(owner=user))
         
-        return queryset.order_by('created_at').distinct()
+        return queryset.select_related('owner__profile').order_by('created_at')
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 class PlaylistSongViewSet(viewsets.ViewSet):
     """
     A ViewSet for managing songs in a playlist.
     """
+    query_budgets = {'list': 5, 'add_songs': 12, 'remove_songs': 9}
+
     def get_playlist(self):
         playlist_id = self.kwargs.get('playlist_pk')
         return get_object_or_404(Playlist, id=playlist_id)
 
+    def get_owned_playlist(self):
+        # Other users' playlists 404 rather than 403, so private ones stay hidden.
+        return get_object_or_404(Playlist, id=self.kwargs.get('playlist_pk'), owner=self.request.user)
+
+    def list(self, request, playlist_pk=None):
+        """
+        List the songs of a playlist in playlist order, paginated.
+        """
+        playlist = self.get_playlist()
+        if not playlist.is_public and playlist.owner_id != request.user.pk:
+            return Response({"detail": "No Playlist matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+
+        paginator = MyLimitOffsetPagination()
+        page = paginator.paginate_queryset(playlist.ordered_songs(), request, view=self)
+        serializer = SongSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
     @action(detail=False, methods=['post'], url_path='add-song')
     def add_song(self, request, playlist_pk=None):
         """
@@ -260,14 +442,43 @@ class PlaylistSongViewSet(viewsets.ViewSet):
         playlist = self.get_playlist()
         
         try:
-            playlist_song = PlaylistSong.objects.get(playlist=playlist, song__id=song_pk)
-            playlist_song.delete()
+            playlist_song = PlaylistSong.objects.select_related('song').get(playlist=playlist, song__id=song_pk)
+            with transaction.atomic():
+                playlist_song.delete()
+                playlist.adjust_stats(-1, -playlist_song.song.duration_seconds)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except PlaylistSong.DoesNotExist:
             return Response({"detail": "Song not found in the playlist."}, status=status.HTTP_404_NOT_FOUND)
 
+    @action(detail=False, methods=['post'], url_path='add-songs', permission_classes=[IsAuthenticated])
+    def add_songs(self, request, playlist_pk=None):
+        """
+        Add many songs to a specific playlist in one request.
+        Body: {"song_ids": [<uuid>, ...]}. Songs are appended in the given order.
+        Only the playlist's owner can add songs.
+        """
+        playlist = self.get_owned_playlist()
+        serializer = BulkPlaylistSongsSerializer(data=request.data, context={'playlist': playlist})
+        serializer.is_valid(raise_exception=True)
+        results = serializer.add_songs()
+        added = sum(1 for item in results if item['status'] == 'added')
+        return Response({'added': added, 'results': results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='remove-songs', permission_classes=[IsAuthenticated])
+    def remove_songs(self, request, playlist_pk=None):
+        """
+        Remove many songs from a specific playlist in one request.
+        Body: {"song_ids": [<uuid>, ...]}. Only the playlist's owner can remove songs.
+        """
+        playlist = self.get_owned_playlist()
+        serializer = BulkPlaylistSongsSerializer(data=request.data, context={'playlist': playlist})
+        serializer.is_valid(raise_exception=True)
+        results = serializer.remove_songs()
+        removed = sum(1 for item in results if item['status'] == 'removed')
+        return Response({'removed': removed, 'results': results}, status=status.HTTP_200_OK)
+
     
-class ArtistSongViewSets(viewsets.ModelViewSet):
+class ArtistSongViewSets(SparseFieldsetsViewMixin, viewsets.ModelViewSet):
     queryset = Song.objects.all()
     serializer_class = SongSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly,IsOwnerOrReadOnly]
@@ -276,7 +487,7 @@ class ArtistSongViewSets(viewsets.ModelViewSet):
     def get_queryset(self):
         artist_id = self.kwargs.get('artist_pk')
         artist = get_object_or_404(Artist, id=artist_id)
-        return artist.songs.all()
+        return artist.songs.order_by('-created_at')
 class FollowViewSet(viewsets.ModelViewSet):
     queryset = Follow.objects.all()
     serializer_class = FollowSerializer
@@ -327,35 +538,52 @@ class FollowViewSet(viewsets.ModelViewSet):
         )
         serializer = UserProfileSerializer(following_profiles, many=True, context={'request': request})
         return Response(serializer.data)
-    @action(detail=False, methods=['get'], url_path='is-following')
-    def is_following(self, request):
-        """
-        Checks if the current user is following the user specified by `user_id` query param.
-        Example: /api/follows/is-following/?user_id=<uuid>
-        """
-        target_user_id = request.query_params.get('user_id')
-        
-        if not target_user_id:
-            return Response({"detail": "User ID not provided."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        is_following = Follow.objects.filter(
-            follower=request.user,
-            following_id=target_user_id
-        ).exists()
-
-        return Response({"is_following": is_following})
 
-@api_view(['GET'])
-def search(request):
-    """
-    Performs a full-text search across songs, artists, and albums using weighted ranking.
-    The query is provided via the 'q' query parameter.
-    """
-    query_string = request.GET.get('q', '')
+# Async views. DRF cannot serve async views, so these are plain Django views
+# that authenticate with aauthenticate_request when they need a user. Under
+# ASGI they run on the event loop; storage URLs are signed off it, in a
+# worker thread, since the S3 client is synchronous.
+
+def _signed_url(file_field):
+    return file_field.url if file_field else None
+
+
+def _profile_picture_url(user):
+    profile = getattr(user, 'profile', None)
+    return _signed_url(profile.profile_picture_url) if profile else None
+
+
+def _detail(detail, status_code):
+    return JsonResponse({"detail": str(detail)}, status=status_code)
+
+
+def _search_results(request, songs, artists, albums):
+    # Runs outside the event loop: serializing signs one URL per file field.
+    return {
+        'songs': SongSerializer(songs, many=True, context={'request': request}).data,
+        'artists': [
+            {
+                'id': artist.id,
+                'name': artist.name,
+                'rank': artist.rank,
+                'signed_profile_url': _profile_picture_url(artist.managed_by),
+            }
+            for artist in artists
+        ],
+        'albums': [
+            {
+                'id': album.id,
+                'title': album.title,
+                'artist_name': album.artist.name,
+                'rank': album.rank,
+                'signed_cover_art_url': _signed_url(album.cover_art_upload),
+            }
+            for album in albums
+        ],
+    }
 
-    if not query_string:
-        return JsonResponse({"results": []})
 
+async def _search(request, query_string):
     query = SearchQuery(query_string)
 
     weights = [1.0, 0.8, 0.6, 0.4]
@@ -368,46 +596,250 @@ def search(request):
         ) + SearchVector(
             'artist__name', weight='C', config='english'
         )
-    ).filter(search_vector=query)
-
-    songs_results = []
-    for song in songs_queryset.annotate(rank=SearchRank(F('search_vector'), query, weights=weights)).order_by('-rank')[:20]:
-        serializer = SongSerializer(song, context={'request': request})
-        songs_results.append(serializer.data)
+    ).filter(search_vector=query).select_related('artist__managed_by').prefetch_related('genres')
+    songs = [
+        song async for song in
+        songs_queryset.annotate(rank=SearchRank(F('search_vector'), query, weights=weights)).order_by('-rank')[:20]
+    ]
 
     artists_queryset = Artist.objects.annotate(
         search_vector=SearchVector('name', weight='A', config='english')
-    ).filter(search_vector=query)
-
-    artists_results = []
-    for artist in artists_queryset.annotate(rank=SearchRank(F('search_vector'), query, weights=weights)).order_by('-rank')[:20]:
-        profile = getattr(artist.managed_by, 'profile', None)
-        signed_profile_url = profile.profile_picture_url.url if profile and profile.profile_picture_url else None
-        artists_results.append({
-            'id': artist.id,
-            'name': artist.name,
-            'rank': artist.rank,
-            'signed_profile_url': signed_profile_url,
-        })
+    ).filter(search_vector=query).select_related('managed_by__profile')
+    artists = [
+        artist async for artist in
+        artists_queryset.annotate(rank=SearchRank(F('search_vector'), query, weights=weights)).order_by('-rank')[:20]
+    ]
 
     albums_queryset = Album.objects.annotate(
         search_vector=SearchVector('title', weight='A', config='english') + SearchVector('artist__name', weight='B', config='english')
-    ).filter(search_vector=query)
-    
-    albums_results = []
-    for album in albums_queryset.annotate(rank=SearchRank(F('search_vector'), query, weights=weights)).order_by('-rank')[:20]:
-        albums_results.append({
-            'id': album.id,
-            'title': album.title,
-            'artist_name': album.artist.name,
-            'rank': album.rank,
-            'signed_cover_art_url': album.cover_art_upload.url if album.cover_art_upload else None
-        })
+    ).filter(search_vector=query).select_related('artist')
+    albums = [
+        album async for album in
+        albums_queryset.annotate(rank=SearchRank(F('search_vector'), query, weights=weights)).order_by('-rank')[:20]
+    ]
 
-    results = {
-        'songs': songs_results,
-        'artists': artists_results,
-        'albums': albums_results
-    }
+    return await sync_to_async(_search_results, thread_sensitive=False)(request, songs, artists, albums)
+
+
+@require_GET
+async def search(request):
+    """
+    Performs a full-text search across songs, artists, and albums using weighted ranking.
+    The query is provided via the 'q' query parameter.
+    """
+    query_string = ' '.join(request.GET.get('q', '').lower().split())
+
+    if not query_string:
+        return JsonResponse({"results": []})
+
+    # Results are the same for everyone, so popular queries are computed by
+    # one worker at a time and served stale while they refresh.
+    results = await search_results.aget_or_set(query_string, lambda: _search(request, query_string))
+    return ORJSONResponse(results)
+
+
+@csrf_exempt
+@require_POST
+async def play_song(request, pk):
+    """
+    Records one play of a song. Anonymous plays count too. Requests are
+    throttled per client IP, and a client's repeated plays of a song within
+    PLAY_EVENT_DEDUPE_SECONDS count once.
+    """
+    try:
+        user = await aauthenticate_request(request)
+    except AuthenticationFailed as exc:
+        return _detail(exc.detail, exc.status_code)
+
+    throttle = PlayEventThrottle()
+    if not await sync_to_async(throttle.allow_request)(request, None):
+        response = _detail("Request was throttled.", status.HTTP_429_TOO_MANY_REQUESTS)
+        response['Retry-After'] = str(math.ceil(throttle.wait()))
+        return response
+
+    client = f"user:{user.pk}" if user.is_authenticated else f"ip:{throttle.get_ident(request)}"
+    if not await cache.aadd(play_event_key(pk, client), True, settings.PLAY_EVENT_DEDUPE_SECONDS):
+        found = await Song.objects.filter(pk=pk).aexists()
+    else:
+        found = await Song.objects.filter(pk=pk).aupdate(play_count=F('play_count') + 1)
+    if not found:
+        return _detail("No Song matches the given query.", status.HTTP_404_NOT_FOUND)
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+@require_GET
+async def is_following(request):
+    """
+    Checks if the current user is following the user specified by `user_id` query param.
+    Example: /api/follows/is-following/?user_id=<uuid>
+    """
+    try:
+        user = await aauthenticate_request(request)
+    except AuthenticationFailed as exc:
+        return _detail(exc.detail, exc.status_code)
+    if not user.is_authenticated:
+        return _detail("Authentication credentials were not provided.", status.HTTP_401_UNAUTHORIZED)
+
+    target_user_id = request.GET.get('user_id')
+    if not target_user_id:
+        return _detail("User ID not provided.", status.HTTP_400_BAD_REQUEST)
+    try:
+        uuid.UUID(target_user_id)
+    except ValueError:
+        return _detail("Invalid user ID.", status.HTTP_400_BAD_REQUEST)
+
+    following = await Follow.objects.filter(follower=user, following_id=target_user_id).aexists()
+    return JsonResponse({"is_following": following})
+
+
+@require_GET
+async def song_media(request, pk):
+    """
+    Signed audio and cover URLs of a song.
+    """
+    song = await Song.objects.only('id', 'audio_file_url', 'song_cover_upload').filter(pk=pk).afirst()
+    if song is None:
+        return _detail("No Song matches the given query.", status.HTTP_404_NOT_FOUND)
+    audio_url, cover_url = await sync_to_async(
+        lambda: (_signed_url(song.audio_file_url), _signed_url(song.song_cover_upload)),
+        thread_sensitive=False,
+    )()
+    return JsonResponse({'id': song.id, 'signed_audio_url': audio_url, 'signed_cover_url': cover_url})
+
+
+@require_GET
+async def album_media(request, pk):
+    """
+    Signed cover art URL of an album.
+    """
+    album = await Album.objects.only('id', 'cover_art_upload').filter(pk=pk).afirst()
+    if album is None:
+        return _detail("No Album matches the given query.", status.HTTP_404_NOT_FOUND)
+    cover_url = await sync_to_async(_signed_url, thread_sensitive=False)(album.cover_art_upload)
+    return JsonResponse({'id': album.id, 'signed_cover_art_url': cover_url})
+
+@require_GET
+def export(request, kind):
+    """
+    Streams the song catalog (`songs`) or per-artist play totals
+    (`play-stats`) as NDJSON (default) or CSV: /api/exports/songs/?format=csv.
+    Artists get their own rows; staff get everything, or one artist's with
+    `artist_id`. Rows are streamed from the database, never held in memory.
+    """
+    try:
+        user = authenticate_request(request)
+    except AuthenticationFailed as exc:
+        return _detail(exc.detail, exc.status_code)
+    if not user.is_authenticated:
+        return _detail("Authentication credentials were not provided.", status.HTTP_401_UNAUTHORIZED)
+    if kind not in exports.EXPORTS:
+        return _detail("Unknown export.", status.HTTP_404_NOT_FOUND)
+    file_format = request.GET.get('format', 'ndjson')
+    if file_format not in exports.FORMATS:
+        return _detail(f"Format must be one of: {', '.join(exports.FORMATS)}.", status.HTTP_400_BAD_REQUEST)
+
+    artist_id = request.GET.get('artist_id')
+    if user.is_staff:
+        try:
+            artist_ids = [uuid.UUID(artist_id)] if artist_id else None
+        except ValueError:
+            return _detail("Invalid artist ID.", status.HTTP_400_BAD_REQUEST)
+    else:
+        artist_ids = list(Artist.objects.filter(managed_by=user).values_list('id', flat=True))
+        if not artist_ids:
+            return _detail("You do not manage an artist.", status.HTTP_403_FORBIDDEN)
+
+    rows, fields = exports.EXPORTS[kind]
+    # A sync iterator would be read into memory whole under ASGI, and an
+    # async one under WSGI.
+    stream = exports.astream if isinstance(request, ASGIRequest) else exports.stream
+    response = StreamingHttpResponse(
+        stream(rows(artist_ids), fields, file_format),
+        content_type=exports.FORMATS[file_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{file_format}"'
+    return response
 
-    return JsonResponse(results)
\ No newline at end of file
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def db_pool_stats(request):
+    """
+    Database connection pool stats (in use, waiting, wait time) for the
+    worker process that serves the request.
+    """
+    return Response(pool_stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def sync(request):
+    """
+    Delta sync of the user's playlists (with their song ids), follows and
+    owned songs and albums. Without `since`, returns the current token and
+    `reset`: the client downloads everything, then calls
+    /api/sync/?since=<token> to get only what changed since. Each change is
+    the object's latest state (`upsert`, with compact `data`) or `delete`.
+    Keep calling with the returned token while `has_more` is true; changes
+    younger than SYNC_SETTLE_SECONDS come with the next regular sync. `reset`
+    means the token is too old and the client must download everything again.
+    """
+    since = request.query_params.get('since')
+    if since is None:
+        return Response({'token': str(sync_log.current_token()), 'changes': [], 'has_more': False, 'reset': True})
+    try:
+        since = int(since)
+        if since < 0:
+            raise ValueError
+    except ValueError:
+        return Response({"detail": "since must be a token returned by this endpoint."}, status=status.HTTP_400_BAD_REQUEST)
+    if sync_log.needs_reset(since):
+        return Response({'token': str(sync_log.current_token()), 'changes': [], 'has_more': False, 'reset': True})
+
+    changes, token, has_more = sync_log.changes_since(request.user, since, settings.SYNC_PAGE_SIZE)
+    return Response({'token': str(token), 'changes': changes, 'has_more': has_more, 'reset': False})
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def cache_stats(request):
+    """
+    Local and shared hit ratios of every two-tier cache, across all worker
+    processes that report to METRICS_DIR.
+    """
+    return Response(hit_ratios())
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def profiles(request):
+    """
+    Lists the request profiles kept by ProfilingMiddleware, newest first.
+    """
+    return Response(recent_profiles())
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def profile_download(request, profile_id):
+    """
+    Downloads one profile as a cProfile/pstats dump (e.g. for snakeviz).
+    """
+    path = profile_path(profile_id)
+    if path is None:
+        raise Http404
+    return FileResponse(path.open('rb'), as_attachment=True, filename=path.name)
+
+
+def prometheus_metrics(request):
+    """
+    Request, database, storage and cache metrics in the Prometheus text
+    format, summed over all worker processes.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        raise Http404
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
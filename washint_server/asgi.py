@@ -12,5 +12,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'washint_server.settings')
+os.environ.setdefault('WASHINT_WORKER_TYPE', 'asgi')
 
 application = get_asgi_application()
@@ -1,9 +1,54 @@
 # your_app/authentication.py
 
+import copy
+
+from asgiref.sync import sync_to_async
+from django.utils.translation import gettext_lazy as _
+from rest_framework.request import Request
+from rest_framework.settings import api_settings as drf_settings
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
 from rest_framework.exceptions import AuthenticationFailed
 
-class JWTCookieAuthentication(JWTAuthentication):
+from w_server.cache import user_cache
+
+
+class CachedUserMixin:
+    """
+    Resolves the token's user through the two-tier user cache before falling
+    back to the primary-key query. The active and password-change checks are
+    still applied to cached users.
+    """
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            # Cache a copy: the in-process tier must not share this request's object.
+            user_cache.set(user_id, copy.copy(user))
+            return user
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        # The in-process tier hands out the same object to every request, so
+        # give each request its own copy to mutate.
+        return copy.copy(user)
+
+
+class CachedJWTAuthentication(CachedUserMixin, JWTAuthentication):
+    pass
+
+
+class JWTCookieAuthentication(CachedUserMixin, JWTAuthentication):
     def authenticate(self, request):
         # First, try to get the token from the Authorization header (standard behavior)
         header = self.get_header(request)
@@ -17,4 +62,19 @@ class JWTCookieAuthentication(JWTAuthentication):
 
         # Authenticate the token from the cookie
         validated_token = self.get_validated_token(raw_token)
-        return self.get_user(validated_token), validated_token
\ No newline at end of file
+        return self.get_user(validated_token), validated_token
+
+
+def authenticate_request(request):
+    """
+    Runs the configured DRF authentication classes for a plain Django view
+    (the async views, which DRF cannot serve). Returns AnonymousUser when no
+    credentials were sent; raises AuthenticationFailed for bad ones.
+    """
+    authenticators = [authentication() for authentication in drf_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    return Request(request, authenticators=authenticators).user
+
+
+async def aauthenticate_request(request):
+    # The user lookup may hit the cache or the database, both synchronous.
+    return await sync_to_async(authenticate_request)(request)
@@ -0,0 +1,42 @@
+# washint_server/db_pool.py
+
+from django.db import connections
+
+
+def pool_stats():
+    """
+    Connection stats for every configured database alias in this process.
+    Pooled aliases report psycopg_pool's counters; others report their
+    persistent-connection settings.
+    """
+    stats = {}
+    for alias in connections:
+        connection = connections[alias]
+        pool = getattr(connection, 'pool', None)
+        if pool is None:
+            stats[alias] = {
+                'pooled': False,
+                'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+                'health_checks': connection.settings_dict['CONN_HEALTH_CHECKS'],
+                'connected': connection.connection is not None,
+            }
+            continue
+
+        raw = pool.get_stats()
+        size = raw.get('pool_size', 0)
+        available = raw.get('pool_available', 0)
+        stats[alias] = {
+            'pooled': True,
+            'min_size': raw.get('pool_min', pool.min_size),
+            'max_size': raw.get('pool_max', pool.max_size),
+            'size': size,
+            'in_use': size - available,
+            'available': available,
+            'waiting': raw.get('requests_waiting', 0),
+            'requests': raw.get('requests_num', 0),
+            'requests_queued': raw.get('requests_queued', 0),
+            'requests_wait_ms': raw.get('requests_wait_ms', 0),
+            'requests_errors': raw.get('requests_errors', 0),
+            'connections_lost': raw.get('connections_lost', 0),
+        }
+    return stats
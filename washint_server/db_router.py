@@ -0,0 +1,89 @@
+# washint_server/db_router.py
+
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICA_ALIAS = 'replica'
+PRIMARY_ALIAS = 'default'
+# Set on responses to writes so the same client keeps reading from the
+# primary until the replica has caught up with its own changes.
+STICKY_COOKIE = 'db_primary'
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the replica while ReplicaRoutingMiddleware says the current
+    request may use it, and everything else to the primary. Once a request
+    writes, the rest of it reads from the primary too.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and REPLICA_ALIAS in settings.DATABASES:
+            return REPLICA_ALIAS
+        return PRIMARY_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _use_replica.set(False)
+        return PRIMARY_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is populated by replication, never migrated directly.
+        return db == PRIMARY_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets safe-method requests read from the replica, unless the client wrote
+    within the last DATABASE_REPLICA_STICKY_SECONDS (read-your-writes).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _use_replica.set(self.may_use_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        # sync_to_async copies the context into its thread, so the ORM calls
+        # of async views see the flag as well.
+        token = _use_replica.set(self.may_use_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+        return self.process_response(request, response)
+
+    def may_use_replica(self, request):
+        return request.method in SAFE_METHODS and STICKY_COOKIE not in request.COOKIES
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(
+                STICKY_COOKIE,
+                '1',
+                max_age=settings.DATABASE_REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -0,0 +1,228 @@
+# washint_server/metrics.py
+
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PRESIGN_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name: (type, help, buckets)
+METRICS = {
+    'washint_http_requests_total': (
+        'counter', 'Requests handled, by view action, method and status.', None),
+    'washint_http_request_duration_seconds': (
+        'histogram', 'Time spent handling a request.', LATENCY_BUCKETS),
+    'washint_http_response_size_bytes': (
+        'histogram', 'Size of response bodies (streamed responses excluded).', SIZE_BUCKETS),
+    'washint_db_duration_seconds': (
+        'histogram', 'Database time spent per request.', LATENCY_BUCKETS),
+    'washint_db_queries_total': (
+        'counter', 'Database queries run while handling requests.', None),
+    'washint_storage_presign_duration_seconds': (
+        'histogram', 'Time spent signing storage URLs.', PRESIGN_BUCKETS),
+    'washint_cache_requests_total': (
+        'counter', 'Cache lookups, by cache and result.', None),
+    'washint_single_flight_total': (
+        'counter', 'Expired cache entries, by whether this worker recomputed, served stale or waited.', None),
+}
+
+
+class Registry:
+    """
+    Counters and histograms of this process. With METRICS_DIR set, every
+    process periodically writes its totals there, and scrapes add them up,
+    so any gunicorn worker can answer /metrics for all of them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._flushed_at = time.monotonic()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = {'counts': [0] * (len(buckets) + 1), 'sum': 0.0}
+            series['counts'][index] += 1
+            series['sum'] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, dict(labels), list(series['counts']), series['sum']]
+                    for (name, labels), series in self._histograms.items()
+                ],
+            }
+
+    def flush(self):
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        # Written to a temporary file and renamed, so readers never see a
+        # partial snapshot.
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'w') as temp_file:
+            json.dump(self.snapshot(), temp_file)
+        os.replace(temp_path, Path(directory) / f'{os.getpid()}.json')
+        self._flushed_at = time.monotonic()
+
+    def maybe_flush(self):
+        if settings.METRICS_DIR and time.monotonic() - self._flushed_at >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+registry = Registry()
+
+
+def collect():
+    """
+    Totals across every process that has written to METRICS_DIR, with this
+    process's own numbers taken live.
+    """
+    snapshots = [registry.snapshot()]
+    if settings.METRICS_DIR:
+        own_file = f'{os.getpid()}.json'
+        for path in Path(settings.METRICS_DIR).glob('*.json'):
+            if path.name == own_file:
+                continue
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue
+
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total in snapshot['histograms']:
+            key = (name, tuple(sorted(labels.items())))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+    return counters, histograms
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """
+    Every metric in the Prometheus text exposition format (version 0.0.4).
+    """
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            continue
+        for (series_name, labels), (counts, total) in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def view_label(request):
+    """
+    `ViewSet.action` for viewsets, the function name for @api_view and
+    plain (async) function views.
+    """
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+    if view_class is None:
+        return match.func.__name__
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        return f'{view_class.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+    return view_class.__name__
+
+
+class MetricsMiddleware:
+    """
+    Records latency, response size and database time per view action.
+    Must sit above QueryBudgetMiddleware, whose query stats it reads.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        return self.record(request, response, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        return self.record(request, response, time.perf_counter() - started)
+
+    def record(self, request, response, duration):
+        labels = {'view': view_label(request), 'method': request.method}
+        registry.inc('washint_http_requests_total', {**labels, 'status': str(response.status_code)})
+        registry.observe('washint_http_request_duration_seconds', labels, duration)
+        if not response.streaming:
+            registry.observe('washint_http_response_size_bytes', labels, len(response.content))
+        stats = getattr(response, 'query_stats', None)
+        if stats is not None:
+            registry.observe('washint_db_duration_seconds', labels, stats.duration)
+            registry.inc('washint_db_queries_total', labels, stats.queries)
+        registry.maybe_flush()
+        return response
@@ -0,0 +1,129 @@
+# washint_server/profiling.py
+
+import cProfile
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import authenticate_request
+
+# Staff requests carrying this header are always profiled.
+PROFILE_HEADER = 'X-Profile'
+PROFILE_NAME = re.compile(r'^[0-9]{8}T[0-9]{6}-[\w.-]+-[0-9a-f]{8}$')
+
+# Only one cProfile profiler can be active per interpreter on newer Pythons,
+# so concurrent requests skip profiling instead of failing.
+_profiler_lock = threading.Lock()
+
+
+def profiles_dir():
+    return Path(settings.PROFILING_DIR)
+
+
+def recent_profiles():
+    """
+    Metadata of the stored profiles, newest first.
+    """
+    profiles = []
+    for meta_path in sorted(profiles_dir().glob('*.json'), reverse=True):
+        try:
+            profiles.append(json.loads(meta_path.read_text()))
+        except (OSError, ValueError):
+            # Removed by a concurrent rotation, or half written.
+            continue
+    return profiles
+
+
+def profile_path(name):
+    """
+    Path of a stored profile, or None for unknown or malformed names.
+    """
+    if not PROFILE_NAME.match(name):
+        return None
+    path = profiles_dir() / f'{name}.prof'
+    return path if path.exists() else None
+
+
+def _rotate(directory, keep):
+    # Names start with a timestamp, so lexical order is age order.
+    for meta_path in sorted(directory.glob('*.json'))[:-keep or None]:
+        meta_path.with_suffix('.prof').unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    """
+    Runs cProfile over a sample of requests (PROFILING_SAMPLE_RATE) and over
+    staff requests sent with an X-Profile header, and keeps the last
+    PROFILING_MAX_PROFILES profiles in PROFILING_DIR. Not installed at all
+    unless PROFILING_ENABLED is set.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        requested = PROFILE_HEADER in request.headers and self.is_staff(request)
+        sampled = random.random() < settings.PROFILING_SAMPLE_RATE
+        if not (requested or sampled) or not _profiler_lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - started
+        finally:
+            _profiler_lock.release()
+
+        name = self.save(profiler, request, response, duration)
+        if requested:
+            response['X-Profile-Id'] = name
+        return response
+
+    def is_staff(self, request):
+        # Checked before profiling starts, so anonymous clients cannot slow
+        # their requests down or hold the profiler lock with the header.
+        try:
+            return authenticate_request(request).is_staff
+        except AuthenticationFailed:
+            return False
+
+    def save(self, profiler, request, response, duration):
+        match = request.resolver_match
+        endpoint = match.view_name if match else 'unresolved'
+        name = '{}-{}-{}'.format(
+            timezone.now().strftime('%Y%m%dT%H%M%S'),
+            re.sub(r'[^\w.-]', '_', f'{request.method}.{endpoint}'),
+            uuid.uuid4().hex[:8],
+        )
+        directory = profiles_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(directory / f'{name}.prof')
+        # The metadata is written last: listing only sees complete profiles.
+        (directory / f'{name}.json').write_text(json.dumps({
+            'id': name,
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'created_at': timezone.now().isoformat(),
+        }))
+        _rotate(directory, settings.PROFILING_MAX_PROFILES)
+        return name
@@ -0,0 +1,169 @@
+# washint_server/query_budget.py
+
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Stats of the request being handled. A context variable rather than a
+# per-connection wrapper, so queries that async views run through
+# sync_to_async threads are counted too.
+_current_stats = ContextVar('query_stats', default=None)
+
+# Placeholder lists of any length collapse to one shape, so `IN (%s, %s)` and
+# `IN (%s, %s, %s)` count as the same query.
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*%s\s*,)*\s*%s\s*\)')
+
+
+def query_shape(sql):
+    return _PLACEHOLDER_LIST.sub('(...)', sql)
+
+
+class QueryStats:
+    """
+    Counts the queries, database time and repeated query shapes of one
+    request. Fed by record_query while QueryBudgetMiddleware has it active.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.budget = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.queries += 1
+            self.shapes[query_shape(sql)] += 1
+
+    @property
+    def duration_ms(self):
+        return round(self.duration * 1000, 2)
+
+    @property
+    def duplicates(self):
+        """Queries beyond the first of each shape; N+1s show up here."""
+        return self.queries - len(self.shapes)
+
+    def repeated_shapes(self):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > 1]
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.queries > self.budget
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def install(connection):
+    """Adds record_query to a connection's execute wrappers, once."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def query_budget_for(request):
+    """
+    The query budget declared for the view that handled the request.
+    ViewSets declare them per action, e.g. `query_budgets = {'list': 3}`.
+    """
+    match = request.resolver_match
+    if match is None:
+        return None
+    view_class = getattr(match.func, 'cls', None)
+    budgets = getattr(view_class, 'query_budgets', None)
+    actions = getattr(match.func, 'actions', None)
+    if not budgets or not actions:
+        return None
+    return budgets.get(actions.get(request.method.lower()))
+
+
+class QueryBudgetMiddleware:
+    """
+    Measures every request's queries and attaches the result to the response
+    as `response.query_stats`. Requests over their view's budget are logged
+    as warnings; with QUERY_BUDGET_HEADERS the counts are also sent as
+    X-DB-* response headers.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        token = _current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        token = _current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        stats.budget = query_budget_for(request)
+        response.query_stats = stats
+
+        if stats.over_budget:
+            logger.warning(
+                "%s %s ran %d queries (budget %d, %d duplicated): %s",
+                request.method, request.path, stats.queries, stats.budget, stats.duplicates,
+                stats.repeated_shapes()[:3],
+            )
+        elif settings.DEBUG:
+            logger.debug(
+                "%s %s ran %d queries in %sms (%d duplicated)",
+                request.method, request.path, stats.queries, stats.duration_ms, stats.duplicates,
+            )
+
+        if settings.QUERY_BUDGET_HEADERS:
+            response['X-DB-Queries'] = stats.queries
+            response['X-DB-Time-Ms'] = stats.duration_ms
+            response['X-DB-Duplicate-Queries'] = stats.duplicates
+            if stats.budget is not None:
+                response['X-DB-Query-Budget'] = stats.budget
+        return response
+
+
+class QueryBudgetTestMixin:
+    """
+    TestCase mixin for checking responses that passed through
+    QueryBudgetMiddleware against their view's declared budget.
+    """
+
+    def assertWithinQueryBudget(self, response, budget=None):
+        stats = response.query_stats
+        budget = stats.budget if budget is None else budget
+        if budget is None:
+            self.fail("The view declares no query budget for this action.")
+        if stats.queries > budget:
+            repeated = "\n".join(f"  {count}x {shape}" for shape, count in stats.repeated_shapes())
+            self.fail(f"{stats.queries} queries, budget {budget}. Repeated shapes:\n{repeated or '  none'}")
@@ -0,0 +1,70 @@
+# washint_server/renderers.py
+
+import uuid
+
+import orjson
+from django.http import HttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_encoder = JSONEncoder()
+
+# Datetimes go through DRF's encoder too, so they keep its format
+# (millisecond precision, "Z" for UTC).
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def _default(obj):
+    # Lazy translations, Decimals, datetimes, querysets and other iterables,
+    # exactly as DRF's JSONRenderer would encode them.
+    return _encoder.default(obj)
+
+
+def dumps(data, indent=False):
+    option = ORJSON_OPTIONS | orjson.OPT_INDENT_2 if indent else ORJSON_OPTIONS
+    return orjson.dumps(data, default=_default, option=option)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer on orjson, several times faster on large pages. Output is
+    compact UTF-8 like JSONRenderer's; an `indent` in the accepted media type
+    (as the browsable API asks for) pretty-prints with two spaces.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data, indent=bool(self.get_indent(accepted_media_type, renderer_context or {})))
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack for clients that send `Accept: application/msgpack`. Needs
+    the optional msgpack package; settings only enable it when installed.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        import msgpack
+
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_msgpack_default, use_bin_type=True)
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    return _encoder.default(obj)
+
+
+class ORJSONResponse(HttpResponse):
+    """JsonResponse on orjson, for plain Django views with large payloads."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
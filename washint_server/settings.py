@@ -9,7 +9,11 @@ https://docs.djangoproject.com/en/5.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
+import os
+from importlib.util import find_spec
+
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 from pathlib import Path
 from datetime import timedelta
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,7 +27,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = config('SECRET_KEY')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = config('DEBUG', default=True, cast=bool)
 
 ALLOWED_HOSTS = []
 
@@ -40,6 +44,7 @@ INSTALLED_APPS = [
     'w_server',
     'rest_framework',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'storages',
 
@@ -47,6 +52,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'washint_server.db_router.ReplicaRoutingMiddleware',
+    'washint_server.metrics.MetricsMiddleware',
+    'washint_server.query_budget.QueryBudgetMiddleware',
+    'washint_server.profiling.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # ADD THIS LINE
     'django.middleware.common.CommonMiddleware',
@@ -58,7 +67,7 @@ MIDDLEWARE = [
 
 STORAGES = {
     "default": {
-        "BACKEND": "storages.backends.s3.S3Storage",
+        "BACKEND": "washint_server.storage.InstrumentedS3Storage",
     },
       "staticfiles": {
         "BACKEND": "storages.backends.s3.S3Storage",    },
@@ -106,6 +115,152 @@ DATABASES = {
         'PORT': config('DATABASE_PORT', default='5432'),
     }
 }
+
+# Connection reuse, tuned per worker type. wsgi.py and asgi.py set
+# WASHINT_WORKER_TYPE before settings load. WSGI workers keep one persistent,
+# health-checked connection per thread. ASGI workers serve requests from many
+# threads, so they use a psycopg3 pool instead (requires psycopg[pool]).
+# DATABASE_POOL overrides the choice either way.
+WORKER_TYPE = os.environ.get('WASHINT_WORKER_TYPE', 'wsgi')
+DATABASE_POOL = DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql' and config(
+    'DATABASE_POOL', default=WORKER_TYPE == 'asgi', cast=bool
+)
+if DATABASE_POOL:
+    # Pooled connections must not also be persistent.
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': config('DATABASE_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DATABASE_POOL_MAX_SIZE', default=20 if WORKER_TYPE == 'asgi' else 4, cast=int),
+            # Seconds a request may wait for a free connection before erroring.
+            'timeout': config('DATABASE_POOL_TIMEOUT', default=10, cast=int),
+            # Recycle idle and old connections; the pool only hands out live ones.
+            'max_idle': 300,
+            'max_lifetime': 1800,
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = config(
+        'DATABASE_CONN_MAX_AGE', default=0 if WORKER_TYPE == 'asgi' else 60, cast=int
+    )
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Optional read replica. Safe-method requests read from it (see
+# washint_server/db_router.py); set DATABASE_REPLICA_HOST, or
+# DATABASE_REPLICA_NAME for a second local SQLite file, to enable it. Leave
+# both unset for the test suite: TestCase only wraps the primary in a
+# transaction, so the mirrored replica connection cannot see test data.
+DATABASE_REPLICA_HOST = config('DATABASE_REPLICA_HOST', default='')
+DATABASE_REPLICA_NAME = config('DATABASE_REPLICA_NAME', default='')
+if DATABASE_REPLICA_HOST or DATABASE_REPLICA_NAME:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': DATABASE_REPLICA_NAME or DATABASES['default']['NAME'],
+        'HOST': DATABASE_REPLICA_HOST or DATABASES['default']['HOST'],
+        'PORT': config('DATABASE_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['washint_server.db_router.ReplicaRouter']
+# How long a client keeps reading from the primary after a write.
+DATABASE_REPLICA_STICKY_SECONDS = config('DATABASE_REPLICA_STICKY_SECONDS', default=10, cast=int)
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+# The default cache must be shared by every worker: user and payload
+# invalidation, the token blacklist fast path, single-flight locks and
+# throttles all go through it. LocMemCache is per process, so outside DEBUG
+# it is refused unless CACHE_ALLOW_LOCAL declares a single-process deployment.
+if not DEBUG and CACHES['default']['BACKEND'] in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+) and not config('CACHE_ALLOW_LOCAL', default=False, cast=bool):
+    raise ImproperlyConfigured(
+        "CACHE_BACKEND must be a cache shared by all workers (e.g. "
+        "django.core.cache.backends.redis.RedisCache) when DEBUG is off; "
+        "set CACHE_ALLOW_LOCAL=True for a single-process deployment."
+    )
+
+# Users resolved from JWTs are cached per process for a few seconds and in
+# the shared cache for longer; saving a User clears both.
+JWT_USER_LOCAL_CACHE_TIMEOUT = config('JWT_USER_LOCAL_CACHE_TIMEOUT', default=5, cast=int)
+JWT_USER_CACHE_TIMEOUT = config('JWT_USER_CACHE_TIMEOUT', default=60, cast=int)
+
+# Serialized song, album and artist detail payloads (see w_server.cache).
+# Every save bumps the object's version, so these bound staleness only for
+# bulk updates such as play counts. Payloads carry signed storage URLs, so
+# the shared timeout must stay well below AWS_QUERYSTRING_EXPIRE.
+OBJECT_CACHE_LOCAL_TIMEOUT = config('OBJECT_CACHE_LOCAL_TIMEOUT', default=30, cast=int)
+OBJECT_CACHE_TIMEOUT = config('OBJECT_CACHE_TIMEOUT', default=300, cast=int)
+
+# Search results turn stale after SEARCH_CACHE_TIMEOUT seconds and are served
+# stale for up to SEARCH_CACHE_STALE_TIMEOUT more while one worker refreshes.
+SEARCH_CACHE_TIMEOUT = config('SEARCH_CACHE_TIMEOUT', default=60, cast=int)
+SEARCH_CACHE_STALE_TIMEOUT = config('SEARCH_CACHE_STALE_TIMEOUT', default=300, cast=int)
+
+# Only one worker recomputes an expired cache entry at a time (see
+# w_server.cache.single_flight). Workers with nothing stale to serve poll for
+# its result for up to SINGLE_FLIGHT_WAIT_TIMEOUT seconds; the lock expires
+# after SINGLE_FLIGHT_LOCK_TIMEOUT in case its holder dies.
+SINGLE_FLIGHT_LOCK_TIMEOUT = config('SINGLE_FLIGHT_LOCK_TIMEOUT', default=10, cast=int)
+SINGLE_FLIGHT_WAIT_TIMEOUT = config('SINGLE_FLIGHT_WAIT_TIMEOUT', default=2.0, cast=float)
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+
+# Rows fetched per round trip by the streaming exports (/api/exports/ and
+# the export_catalog command).
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+# /api/sync/ returns at most SYNC_PAGE_SIZE change-log rows per call and
+# holds back rows younger than SYNC_SETTLE_SECONDS, so a slow transaction
+# that commits an older sequence is not skipped. prune_sync_changes deletes
+# rows after SYNC_CHANGE_RETENTION_DAYS; clients further behind resync.
+SYNC_PAGE_SIZE = config('SYNC_PAGE_SIZE', default=500, cast=int)
+SYNC_SETTLE_SECONDS = config('SYNC_SETTLE_SECONDS', default=1.0, cast=float)
+SYNC_CHANGE_RETENTION_DAYS = config('SYNC_CHANGE_RETENTION_DAYS', default=30, cast=int)
+
+# Cached answers of /api/users/check_username/. Saving or deleting a User
+# clears its entry, so taken answers can live long; available answers are
+# kept short as a backstop for usernames changed through queryset updates.
+USERNAME_TAKEN_CACHE_TIMEOUT = 60 * 60
+USERNAME_AVAILABLE_CACHE_TIMEOUT = 60
+
+# A client (user, or IP when anonymous) counts one play per song per window.
+PLAY_EVENT_DEDUPE_SECONDS = config('PLAY_EVENT_DEDUPE_SECONDS', default=30, cast=int)
+
+# Per-request query count, database time and duplicated query shapes, sent
+# as X-DB-* response headers. Viewsets declare budgets in `query_budgets`;
+# requests over budget are logged regardless of this setting.
+QUERY_BUDGET_HEADERS = config('QUERY_BUDGET_HEADERS', default=DEBUG, cast=bool)
+
+# cProfile of sampled requests, plus staff requests sent with an X-Profile
+# header. The newest PROFILING_MAX_PROFILES are kept in PROFILING_DIR and
+# served at /api/request-profiles/. When disabled the middleware is not installed.
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=False, cast=bool)
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.0, cast=float)
+PROFILING_MAX_PROFILES = config('PROFILING_MAX_PROFILES', default=50, cast=int)
+PROFILING_DIR = config('PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+
+# Prometheus metrics at /metrics. Under gunicorn, point METRICS_DIR at a
+# directory shared by the workers (emptied on deploy): each worker writes
+# its totals there every METRICS_FLUSH_INTERVAL seconds and scrapes add
+# them up. Scrapers send METRICS_TOKEN as a bearer token; without one the
+# endpoint is only served in DEBUG.
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=5, cast=int)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Queries slower than the threshold are aggregated per SQL shape into
+# w_server.SlowQuery by a background thread, which also captures EXPLAIN
+# (ANALYZE, BUFFERS) for the top SLOW_QUERY_EXPLAIN_TOP shapes by total
+# time. Report with `manage.py slow_query_report`. Off by default: ANALYZE
+# runs the slowest SELECTs again, so enable it deliberately.
+SLOW_QUERY_LOG_ENABLED = config('SLOW_QUERY_LOG_ENABLED', default=False, cast=bool)
+SLOW_QUERY_THRESHOLD_MS = config('SLOW_QUERY_THRESHOLD_MS', default=200, cast=float)
+SLOW_QUERY_EXPLAIN_TOP = config('SLOW_QUERY_EXPLAIN_TOP', default=20, cast=int)
+
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -156,11 +311,24 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'washint_server.authentication.CachedJWTAuthentication',
         'washint_server.authentication.JWTCookieAuthentication',
     ),
+    # orjson by default; MessagePack on `Accept: application/msgpack` when
+    # the optional msgpack package is installed.
+    'DEFAULT_RENDERER_CLASSES': [
+        'washint_server.renderers.ORJSONRenderer',
+        *(['washint_server.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'washint_server.pagination.MyLimitOffsetPagination',
-    'PAGE_SIZE': 20 
+    'PAGE_SIZE': 20,
+    'DEFAULT_THROTTLE_RATES': {
+        # Token bucket: bursts of up to 30 checks, refilled at 30 per minute.
+        'username_check': config('USERNAME_CHECK_THROTTLE_RATE', default='30/min'),
+        # Play events per client IP (see w_server.views.play_song).
+        'play_event': config('PLAY_EVENT_THROTTLE_RATE', default='60/min'),
+    },
 }
 
 SIMPLE_JWT = {
@@ -168,4 +336,16 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-}
\ No newline at end of file
+    'TOKEN_OBTAIN_SERIALIZER': 'washint_server.tokens.CachedTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'washint_server.tokens.CachedTokenRefreshSerializer',
+}
+
+# Refresh-token blacklist (see washint_server/tokens.py). Blacklisted jtis are
+# always written to the shared cache; database rows are bulk inserted once
+# JWT_BLACKLIST_BATCH_SIZE rows or JWT_BLACKLIST_FLUSH_INTERVAL seconds pile up.
+# Only trust the cache for negative lookups when it is shared between workers
+# and does not evict (e.g. a dedicated Redis), and run `warm_token_blacklist`
+# after it starts empty.
+JWT_BLACKLIST_TRUST_CACHE = config('JWT_BLACKLIST_TRUST_CACHE', default=False, cast=bool)
+JWT_BLACKLIST_BATCH_SIZE = config('JWT_BLACKLIST_BATCH_SIZE', default=1, cast=int)
+JWT_BLACKLIST_FLUSH_INTERVAL = config('JWT_BLACKLIST_FLUSH_INTERVAL', default=5, cast=int)
\ No newline at end of file
@@ -0,0 +1,153 @@
+# washint_server/slow_queries.py
+
+import hashlib
+import logging
+import queue
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .query_budget import query_shape
+
+logger = logging.getLogger(__name__)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LOCKING_CLAUSE = re.compile(r'\bFOR\s+(?:NO\s+KEY\s+UPDATE|KEY\s+SHARE|UPDATE|SHARE)\b', re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """
+    The shape of a statement: placeholder lists collapsed and literals
+    replaced, so the same ORM query always maps to the same shape.
+    """
+    shape = _STRING_LITERAL.sub('?', query_shape(sql))
+    return _NUMBER_LITERAL.sub('?', shape)
+
+
+def fingerprint(shape):
+    return hashlib.sha1(shape.encode()).hexdigest()
+
+
+def explain_sql(vendor, sql):
+    if vendor == 'postgresql':
+        return f'EXPLAIN (ANALYZE, BUFFERS) {sql}'
+    if vendor == 'sqlite':
+        return f'EXPLAIN QUERY PLAN {sql}'
+    return f'EXPLAIN {sql}'
+
+
+class SlowQueryLog:
+    """
+    Execute wrapper that hands queries slower than SLOW_QUERY_THRESHOLD_MS to
+    a background thread. The thread aggregates calls and time per SQL shape
+    into SlowQuery rows and captures an EXPLAIN for shapes that rank in the
+    top SLOW_QUERY_EXPLAIN_TOP by total time, so requests never wait on it.
+    """
+
+    def __init__(self, maxsize=1000):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._local = threading.local()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def install(self, connection):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if duration_ms >= settings.SLOW_QUERY_THRESHOLD_MS and not getattr(self._local, 'busy', False):
+                self.record(context['connection'].alias, sql, None if many else params, duration_ms)
+
+    def record(self, alias, sql, params, duration_ms):
+        try:
+            self._queue.put_nowait((alias, sql, params, duration_ms))
+        except queue.Full:
+            # Dropping samples beats slowing requests down.
+            return
+        self.start_worker()
+
+    def start_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='slow-query-log', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self.process(*item)
+            except Exception:
+                logger.exception("Could not record a slow query")
+            finally:
+                # Connections are per thread, and this one may idle for long.
+                connections.close_all()
+
+    def drain(self):
+        """Processes everything queued in the calling thread."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self.process(*item)
+
+    def process(self, alias, sql, params, duration_ms):
+        from w_server.models import SlowQuery
+
+        self._local.busy = True
+        try:
+            shape = normalize_sql(sql)
+            key = fingerprint(shape)
+            updated = SlowQuery.objects.filter(fingerprint=key).update(
+                calls=F('calls') + 1,
+                total_ms=F('total_ms') + duration_ms,
+                max_ms=Greatest('max_ms', duration_ms),
+                last_seen=timezone.now(),
+            )
+            if not updated:
+                SlowQuery.objects.get_or_create(fingerprint=key, defaults={
+                    'database': alias, 'shape': shape, 'sample_sql': sql,
+                    'calls': 1, 'total_ms': duration_ms, 'max_ms': duration_ms,
+                })
+            if params is not None:
+                self.maybe_explain(SlowQuery.objects.get(fingerprint=key), alias, sql, params)
+        finally:
+            self._local.busy = False
+
+    def maybe_explain(self, slow_query, alias, sql, params):
+        from w_server.models import SlowQuery
+
+        if slow_query.plan or not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            # ANALYZE executes the statement, so writes are never explained.
+            return
+        if _LOCKING_CLAUSE.search(sql):
+            # Nor are locking reads, which would hold row locks until the rollback.
+            return
+        worse = SlowQuery.objects.filter(total_ms__gt=slow_query.total_ms).count()
+        if worse >= settings.SLOW_QUERY_EXPLAIN_TOP:
+            return
+        connection = connections[alias]
+        with transaction.atomic(using=alias):
+            with connection.cursor() as cursor:
+                cursor.execute(explain_sql(connection.vendor, sql), params)
+                rows = cursor.fetchall()
+            # Undo anything the analyzed statement might have done.
+            transaction.set_rollback(True, using=alias)
+        plan = '\n'.join(' '.join(str(column) for column in row) for row in rows)
+        SlowQuery.objects.filter(pk=slow_query.pk).update(plan=plan, plan_captured_at=timezone.now())
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,46 @@
+# washint_server/storage.py
+
+import os
+import threading
+import time
+
+from storages.backends.s3 import S3Storage
+
+from .metrics import registry
+
+# One boto3 session per process, created on first use (after gunicorn has
+# forked, never in the master). Sessions are not thread-safe, so creating
+# resources from it is serialized; the resources themselves stay per thread.
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class InstrumentedS3Storage(S3Storage):
+    """
+    S3Storage that shares one boto3 session per process, so each thread's
+    client reuses the already loaded service models, and records how long
+    signing each URL takes; serializers sign one URL per file field per row,
+    so this adds up on list endpoints.
+    """
+
+    @property
+    def connection(self):
+        if getattr(self._connections, 'connection', None) is None:
+            with _session_lock:
+                return super().connection
+        return self._connections.connection
+
+    def _create_session(self):
+        global _session, _session_pid
+        if _session is None or _session_pid != os.getpid():
+            _session = super()._create_session()
+            _session_pid = os.getpid()
+        return _session
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        started = time.perf_counter()
+        try:
+            return super().url(name, parameters=parameters, expire=expire, http_method=http_method)
+        finally:
+            registry.observe('washint_storage_presign_duration_seconds', {}, time.perf_counter() - started)
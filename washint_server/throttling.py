@@ -0,0 +1,63 @@
+# washint_server/throttling.py
+
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class TokenBucketRateThrottle(SimpleRateThrottle):
+    """
+    A token-bucket take on SimpleRateThrottle. The rate's request count is the
+    bucket size and the bucket refills evenly over the rate's duration, so
+    short bursts are allowed while the sustained rate stays capped. Bucket
+    state lives in the shared cache as a (tokens, updated_at) pair.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        refill_per_second = self.num_requests / self.duration
+        tokens, updated_at = self.cache.get(self.key, (self.num_requests, self.now))
+        tokens = min(self.num_requests, tokens + (self.now - updated_at) * refill_per_second)
+
+        if tokens < 1:
+            self.wait_seconds = (1 - tokens) / refill_per_second
+            self.cache.set(self.key, (tokens, self.now), self.duration)
+            return False
+
+        self.cache.set(self.key, (tokens - 1, self.now), self.duration)
+        return True
+
+    def wait(self):
+        return getattr(self, 'wait_seconds', None)
+
+
+class ClientIPTokenBucketThrottle(TokenBucketRateThrottle):
+    """
+    A token bucket per client IP, whether or not the request is authenticated.
+    Only reads request.META, so plain Django views can call allow_request too.
+    """
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': self.get_ident(request),
+        }
+
+
+class UsernameCheckThrottle(ClientIPTokenBucketThrottle):
+    """
+    Throttles the anonymous username availability check per client IP.
+    """
+    scope = 'username_check'
+
+
+class PlayEventThrottle(ClientIPTokenBucketThrottle):
+    """
+    Throttles play events per client IP, so loops cannot inflate play counts.
+    """
+    scope = 'play_event'
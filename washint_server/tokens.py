@@ -0,0 +1,233 @@
+# washint_server/tokens.py
+
+import atexit
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow, datetime_from_epoch
+
+from w_server.cache import user_cache
+
+BLACKLIST_KEY_PREFIX = 'jwt-blacklist'
+# Set by `warm_token_blacklist` once every unexpired blacklisted jti is in the cache.
+BLACKLIST_WARM_KEY = f'{BLACKLIST_KEY_PREFIX}:warm'
+
+
+def blacklist_key(jti):
+    return f'{BLACKLIST_KEY_PREFIX}:{jti}'
+
+
+def seconds_until(exp):
+    return max(int(exp - time.time()), 1)
+
+
+class TokenWriteBuffer:
+    """
+    Collects outstanding and blacklisted token rows and writes them with
+    bulk inserts, either once `batch_size` rows are pending or once the oldest
+    pending row is `flush_interval` seconds old.
+    """
+
+    def __init__(self, batch_size, flush_interval):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._outstanding = {}
+        self._blacklisted = set()
+        self._first_pending_at = None
+        self._lock = threading.Lock()
+
+    def add_outstanding(self, jti, user_id, token, created_at, expires_at):
+        with self._lock:
+            self._outstanding.setdefault(jti, {
+                'jti': jti,
+                'user_id': user_id,
+                'token': token,
+                'created_at': created_at,
+                'expires_at': expires_at,
+            })
+            self._mark_pending()
+        self.flush_if_due()
+
+    def add_blacklisted(self, jti):
+        with self._lock:
+            self._blacklisted.add(jti)
+            self._mark_pending()
+        self.flush_if_due()
+
+    def is_pending_blacklist(self, jti):
+        with self._lock:
+            return jti in self._blacklisted
+
+    def _mark_pending(self):
+        if self._first_pending_at is None:
+            self._first_pending_at = time.monotonic()
+
+    def flush_if_due(self):
+        with self._lock:
+            pending = len(self._outstanding) + len(self._blacklisted)
+            if not pending:
+                return
+            age = time.monotonic() - self._first_pending_at
+            if pending < self.batch_size and age < self.flush_interval:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            outstanding, self._outstanding = self._outstanding, {}
+            blacklisted, self._blacklisted = self._blacklisted, set()
+            self._first_pending_at = None
+
+        if outstanding:
+            # Tokens can outlive their user; drop the FK instead of failing the batch.
+            user_ids = {row['user_id'] for row in outstanding.values() if row['user_id'] is not None}
+            existing_users = {
+                str(pk) for pk in get_user_model().objects.filter(pk__in=user_ids).values_list('pk', flat=True)
+            }
+            for row in outstanding.values():
+                if str(row['user_id']) not in existing_users:
+                    row['user_id'] = None
+            OutstandingToken.objects.bulk_create(
+                [OutstandingToken(**row) for row in outstanding.values()],
+                ignore_conflicts=True,
+            )
+
+        if blacklisted:
+            token_ids = OutstandingToken.objects.filter(jti__in=blacklisted).values_list('id', flat=True)
+            BlacklistedToken.objects.bulk_create(
+                [BlacklistedToken(token_id=token_id) for token_id in token_ids],
+                ignore_conflicts=True,
+            )
+
+
+token_buffer = TokenWriteBuffer(
+    batch_size=getattr(settings, 'JWT_BLACKLIST_BATCH_SIZE', 1),
+    flush_interval=getattr(settings, 'JWT_BLACKLIST_FLUSH_INTERVAL', 5),
+)
+atexit.register(token_buffer.flush)
+
+
+def is_blacklisted(jti):
+    """
+    Positive answers come from the shared cache. Negative answers come from
+    the cache only when JWT_BLACKLIST_TRUST_CACHE is on and the cache has been
+    warmed; otherwise the database decides.
+    """
+    if cache.get(blacklist_key(jti)) is not None:
+        return True
+    if token_buffer.is_pending_blacklist(jti):
+        return True
+    if getattr(settings, 'JWT_BLACKLIST_TRUST_CACHE', False) and cache.get(BLACKLIST_WARM_KEY):
+        return False
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+def warm_blacklist_cache(chunk_size=5000):
+    """
+    Copies every unexpired blacklisted jti into the shared cache and marks the
+    cache as warm. Returns the number of jtis cached.
+    """
+    rows = (
+        BlacklistedToken.objects.filter(token__expires_at__gt=aware_utcnow())
+        .order_by()
+        .values_list('token__jti', 'token__expires_at')
+    )
+    cached = 0
+    chunk = {}
+    latest_exp = 0
+    for jti, expires_at in rows.iterator(chunk_size=chunk_size):
+        chunk[blacklist_key(jti)] = True
+        latest_exp = max(latest_exp, expires_at.timestamp())
+        if len(chunk) >= chunk_size:
+            cache.set_many(chunk, seconds_until(latest_exp))
+            cached += len(chunk)
+            chunk, latest_exp = {}, 0
+    if chunk:
+        cache.set_many(chunk, seconds_until(latest_exp))
+        cached += len(chunk)
+
+    cache.set(BLACKLIST_WARM_KEY, True, None)
+    return cached
+
+
+class CachedRefreshToken(RefreshToken):
+    """
+    A refresh token whose blacklist checks go through the shared cache and
+    whose outstanding/blacklisted rows are written through `token_buffer`.
+    """
+
+    def check_blacklist(self):
+        if is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        exp = self.payload['exp']
+        cache.set(blacklist_key(jti), True, seconds_until(exp))
+        self.outstand()
+        token_buffer.add_blacklisted(jti)
+
+    def outstand(self):
+        token_buffer.add_outstanding(
+            jti=self.payload[api_settings.JTI_CLAIM],
+            user_id=self.payload.get(api_settings.USER_ID_CLAIM),
+            token=str(self),
+            created_at=self.current_time,
+            expires_at=datetime_from_epoch(self.payload['exp']),
+        )
+
+    @classmethod
+    def for_user(cls, user):
+        # Skip BlacklistMixin.for_user, which inserts the outstanding row immediately.
+        token = super(BlacklistMixin, cls).for_user(user)
+        token.outstand()
+        return token
+
+
+class CachedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = CachedRefreshToken
+
+
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = CachedRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM, None)
+        if user_id:
+            user = user_cache.get(user_id)
+            if user is None:
+                user = get_user_model().objects.get(**{api_settings.USER_ID_FIELD: user_id})
+                user_cache.set(user_id, copy.copy(user))
+            if not api_settings.USER_AUTHENTICATION_RULE(user):
+                raise AuthenticationFailed(
+                    self.error_messages['no_active_account'],
+                    'no_active_account',
+                )
+
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+
+            data['refresh'] = str(refresh)
+
+        return data
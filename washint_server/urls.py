@@ -34,11 +34,27 @@ album_router.register(r'songs', AlbumSongViewSets, basename='album-songs')
 artists_router = routers.NestedSimpleRouter(router, r'artists', lookup='artist')
 artists_router.register(r'songs', ArtistSongViewSets, basename='artist-songs')
 
-api_url_patterns = router.urls + playlists_router.urls + album_router.urls + artists_router.urls
+# Async views. Listed before the routers so `follows/is-following/` is not
+# taken for a follow's primary key.
+async_url_patterns = [
+    path('follows/is-following/', views.is_following, name='follow-is-following'),
+    path('songs/<uuid:pk>/media/', views.song_media, name='song-media'),
+    path('albums/<uuid:pk>/media/', views.album_media, name='album-media'),
+]
+
+api_url_patterns = async_url_patterns + router.urls + playlists_router.urls + album_router.urls + artists_router.urls
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/search/', views.search, name='api-search'),
+    path('api/songs/<uuid:pk>/play/', views.play_song, name='api-song-play'),
+    path('api/db-pool-stats/', views.db_pool_stats, name='api-db-pool-stats'),
+    path('api/exports/<slug:kind>/', views.export, name='api-export'),
+    path('api/sync/', views.sync, name='api-sync'),
+    path('api/cache-stats/', views.cache_stats, name='api-cache-stats'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
+    path('api/request-profiles/', views.profiles, name='api-request-profiles'),
+    path('api/request-profiles/<str:profile_id>/', views.profile_download, name='api-request-profile-download'),
     path('api/', include(api_url_patterns)),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
@@ -12,5 +12,6 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'washint_server.settings')
+os.environ.setdefault('WASHINT_WORKER_TYPE', 'wsgi')
 
 application = get_wsgi_application()